@@ -4,6 +4,7 @@ import pandas as pd
 import torch
 import torch.nn as nn
 from fedflow import Task
+from fedflow.utils.aggregate import FedAvgAggregator, ParallelFedAvgAggregator
 from fedflow.utils.trainer import SupervisedTrainer
 
 from cifar_dataset import CifarDataset
@@ -12,28 +13,27 @@ from cifar_net import CifarNet
 
 class AggregateTask(Task):
 
-    def __init__(self, sample_dir, tasks):
+    def __init__(self, sample_dir, tasks, processes=1):
         super(AggregateTask, self).__init__()
         self.sample_dir = sample_dir
         self.tasks = tasks
-        self.parameters = []
+        self.processes = processes
 
     def load(self) -> None:
         # Nothing to do
         pass
 
     def train(self, device) -> dict:
+        if self.processes > 1:
+            aggregator = ParallelFedAvgAggregator(self.processes)
+        else:
+            aggregator = FedAvgAggregator()
         for t in self.tasks:
             task: Task = t
             path = os.path.join(task.workdir, "parameter.pth")
-            self.parameters.append(torch.load(path, map_location=device))
-
-        avg_parameter = self.parameters[0]
-        for key in avg_parameter.keys():
-            for i in range(1, len(self.parameters)):
-                avg_parameter[key] += self.parameters[i][key]
-            avg_parameter[key] = torch.div(avg_parameter[key], len(self.parameters))
-        torch.save(avg_parameter, "aggregate.pth")
+            # weight every client by the number of its train samples
+            aggregator.add(path, weight=task.result.get("samples", 1))
+        torch.save(aggregator.result(), "aggregate.pth")
 
         return self.test(device=device)
 
@@ -0,0 +1,46 @@
+try:
+    import fedflow
+except:
+    import os
+    import sys
+    root_dir = os.path.abspath(os.path.dirname(__file__))
+    root_dir = os.path.dirname(os.path.dirname(root_dir))
+    fedflow_dir = os.path.join(root_dir, "src")
+    sys.path.insert(0, fedflow_dir)
+
+import os
+import shutil
+
+from fedflow import FedFlow, TaskGroup
+from fedflow.utils.aggregate import BufferedAsyncAggregator
+
+from cifar_net import CifarNet
+from split_task import SplitTask
+from train_task import TrainTask
+
+
+if __name__ == "__main__":
+    split_task = SplitTask()
+    with FedFlow() as flow:
+        flow.execute_task(split_task)
+
+    sample_dir = split_task.workdir
+
+    # a new global version is published after every 5 client updates, the updates older than 10 versions are dropped.
+    aggregator = BufferedAsyncAggregator(os.path.join(os.path.dirname(sample_dir), "async-global"),
+                                         CifarNet().state_dict(),
+                                         buffer_size=5,
+                                         max_versions=100,
+                                         max_staleness=10)
+
+    group = TaskGroup("async-train")
+    group.add_task_source(aggregator.client_source(
+        lambda i: TrainTask("client-%d" % i, sample_dir, sample_id=i % 10, async_dir=aggregator.directory)))
+    group.add_finish_callback(aggregator.on_finish)
+    with FedFlow() as flow:
+        flow.execute(group)
+    aggregator.flush()
+
+    shutil.copyfile(aggregator.latest_path(), "async-final.pth")
+    print("version: %d, accepted updates: %d, dropped updates: %d" %
+          (aggregator.version, aggregator.accepted, aggregator.dropped))
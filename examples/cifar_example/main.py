@@ -50,15 +50,16 @@ if __name__ == "__main__":
         with FedFlow() as flow:
             flow.execute(train_group)
 
-        if pre_aggregate_group is not None:
-            remove_path(pre_aggregate_group.workdir)
-
         aggregate_group = TaskGroup("aggregate-%d" % (i + 1))
         aggregate_task = AggregateTask(split_task.workdir, train_tasks)
         aggregate_group.add_task(aggregate_task)
         with FedFlow() as flow:
             flow.execute(aggregate_group)
 
+        # the compressed client updates are decoded by the previous global model, remove it after aggregating.
+        if pre_aggregate_group is not None:
+            remove_path(pre_aggregate_group.workdir)
+
         acc_history.append(aggregate_task.get_item("acc"))
 
         pre_aggregate_group = aggregate_group
@@ -3,6 +3,7 @@ import os
 import pandas as pd
 import torch.nn as nn
 from fedflow import Task
+from fedflow.utils.aggregate import BufferedAsyncAggregator
 from fedflow.utils.trainer import SupervisedTrainer
 from torch.optim import SGD
 from torch.optim.lr_scheduler import MultiStepLR
@@ -13,10 +14,18 @@ from cifar_net import CifarNet
 
 class TrainTask(Task):
 
-    def __init__(self, task_id, sample_dir: Task, aggregate_dir: Task = None):
+    def __init__(self, task_id, sample_dir: Task, aggregate_dir: Task = None, *, sample_id=None, client_id=None,
+                 async_dir=None, compression=None):
         super(TrainTask, self).__init__(task_id=str(task_id))
         self.sample_dir = sample_dir
         self.aggregate_dir = aggregate_dir
+        self.sample_id = sample_id if sample_id is not None else task_id
+        # the client is identified by its samples by default, it keeps the compression error across rounds.
+        self.client_id = client_id if client_id is not None else self.sample_id
+        # the directory of global versions in asynchronous mode
+        self.async_dir = async_dir
+        # the compression method of client updates, such as "int8" or "topk"
+        self.compression = compression
 
     def load(self) -> None:
         self.model = CifarNet()
@@ -24,13 +33,17 @@ class TrainTask(Task):
         self.lr_scheduler = MultiStepLR(self.optimizer, [10, 30, 60, 90])
         self.criterion = nn.CrossEntropyLoss()
         # Load dataset
-        sample_path = os.path.join(self.sample_dir, "sample-%s.csv" % self.task_id)
+        sample_path = os.path.join(self.sample_dir, "sample-%s.csv" % self.sample_id)
         df = pd.read_csv(sample_path, header=None)
         data = df.values.tolist()
         self.dataset = CifarDataset(data)
 
     def train(self, device: str) -> dict:
-        if self.aggregate_dir is not None:
+        base_version = None
+        if self.async_dir is not None:
+            # start from the latest global version
+            base_version, pre_model_path = BufferedAsyncAggregator.checkout(self.async_dir)
+        elif self.aggregate_dir is not None:
             pre_model_path = os.path.join(self.aggregate_dir, "aggregate.pth")
         else:
             pre_model_path = None
@@ -38,7 +51,10 @@ class TrainTask(Task):
                                          epoch=10,
                                          device=device,
                                          init_model_path=pre_model_path,
-                                         console_out="console.out")
+                                         console_out="console.out",
+                                         update_compression=self.compression,
+                                         error_feedback_path=os.path.join(self.sample_dir,
+                                                                          "residual-%s.pth" % self.client_id))
 
         _, correct, total = self.trainer.test(pre_model_path, self.dataset)
         ret = {
@@ -48,4 +64,6 @@ class TrainTask(Task):
         self.trainer.mount_dataset(self.dataset)
 
         ret.update(self.trainer.train())
+        if base_version is not None:
+            ret["base_version"] = base_version
         return ret
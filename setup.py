@@ -24,7 +24,7 @@ setuptools.setup(
     package_dir={"": "src"},
     package_data={'': ['resources/*']},
     packages=setuptools.find_packages(where="src"),
-    python_requires=">=3.4",
+    python_requires=">=3.8",
     install_requires=[
         "ngpuinfo==0.1.0",
         "psutil",
@@ -35,8 +35,8 @@ setuptools.setup(
     ],
     extras_requires={
         "pytorch": [
-            "torch>=1.4.0",
-            "torchvision>=0.5.0"
+            "torch>=2.1.0",
+            "torchvision>=0.16.0"
         ]
     }
 
@@ -10,3 +10,12 @@ if __name__ == "__main__":
                 Config.generate_config(sys.argv[2])
             else:
                 Config.generate_config(None)
+        elif sys.argv[1] == "agent":
+            # python -m fedflow agent [host:port] [workdir]
+            from fedflow.core.cluster import Agent
+            if len(sys.argv) > 2:
+                host, port = sys.argv[2].rsplit(":", 1)
+            else:
+                host, port = Config.get_property("cluster.host"), Config.get_property("cluster.port")
+            workdir = sys.argv[3] if len(sys.argv) > 3 else None
+            Agent(host, int(port), workdir).run()
@@ -6,6 +6,9 @@ This package is the core of fedflow.
 """
 
 __all__ = [
+    "cache",
+    "cluster",
+    "journal",
     "message",
     "scheduler",
     "task",
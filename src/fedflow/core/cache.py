@@ -0,0 +1,303 @@
+"""
+Result cache
+=============
+
+The content-hash memoization of task results.
+
+A task can be cached only if it declares its parameters by overwriting ``Task.cache_parameters``. The cache key of a
+task is the hash of its code identity, its declared parameters and the content of its declared input files
+(``Task.cache_inputs``). When a task hits the cache, the scheduler skips the subprocess entirely, and restores
+``result``, ``items`` and the declared output files(``Task.cache_outputs``) from the cache directory.
+"""
+
+__all__ = [
+    "ResultCache"
+]
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+
+from fedflow.config import Config
+from fedflow.core.task import Task
+from fedflow.units import ByteUnits
+
+
+class ResultCache(object):
+
+    """
+    A local directory of cached task results with size-bounded LRU eviction.
+
+    Every entry is a directory named by the cache key, which contains a ``meta.pkl`` file and an ``outputs`` directory.
+    The modification time of ``meta.pkl`` is used as the last access time. The sizes and access order of entries are
+    loaded once when the cache is constructed and kept in memory, so storing and evicting don't scan the directory.
+    The entries are written by a background thread, so the finished messages of tasks are not blocked by copying their
+    outputs, ``flush`` waits for the pending entries.
+    """
+
+    logger = logging.getLogger("fedflow.cache")
+
+    META_FILE = "meta.pkl"
+    OUTPUTS_DIR = "outputs"
+
+    def __init__(self, directory: str = None, max_size: Union[int, str] = None):
+        """
+        Construct a result cache.
+
+        :param directory: the cache directory, the relative path is relative to workdir. Default is the value of
+            ``cache.directory``.
+        :param max_size: the maximum size of cache, default is the value of ``cache.max-size``.
+        """
+        super(ResultCache, self).__init__()
+        if directory is None:
+            directory = Config.get_property("cache.directory")
+        if not os.path.isabs(directory):
+            directory = os.path.join(Config.get_property("workdir"), directory)
+        self.directory = os.path.abspath(directory)
+        if max_size is None:
+            max_size = Config.get_property("cache.max-size")
+        if type(max_size) == str:
+            v, u = ByteUnits.parse(max_size)
+            max_size = ByteUnits.convert(u, ByteUnits.B, v)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+        # task id -> cache key, the tasks missed cache and waiting for storing, the key is reused if a task is re-picked
+        self.__keys = {}
+        # task class -> the identity of its code
+        self.__identities = {}
+        # (path, size, mtime) -> sha256 of file content
+        self.__fingerprints = {}
+        self.__lock = threading.Lock()
+        # cache key -> entry size, ordered from the least recently used to the most recently used
+        self.__index = OrderedDict()
+        self.__total = 0
+        self.__load_index()
+        # the entries waiting for being written by worker thread
+        self.__queue = queue.Queue()
+        self.__worker = None
+
+    @property
+    def size(self) -> int:
+        """
+        The total size of cached entries.
+
+        :return: bytes
+        """
+        return self.__total
+
+    def __load_index(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, name, self.META_FILE)
+            if not os.path.exists(meta_path):
+                continue
+            try:
+                with open(meta_path, "rb") as f:
+                    size = pickle.load(f)["size"]
+                entries.append((os.path.getmtime(meta_path), size, name))
+            except Exception:
+                continue
+        entries.sort()
+        for _, size, name in entries:
+            self.__index[name] = size
+            self.__total += size
+
+    def __touch(self, key: str, size: int) -> None:
+        with self.__lock:
+            if key in self.__index:
+                self.__index.move_to_end(key)
+            else:
+                # the entry may be stored by another process
+                self.__index[key] = size
+                self.__total += size
+
+    def key(self, task: Task) -> Union[str, None]:
+        """
+        Compute the cache key of task.
+
+        :param task: the task.
+        :return: a hex string, or None if the task cannot be cached.
+        """
+        parameters = task.cache_parameters()
+        if parameters is None:
+            return None
+        identity = {
+            "code": self.__code_identity(type(task)),
+            "parameters": parameters,
+            "inputs": [(os.path.abspath(p), self.__fingerprint(p)) for p in task.cache_inputs()]
+        }
+        s = json.dumps(identity, sort_keys=True, default=repr)
+        return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+    def restore(self, task: Task) -> Union[dict, None]:
+        """
+        Restore the result and output files of task if it hits cache. The output files are copied into the workdir of
+        task.
+
+        :param task: the task which hasn't started.
+        :return: the report data of the cached run, or None if missed.
+        """
+        key = self.__keys.get(task.task_id)
+        if key is None:
+            key = self.key(task)
+            if key is None:
+                return None
+        entry = os.path.join(self.directory, key)
+        meta_path = os.path.join(entry, self.META_FILE)
+        if not os.path.exists(meta_path):
+            self.__keys[task.task_id] = key
+            self.logger.info("{%s} cache missed.", task.task_id)
+            return None
+        self.__keys.pop(task.task_id, None)
+        with open(meta_path, "rb") as f:
+            meta = pickle.load(f)
+        os.utime(meta_path)
+        self.__touch(key, meta["size"])
+        report = meta["report"]
+        task.recover(meta["result"], meta["items"], report.get("load_time", -1), report.get("train_time", -1))
+        os.makedirs(task.workdir, exist_ok=True)
+        outputs = os.path.join(entry, self.OUTPUTS_DIR)
+        for name in meta["outputs"]:
+            src = os.path.join(outputs, name)
+            dst = os.path.join(task.workdir, name)
+            self.__copy(src, dst)
+        self.logger.info("{%s} cache hit[%s].", task.task_id, key)
+        return report
+
+    def store(self, task: Task, report: dict) -> None:
+        """
+        Store the result and output files of a finished task, then evict the least recently used entries if the cache
+        is larger than ``max_size``. The entry is written by a worker thread, this method returns immediately.
+
+        :param task: the finished task.
+        :param report: the report data of task.
+        :return:
+        """
+        key = self.__keys.pop(task.task_id, None)
+        if key is None:
+            return
+        with self.__lock:
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run, name="result-cache", daemon=True)
+                self.__worker.start()
+        self.__queue.put((task.task_id, key, task.workdir, list(task.cache_outputs()), {
+            "report": report,
+            "result": task.result,
+            "items": task.items
+        }))
+
+    def flush(self) -> None:
+        """
+        Wait for the entries queued by ``store``.
+
+        :return:
+        """
+        self.__queue.join()
+
+    def __run(self):
+        while True:
+            task_id, key, workdir, outputs, meta = self.__queue.get()
+            try:
+                self.__write_entry(task_id, key, workdir, outputs, meta)
+                self.evict()
+            except Exception:
+                self.logger.error("{%s} failed to store cache.", task_id, exc_info=True)
+            finally:
+                self.__queue.task_done()
+
+    def __write_entry(self, task_id, key, workdir, outputs, meta):
+        entry = os.path.join(self.directory, key)
+        if os.path.exists(entry):
+            return
+        tmp_entry = "%s.tmp-%d" % (entry, os.getpid())
+        try:
+            os.makedirs(tmp_entry, exist_ok=True)
+            for name in outputs:
+                src = os.path.join(workdir, name)
+                if not os.path.exists(src):
+                    self.logger.warning("{%s} output %s not exists, skip caching.", task_id, name)
+                    return
+                self.__copy(src, os.path.join(tmp_entry, self.OUTPUTS_DIR, name))
+            meta.update({
+                "outputs": outputs,
+                "size": self.__size(tmp_entry),
+                "time": time.time()
+            })
+            with open(os.path.join(tmp_entry, self.META_FILE), "wb") as f:
+                pickle.dump(meta, f)
+            os.rename(tmp_entry, entry)
+            self.__touch(key, meta["size"])
+            self.logger.info("{%s} stored in cache[%s].", task_id, key)
+        finally:
+            if os.path.exists(tmp_entry):
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache size is not larger than ``max_size``.
+
+        :return:
+        """
+        with self.__lock:
+            while self.__total > self.max_size and len(self.__index) > 0:
+                name, size = self.__index.popitem(last=False)
+                self.__total -= size
+                self.logger.info("evict cache[%s].", name)
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def __code_identity(self, cls) -> list:
+        identity = self.__identities.get(cls)
+        if identity is not None:
+            return identity
+        identity = []
+        for c in cls.__mro__:
+            if c is Task or c is object:
+                break
+            try:
+                source = inspect.getsource(c)
+            except (OSError, TypeError):
+                source = ""
+            identity.append((c.__module__, c.__qualname__, hashlib.sha256(source.encode("utf-8")).hexdigest()))
+        self.__identities[cls] = identity
+        return identity
+
+    def __fingerprint(self, path: str):
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            return [(name, self.__fingerprint(os.path.join(path, name))) for name in sorted(os.listdir(path))]
+        stat = os.stat(path)
+        k = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self.__fingerprints.get(k)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self.__fingerprints[k] = digest
+        return digest
+
+    def __copy(self, src: str, dst: str) -> None:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, dirs_exist_ok=True)
+        else:
+            shutil.copy2(src, dst)
+
+    def __size(self, path: str) -> int:
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
@@ -0,0 +1,592 @@
+"""
+Cluster
+========
+
+Classes in this source file are used for running tasks on several hosts.
+
+Every host runs a worker agent(``python -m fedflow agent <host>:<port>``), the agent connects to the coordinator(the
+main process of fedflow, it listens on ``cluster.host:cluster.port`` when ``cluster.enable`` is true), advertises its
+resources periodically, starts task processes on demand and forwards messages between task processes and the
+coordinator. ``GroupScheduler`` dispatches tasks to agents as if they were local processes.
+
+The agent and the coordinator authenticate each other by an HMAC challenge-response with ``cluster.token``(it's never
+sent, and the coordinator refuses to start without it). After that the messages are serialized by pickle, so the token
+must be kept secret and the hosts should be deployed in a trusted network. All hosts must be able to import the code of
+tasks, and the tasks which read the outputs of other tasks need a shared workdir(such as NFS).
+"""
+
+__all__ = [
+    "Agent",
+    "Coordinator",
+    "RemotePipe",
+    "RemoteWorker"
+]
+
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import struct
+import threading
+import time
+import uuid
+from typing import Union
+
+import psutil
+from ngpuinfo import NGPUInfo
+
+from fedflow.config import Config
+from fedflow.core.message import Message, MessageListener
+from fedflow.core.task import TaskStatus
+
+
+__HEADER = struct.Struct("!cI")
+
+
+def send_frame(sock: socket.socket, obj, raw: bool = False) -> None:
+    """
+    send an object through socket.
+
+    :param sock: the connected socket.
+    :param obj: the object to be sent.
+    :param raw: serialize object by json instead of pickle, it is used in handshake.
+    :return:
+    """
+    if raw:
+        payload = json.dumps(obj).encode("utf-8")
+    else:
+        payload = pickle.dumps(obj)
+    sock.sendall(__HEADER.pack(b"J" if raw else b"P", len(payload)) + payload)
+
+
+def auth_digest(token: str, role: str, agent_nonce: str, coordinator_nonce: str) -> str:
+    """
+    the proof of ``cluster.token`` in handshake, the role makes the proofs of two sides different, so a proof cannot be
+    reflected back to its sender.
+
+    :param token: the shared token.
+    :param role: ``"agent"`` or ``"coordinator"``.
+    :param agent_nonce: the random challenge sent by agent.
+    :param coordinator_nonce: the random challenge sent by coordinator.
+    :return: a hex string.
+    """
+    msg = "%s:%s:%s" % (role, agent_nonce, coordinator_nonce)
+    return hmac.new(token.encode("utf-8"), msg.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def recv_frame(sock: socket.socket, allow_pickle: bool = True):
+    """
+    receive an object from socket.
+
+    :param sock: the connected socket.
+    :param allow_pickle: if it's false, only the json frame is accepted.
+    :return: the object, or None if the connection is closed.
+    """
+    header = __recv_exactly(sock, __HEADER.size)
+    if header is None:
+        return None
+    kind, length = __HEADER.unpack(header)
+    payload = __recv_exactly(sock, length)
+    if payload is None:
+        return None
+    if kind == b"J":
+        return json.loads(payload.decode("utf-8"))
+    if not allow_pickle:
+        raise ValueError("pickle frame is not allowed before handshake.")
+    return pickle.loads(payload)
+
+
+def __recv_exactly(sock: socket.socket, n: int) -> Union[bytes, None]:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if len(chunk) == 0:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def local_resources() -> dict:
+    """
+    The resources snapshot of current host.
+
+    :return: a dict ``{"cpu_percent": ..., "memory_total": ..., "memory_available": ..., "gpus": [...]}``
+    """
+    mem = psutil.virtual_memory()
+    gpus = []
+    try:
+        for gpu in NGPUInfo.list_gpus():
+            gpus.append({
+                "id": gpu.id,
+                "mem_total": gpu.mem_total(),
+                "mem_free": gpu.mem_free()
+            })
+    except Exception:
+        logging.getLogger("fedflow.cluster").debug("cannot list gpus.", exc_info=True)
+    return {
+        "cpu_percent": psutil.cpu_percent(),
+        "memory_total": mem.total,
+        "memory_available": mem.available,
+        "gpus": gpus
+    }
+
+
+class RemotePipe(object):
+
+    """
+    The main process side pipe of a task running on agent, it has the same ``send``/``close`` interface as the
+    connection of ``multiprocessing.Pipe``.
+    """
+
+    def __init__(self, worker, task_id: Union[int, str]):
+        super(RemotePipe, self).__init__()
+        self.worker = worker
+        self.task_id = task_id
+        self.closed = False
+
+    def send(self, msg: Message) -> None:
+        self.worker.send("PIPE", {
+            "task_id": self.task_id,
+            "message": msg
+        })
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class RemoteWorker(object):
+
+    """
+    The coordinator side view of a connected agent.
+    """
+
+    logger = logging.getLogger("fedflow.cluster")
+
+    def __init__(self, sock: socket.socket, name: str, workdir: str, resources: dict):
+        super(RemoteWorker, self).__init__()
+        self.sock = sock
+        self.name = name
+        self.workdir = workdir
+        self.resources = resources
+        self.alive = True
+        # the latest reported status of tasks whose process is running on this agent
+        self.tasks = {}
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return "RemoteWorker(%s)" % self.name
+
+    def send(self, cmd: str, data: dict) -> None:
+        """
+        send a command to agent, the command will be dropped if the agent has disconnected.
+
+        :param cmd: command
+        :param data: payload data
+        :return:
+        """
+        if not self.alive:
+            self.logger.warning("agent %s has disconnected, drop %s command.", self.name, cmd)
+            return
+        try:
+            with self.__lock:
+                send_frame(self.sock, Message(source="", cmd=cmd, data=data))
+        except OSError:
+            self.logger.error("failed to send %s command to agent %s.", cmd, self.name, exc_info=True)
+
+    def start_task(self, task, relpath: str) -> RemotePipe:
+        """
+        start a task process on agent.
+
+        :param task: the task to be started, it must can be pickled.
+        :param relpath: the directory(relative to workdir) where task workdir is created in.
+        :return: the pipe used for sending commands to task process.
+        """
+        self.tasks[task.task_id] = TaskStatus.INIT
+        self.send("START", {
+            "task": task,
+            "relpath": relpath
+        })
+        return RemotePipe(self, task.task_id)
+
+    def relpath(self, path: str) -> str:
+        """
+        get the path relative to the workdir of main process, the same relative path is used on agent.
+
+        :param path: a directory in workdir of main process.
+        :return: the relative path.
+        """
+        relpath = os.path.relpath(os.path.abspath(path), Coordinator.workdir)
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            raise ValueError("%s is not in workdir %s." % (path, Coordinator.workdir))
+        return relpath
+
+    def task_workdir(self, relpath: str, task_id: Union[int, str]) -> str:
+        return os.path.normpath(os.path.join(self.workdir, relpath, str(task_id)))
+
+    def is_running(self, task_id: Union[int, str]) -> bool:
+        return self.alive and task_id in self.tasks
+
+
+class Coordinator(object):
+
+    """
+    The server side of cluster, it accepts agents and receives messages from remote tasks.
+    """
+
+    logger = logging.getLogger("fedflow.cluster")
+
+    # the absolute workdir of main process, task directories on agents are created relative to it
+    workdir = None
+
+    __server = None
+    __workers = {}
+    __lock = threading.Lock()
+
+    # the keys of resources snapshot used by scheduler
+    RESOURCE_KEYS = ("cpu_percent", "memory_total", "memory_available", "gpus")
+    # the seconds waiting for messages of handshake
+    HANDSHAKE_TIMEOUT = 30
+
+    @classmethod
+    def start(cls, host: str = None, port: int = None, workdir: str = None) -> tuple:
+        """
+        start listening for agents.
+
+        An exception will be threw if ``cluster.token`` is empty, because the messages after handshake are unpickled
+        and an unauthenticated peer could run arbitrary code.
+
+        :param host: the listening host, default is ``cluster.host``.
+        :param port: the listening port, default is ``cluster.port``, 0 means a random free port.
+        :param workdir: the workdir of main process, default is ``workdir``. A relative path is resolved against the
+            current directory.
+        :return: the address ``(host, port)`` actually listened.
+        """
+        if cls.__server is not None:
+            return cls.__server.getsockname()[:2]
+        if workdir is None:
+            workdir = Config.get_property("workdir")
+        cls.workdir = os.path.abspath(workdir)
+        if not Config.get_property("cluster.token"):
+            raise ValueError("cluster.token must be set when cluster is enabled.")
+        if host is None:
+            host = Config.get_property("cluster.host")
+        if port is None:
+            port = Config.get_property("cluster.port")
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen()
+        cls.__server = server
+        t = threading.Thread(target=cls.__accept, args=(server,), daemon=True)
+        t.start()
+        address = server.getsockname()[:2]
+        cls.logger.info("coordinator listening on %s:%d", address[0], address[1])
+        return address
+
+    @classmethod
+    def stop(cls) -> None:
+        """
+        stop listening and disconnect all agents.
+
+        :return:
+        """
+        if cls.__server is None:
+            return
+        cls.__server.close()
+        cls.__server = None
+        with cls.__lock:
+            workers = list(cls.__workers.values())
+            cls.__workers.clear()
+        for worker in workers:
+            worker.alive = False
+            try:
+                worker.sock.shutdown(socket.SHUT_RDWR)
+                worker.sock.close()
+            except OSError:
+                pass
+        cls.logger.info("coordinator stopped.")
+
+    @classmethod
+    def workers(cls) -> list:
+        """
+        all connected agents.
+
+        :return: a list of ``RemoteWorker``.
+        """
+        with cls.__lock:
+            return [w for w in cls.__workers.values() if w.alive]
+
+    @classmethod
+    def __accept(cls, server: socket.socket) -> None:
+        while True:
+            try:
+                sock, address = server.accept()
+            except OSError:
+                break
+            t = threading.Thread(target=cls.__serve, args=(sock, address), daemon=True)
+            t.start()
+
+    @classmethod
+    def __valid_hello(cls, hello: dict) -> bool:
+        name, workdir, resources = hello.get("name"), hello.get("workdir"), hello.get("resources")
+        if not isinstance(name, str) or name == "" or not isinstance(workdir, str) or workdir == "":
+            return False
+        if not isinstance(hello.get("nonce"), str) or hello["nonce"] == "":
+            return False
+        if not isinstance(resources, dict) or any(k not in resources for k in cls.RESOURCE_KEYS):
+            return False
+        return isinstance(resources["gpus"], list)
+
+    @classmethod
+    def __serve(cls, sock: socket.socket, address) -> None:
+        try:
+            sock.settimeout(cls.HANDSHAKE_TIMEOUT)
+            hello = recv_frame(sock, allow_pickle=False)
+            token = str(Config.get_property("cluster.token") or "")
+            if not isinstance(hello, dict) or hello.get("cmd") != "REGISTER" or token == "" or \
+                    not cls.__valid_hello(hello):
+                cls.logger.warning("reject agent from %s:%d, invalid register message.", address[0], address[1])
+                sock.close()
+                return
+            nonce = os.urandom(16).hex()
+            send_frame(sock, {
+                "cmd": "CHALLENGE",
+                "nonce": nonce,
+                "proof": auth_digest(token, "coordinator", hello["nonce"], nonce)
+            }, raw=True)
+            auth = recv_frame(sock, allow_pickle=False)
+            proof = auth_digest(token, "agent", hello["nonce"], nonce)
+            if not isinstance(auth, dict) or auth.get("cmd") != "AUTH" or \
+                    not hmac.compare_digest(str(auth.get("proof", "")), proof):
+                cls.logger.warning("reject agent from %s:%d", address[0], address[1])
+                sock.close()
+                return
+            send_frame(sock, {"cmd": "ACCEPT"}, raw=True)
+            sock.settimeout(None)
+        except (OSError, ValueError):
+            cls.logger.warning("handshake with %s:%d failed.", address[0], address[1], exc_info=True)
+            sock.close()
+            return
+
+        worker = RemoteWorker(sock, hello["name"], hello["workdir"], hello["resources"])
+        with cls.__lock:
+            cls.__workers[worker.name] = worker
+        cls.logger.info("agent %s registered from %s:%d", worker.name, address[0], address[1])
+
+        try:
+            while True:
+                msg: Message = recv_frame(sock)
+                if msg is None:
+                    break
+                if msg.cmd == "RESOURCES":
+                    worker.resources = msg.data
+                elif msg.cmd == "MESSAGE":
+                    message: Message = msg.data["message"]
+                    if message.cmd == "update_status" and message.source in worker.tasks:
+                        worker.tasks[message.source] = message.data["status"]
+                    MessageListener.mq().put(message)
+                elif msg.cmd == "EXITED":
+                    worker.tasks.pop(msg.data["task_id"], None)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            cls.logger.error("connection with agent %s broken.", worker.name, exc_info=True)
+
+        worker.alive = False
+        with cls.__lock:
+            if cls.__workers.get(worker.name) is worker:
+                cls.__workers.pop(worker.name)
+        cls.logger.warning("agent %s disconnected.", worker.name)
+        # the running tasks on this agent are lost, the tasks which have reported their results are not failed again.
+        for task_id, status in list(worker.tasks.items()):
+            if status in (TaskStatus.FINISHED, TaskStatus.EXCEPTION, TaskStatus.INTERRUPT):
+                continue
+            MessageListener.mq().put(Message(source=task_id, cmd="update_status", data={
+                "status": TaskStatus.EXCEPTION,
+                "message": "agent %s disconnected." % worker.name,
+                "stage": "AGENT"
+            }))
+        worker.tasks.clear()
+
+
+class Agent(object):
+
+    """
+    The worker agent which runs tasks on its host for a coordinator.
+    """
+
+    logger = logging.getLogger("fedflow.cluster")
+
+    def __init__(self, host: str, port: int, workdir: str = None, name: str = None):
+        """
+        Construct an agent.
+
+        :param host: the coordinator host.
+        :param port: the coordinator port.
+        :param workdir: the workdir of tasks on this host, default is ``workdir``.
+        :param name: the unique name of agent, default is ``hostname-uuid``.
+        """
+        super(Agent, self).__init__()
+        self.host = host
+        self.port = port
+        if workdir is None:
+            workdir = Config.get_property("workdir")
+        self.workdir = os.path.abspath(workdir)
+        self.name = name if name is not None else "%s-%s" % (socket.gethostname(), uuid.uuid4().hex[:8])
+
+        self.__sock = None
+        self.__send_lock = threading.Lock()
+        self.__chdir_lock = threading.Lock()
+        self.__running = False
+        # task id -> (process, pipe)
+        self.__tasks = {}
+        self.__mq = multiprocessing.Queue()
+
+    def run(self) -> None:
+        """
+        connect to coordinator and serve until the connection is closed.
+
+        This method is blocked.
+
+        :return:
+        """
+        token = str(Config.get_property("cluster.token") or "")
+        if token == "":
+            raise ValueError("cluster.token must be set to connect to coordinator.")
+        os.makedirs(self.workdir, exist_ok=True)
+        sock = socket.create_connection((self.host, self.port))
+        try:
+            self.__handshake(sock, token)
+        except (OSError, ValueError, ConnectionError):
+            sock.close()
+            raise
+        self.logger.info("agent %s connected to %s:%d", self.name, self.host, self.port)
+        self.__sock = sock
+        self.__running = True
+
+        threading.Thread(target=self.__heartbeat, daemon=True).start()
+        threading.Thread(target=self.__forward, daemon=True).start()
+        try:
+            while True:
+                msg: Message = recv_frame(sock)
+                if msg is None:
+                    break
+                if msg.cmd == "START":
+                    self.__start_task(msg.data["task"], msg.data["relpath"])
+                elif msg.cmd == "PIPE":
+                    self.__pipe_message(msg.data["task_id"], msg.data["message"])
+        except OSError:
+            self.logger.error("connection with coordinator broken.", exc_info=True)
+        finally:
+            self.stop()
+
+    def __handshake(self, sock: socket.socket, token: str) -> None:
+        sock.settimeout(Coordinator.HANDSHAKE_TIMEOUT)
+        nonce = os.urandom(16).hex()
+        send_frame(sock, {
+            "cmd": "REGISTER",
+            "nonce": nonce,
+            "name": self.name,
+            "workdir": self.workdir,
+            "resources": local_resources()
+        }, raw=True)
+        challenge = recv_frame(sock, allow_pickle=False)
+        if not isinstance(challenge, dict) or challenge.get("cmd") != "CHALLENGE" or \
+                not isinstance(challenge.get("nonce"), str):
+            raise ConnectionError("rejected by coordinator %s:%d" % (self.host, self.port))
+        # the frames of coordinator are unpickled, so it must prove the token before that.
+        if not hmac.compare_digest(str(challenge.get("proof", "")),
+                                   auth_digest(token, "coordinator", nonce, challenge["nonce"])):
+            raise ConnectionError("coordinator %s:%d failed authentication" % (self.host, self.port))
+        send_frame(sock, {
+            "cmd": "AUTH",
+            "proof": auth_digest(token, "agent", nonce, challenge["nonce"])
+        }, raw=True)
+        reply = recv_frame(sock, allow_pickle=False)
+        if not isinstance(reply, dict) or reply.get("cmd") != "ACCEPT":
+            raise ConnectionError("rejected by coordinator %s:%d" % (self.host, self.port))
+        sock.settimeout(None)
+
+    def stop(self) -> None:
+        """
+        disconnect from coordinator and kill all task processes.
+
+        :return:
+        """
+        if not self.__running:
+            return
+        self.__running = False
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+            self.__sock.close()
+        except OSError:
+            pass
+        for task_id, (process, pipe) in list(self.__tasks.items()):
+            if process.is_alive():
+                process.terminate()
+        self.__tasks.clear()
+        self.logger.info("agent %s stopped.", self.name)
+
+    def __send(self, cmd: str, data: dict) -> None:
+        try:
+            with self.__send_lock:
+                send_frame(self.__sock, Message(source=self.name, cmd=cmd, data=data))
+        except OSError:
+            self.logger.error("failed to send %s to coordinator.", cmd, exc_info=True)
+
+    def __heartbeat(self) -> None:
+        interval = Config.get_property("cluster.heartbeat")
+        while self.__running:
+            time.sleep(interval)
+            if self.__running:
+                self.__send("RESOURCES", local_resources())
+
+    def __forward(self) -> None:
+        while self.__running:
+            try:
+                msg: Message = self.__mq.get(timeout=1)
+            except Exception:
+                continue
+            self.__send("MESSAGE", {
+                "message": msg
+            })
+
+    def __start_task(self, task, relpath: str) -> None:
+        self.logger.info("start task %s", task.task_id)
+        directory = os.path.normpath(os.path.join(self.workdir, relpath))
+        os.makedirs(directory, exist_ok=True)
+        pipe = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=task.run, args=(pipe[1], self.__mq))
+        # the task process creates its workdir in current directory
+        with self.__chdir_lock:
+            pre_workdir = os.getcwd()
+            os.chdir(directory)
+            try:
+                process.start()
+            finally:
+                os.chdir(pre_workdir)
+        self.__tasks[task.task_id] = (process, pipe[0])
+        threading.Thread(target=self.__wait_task, args=(task.task_id, process), daemon=True).start()
+
+    def __wait_task(self, task_id: Union[int, str], process) -> None:
+        process.join()
+        self.__tasks.pop(task_id, None)
+        if self.__running:
+            self.__send("EXITED", {
+                "task_id": task_id
+            })
+
+    def __pipe_message(self, task_id: Union[int, str], msg: Message) -> None:
+        item = self.__tasks.get(task_id)
+        if item is None:
+            self.logger.warning("task %s not exists, drop %s command.", task_id, msg.cmd)
+            return
+        pipe = item[1]
+        try:
+            pipe.send(msg)
+            if msg.cmd == "EXIT":
+                pipe.close()
+        except OSError:
+            self.logger.warning("task %s has exited, drop %s command.", task_id, msg.cmd)
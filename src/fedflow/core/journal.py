@@ -0,0 +1,182 @@
+"""
+Scheduling journal
+===================
+
+An append-only journal of task status transitions and task results.
+
+Every task group writes a journal in its workdir while scheduling, so when the main process died, the group can be
+resumed by ``FedFlow(resume=True)``: the finished tasks are restored from the journal and only the rest are scheduled.
+"""
+
+__all__ = [
+    "Journal"
+]
+
+import base64
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Union
+
+from fedflow.config import Config
+from fedflow.core.task import TaskStatus
+
+
+class Journal(object):
+
+    """
+    The journal of a task group.
+
+    Every line of journal file is a json object ``{"time": ..., "task_id": ..., "status": ..., "data": ...}``. The data
+    which cannot be restored exactly from json(such as tensors, numpy values, tuples or dicts with non-string keys) is
+    pickled and recorded as ``"pickle": <base64 string>`` instead of ``data``. Records are written immediately, but
+    synchronized to disk(fsync) in batches.
+    """
+
+    logger = logging.getLogger("fedflow.journal")
+
+    def __init__(self, path: str):
+        """
+        Construct a journal.
+
+        :param path: the journal file path.
+        """
+        super(Journal, self).__init__()
+        self.path = path
+        self.sync_batch = Config.get_property("journal.sync-batch")
+        self.sync_interval = Config.get_property("journal.sync-interval")
+        self.__file = None
+        self.__pending = 0
+        self.__last_sync = time.time()
+        self.__lock = threading.Lock()
+
+    def open(self, append: bool = False) -> None:
+        """
+        Open journal file.
+
+        :param append: append records to the existing journal, otherwise the journal will be truncated. The
+            incomplete last record(the process died while writing it) is removed before appending.
+        :return:
+        """
+        if append and os.path.exists(self.path):
+            self.__truncate_partial_record()
+        self.__file = open(self.path, "a" if append else "w", encoding="utf-8")
+        self.__last_sync = time.time()
+
+    def record(self, task_id: Union[int, str], status: TaskStatus, data: dict = None) -> None:
+        """
+        Append a record to journal.
+
+        :param task_id: the task id.
+        :param status: the status of task.
+        :param data: some extra data, it should can be pickled, otherwise the values which cannot be serialized to json
+            are recorded as string.
+        :return:
+        """
+        if self.__file is None:
+            return
+        record = {
+            "time": time.time(),
+            "task_id": task_id,
+            "status": status.name
+        }
+        try:
+            encoded = json.dumps(data)
+            exact = json.loads(encoded) == data
+        except (TypeError, ValueError):
+            exact = False
+        if exact:
+            record["data"] = data
+        else:
+            try:
+                record["pickle"] = base64.b64encode(pickle.dumps(data)).decode("ascii")
+            except (pickle.PicklingError, TypeError, AttributeError):
+                self.logger.warning("the data of task[%s] cannot be pickled, it's recorded as string and cannot be "
+                                    "resumed exactly.", str(task_id), exc_info=True)
+                record["data"] = json.loads(json.dumps(data, default=str))
+        line = json.dumps(record)
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.__pending += 1
+            if self.__pending >= self.sync_batch:
+                self.__sync()
+
+    def sync(self, force: bool = False) -> None:
+        """
+        Synchronize pending records to disk if the ``journal.sync-interval`` seconds passed since last sync.
+
+        :param force: synchronize pending records right now.
+        :return:
+        """
+        with self.__lock:
+            if self.__pending > 0 and (force or time.time() - self.__last_sync >= self.sync_interval):
+                self.__sync()
+
+    def close(self) -> None:
+        """
+        Synchronize all pending records and close journal file.
+
+        :return:
+        """
+        if self.__file is None:
+            return
+        self.sync(force=True)
+        with self.__lock:
+            self.__file.close()
+            self.__file = None
+
+    def __truncate_partial_record(self):
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            # search the last newline backwards by blocks
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                idx = f.read(end - start).rfind(b"\n")
+                if idx >= 0:
+                    end = start + idx + 1
+                    break
+                end = start
+            if end < size:
+                self.logger.warning("drop incomplete journal record at the end of %s", self.path)
+                f.truncate(end)
+
+    def __sync(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__pending = 0
+        self.__last_sync = time.time()
+
+    @classmethod
+    def replay(cls, path: str) -> dict:
+        """
+        Read the journal file and collect the finished tasks.
+
+        :param path: the journal file path.
+        :return: a dict ``{task_id: data}``, the data is the payload of the last ``FINISHED`` record of each task.
+        """
+        finished = {}
+        if not os.path.exists(path):
+            cls.logger.warning("journal %s not exists, nothing to resume.", path)
+            return finished
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete if the process died while writing.
+                    cls.logger.warning("skip broken journal record: %s", line.strip())
+                    continue
+                if record["status"] == TaskStatus.FINISHED.name:
+                    if "pickle" in record:
+                        finished[record["task_id"]] = pickle.loads(base64.b64decode(record["pickle"]))
+                    else:
+                        finished[record["task_id"]] = record["data"]
+                else:
+                    finished.pop(record["task_id"], None)
+        cls.logger.info("%d finished tasks found in journal %s", len(finished), path)
+        return finished
@@ -13,14 +13,16 @@ __all__ = [
 ]
 
 import logging
+import os
 import time
 from typing import Union
 
-import ngpuinfo
 import psutil
-from ngpuinfo import NGPUInfo
 
 from fedflow.config import Config
+from fedflow.core.cache import ResultCache
+from fedflow.core.cluster import Coordinator, local_resources
+from fedflow.core.journal import Journal
 from fedflow.core.message import MessageListener, Handler
 from fedflow.core.task import Task, TaskStatus
 from fedflow.core.taskgroup import TaskGroup
@@ -36,14 +38,16 @@ class TaskHandler(Handler):
 
     main_logger = logging.getLogger("fedflow.task.main")
 
-    def __init__(self, group: TaskGroup):
+    def __init__(self, group: TaskGroup, cache: ResultCache = None):
         """
         Construct a handler instance for specify group.
 
         :param group: the task group in scheduling.
+        :param cache: the result cache, the results of finished tasks will be stored in it.
         """
         super(TaskHandler, self).__init__()
         self.group = group
+        self.cache = cache
 
     def handle(self, source: str, cmd: str, data: dict) -> None:
         """
@@ -86,6 +90,8 @@ class TaskHandler(Handler):
             task.exit()
             self.group.move_task(task.task_id, task.status, TaskStatus.EXITED)
             self.group.report_finish(task.task_id, data)
+            if self.cache is not None:
+                self.cache.store(task, data)
         else:
             self.group.move_task(task.task_id, task.status, status)
 
@@ -132,47 +138,69 @@ class GroupScheduler(object):
     logger = logging.getLogger("fedflow.scheduler")
 
     @classmethod
-    def schedule(cls, group: TaskGroup) -> None:
+    def schedule(cls, group: TaskGroup, resume: bool = False) -> None:
         """
         The entry of schedule.
 
         This method is blocked.
 
         :param group: the task group waiting for scheduling.
+        :param resume: restore the tasks finished in previous run from the journal of group, and only schedule the
+            rest.
         :return:
         """
         cls.logger.info("schedule group #%s", group.index)
-        MessageListener.register_default_handler(TaskHandler(group))
+        group.prepare()
+        cls.open_journal(group, resume)
+        cache = ResultCache() if Config.get_property("cache.enable") else None
+        MessageListener.register_default_handler(TaskHandler(group, cache))
 
         schedule_round = 1
         while not group.finished():
             process_number, waiting_number, training_number = group.numbers()
-            cls.logger.info("schedule round #%d{waiting: %d, training: %d, process: %d}",
-                            schedule_round, waiting_number, training_number, process_number)
+            total_number = group.total_number()
+            cls.logger.info("schedule round #%d{waiting: %d, training: %d, process: %d, done: %d/%s}",
+                            schedule_round, waiting_number, training_number, process_number,
+                            group.success_number + group.failed_number,
+                            str(total_number) if total_number is not None else "?")
             schedule_round += 1
 
             max_process = Config.get_property("scheduler.max-process")
             if process_number < max_process or max_process == 0:
-                if cls.cpu_free():
+                hosts = cls.hosts()
+                if any(cls.cpu_free(resources) for resources in hosts.values()):
                     # schedule load
                     max_waiting = Config.get_property("scheduler.max-waiting")
                     if waiting_number < max_waiting or max_waiting == 0:
                         # start init task
+                        group.materialize(Config.get_property("scheduler.max-init"))
                         task: Task = group.retrieve_task(TaskStatus.INIT)
+                        if task is not None and cache is not None:
+                            report = cache.restore(task)
+                            if report is not None:
+                                cls.logger.info("task{%s} restored from cache", task.task_id)
+                                group.move_task(task.task_id, task.status, TaskStatus.EXITED)
+                                group.report_finish(task.task_id, report)
+                                continue
                         if task is not None:
-                            cls.logger.info("task{%s} start", task.task_id)
-                            task.start()
-                            time.sleep(3)
+                            found, worker = cls.select_host(hosts, cls.require_memory(task, group))
+                            if found:
+                                cls.logger.info("task{%s} start", task.task_id)
+                                task.start(worker)
+                                time.sleep(3)
+                                hosts = cls.hosts()
+                            else:
+                                cls.logger.warning("CPU utilization of all hosts is too high.")
                         else:
                             cls.logger.debug("no init task exists.")
 
                         # start available task
                         task: Task = group.retrieve_task(TaskStatus.AVAILABLE)
                         if task is not None:
-                            require_memory = task.estimate_memory
-                            if require_memory is None:
-                                require_memory = group.estimate_memory
-                            if cls.memory_free(require_memory):
+                            resources = hosts.get(task.worker)
+                            if resources is None:
+                                cls.logger.warning("the host of task{%s} is unavailable.", task.task_id)
+                            elif cls.memory_free(cls.require_memory(task, group), resources):
                                 cls.logger.info("task{%s} start load", task.task_id)
                                 task.start_load()
                             else:
@@ -188,13 +216,17 @@ class GroupScheduler(object):
                         require_cuda_memory = task.estimate_cuda_memory
                         if require_cuda_memory is None:
                             require_cuda_memory = group.estimate_cuda_memory
-                        device_id = cls.assign_cuda(require_cuda_memory, task.device)
-                        if device_id >= 0:
-                            device = "cuda:%d" % device_id
-                            cls.logger.info("task{%s} start train in %s", task.task_id, device)
-                            task.start_train(device)
+                        resources = hosts.get(task.worker)
+                        if resources is None or not cls.cpu_free(resources):
+                            cls.logger.warning("CPU utilization of the host of task{%s} is too high.", task.task_id)
                         else:
-                            cls.logger.warning("GPU utilization is too high.")
+                            device_id = cls.assign_cuda(require_cuda_memory, task.device, resources)
+                            if device_id >= 0:
+                                device = "cuda:%d" % device_id
+                                cls.logger.info("task{%s} start train in %s", task.task_id, device)
+                                task.start_train(device)
+                            else:
+                                cls.logger.warning("GPU utilization is too high.")
                     else:
                         cls.logger.info("no waiting task exists.")
 
@@ -204,45 +236,122 @@ class GroupScheduler(object):
             else:
                 cls.logger.info("the maximum number of processes has been reached.")
 
+            if group.journal is not None:
+                group.journal.sync()
+
             cls.logger.info("sleeping...")
             time.sleep(Config.get_property("scheduler.interval"))
 
+        if group.journal is not None:
+            group.journal.close()
+            group.journal = None
+        if cache is not None:
+            cache.flush()
+
         # send task group report
         Mail.send_group_result(group.group_name, group.result)
 
     @classmethod
-    def cpu_free(cls) -> bool:
+    def open_journal(cls, group: TaskGroup, resume: bool = False) -> None:
+        """
+        open the journal of group in current directory.
+
+        :param group: the task group.
+        :param resume: if recover finished tasks from the existing journal.
+        :return:
+        """
+        path = os.path.abspath("%s.journal" % group.group_name)
+        if resume:
+            group.recover(Journal.replay(path))
+        if Config.get_property("journal.enable"):
+            group.journal = Journal(path)
+            group.journal.open(append=resume)
+        elif resume:
+            cls.logger.warning("journal is disabled, the progress of this run cannot be resumed.")
+
+    @classmethod
+    def hosts(cls) -> dict:
+        """
+        The resources snapshot of all hosts which can run tasks.
+
+        :return: a dict ``{worker: resources}``, the key of local host is None, and the others are instances of
+            ``RemoteWorker``.
+        """
+        hosts = {}
+        if not Config.get_property("cluster.enable") or Config.get_property("cluster.local"):
+            hosts[None] = local_resources()
+        if Config.get_property("cluster.enable"):
+            for worker in Coordinator.workers():
+                hosts[worker] = worker.resources
+        return hosts
+
+    @classmethod
+    def select_host(cls, hosts: dict, require_memory: Union[int, str] = None) -> tuple:
+        """
+        Select a host to start task process. The hosts which have enough memory for the task are preferred.
+
+        :param hosts: the resources snapshot of hosts, see ``hosts()``.
+        :param require_memory: the memory the task required.
+        :return: a tuple ``(found, worker)``, the worker is None if the local host is selected.
+        """
+        candidates = [w for w, resources in hosts.items() if cls.cpu_free(resources)]
+        candidates.sort(key=lambda w: hosts[w]["memory_available"], reverse=True)
+        for worker in candidates:
+            if cls.memory_free(require_memory, hosts[worker]):
+                return True, worker
+        if len(candidates) > 0:
+            return True, candidates[0]
+        return False, None
+
+    @classmethod
+    def require_memory(cls, task: Task, group: TaskGroup) -> Union[int, str, None]:
+        require_memory = task.estimate_memory
+        if require_memory is None:
+            require_memory = group.estimate_memory
+        return require_memory
+
+    @classmethod
+    def cpu_free(cls, resources: dict = None) -> bool:
         """
         check cpu utilization.
 
+        :param resources: the resources snapshot of a host, default is current host.
         :return: a bool value.
         """
-        cpu_precent = psutil.cpu_percent()
+        if resources is None:
+            cpu_precent = psutil.cpu_percent()
+        else:
+            cpu_precent = resources["cpu_percent"]
         utilization_limit = Config.get_property("utilization-limit.cpu")
         cls.logger.debug("CPU utilization: %.2f%%", cpu_precent)
         return cpu_precent < 100 * utilization_limit
 
     @classmethod
-    def memory_free(cls, require_memory: Union[int, str] = None) -> bool:
+    def memory_free(cls, require_memory: Union[int, str] = None, resources: dict = None) -> bool:
         """
         check memory utilization
 
         :param require_memory: the memory current task required. the type of ``require_memory`` can be int(the unit is
             Byte) or str(number + unit, for example, '123KB', '456 MB', '789MiB').
+        :param resources: the resources snapshot of a host, default is current host.
         :return: a bool value
         """
         if require_memory is None:
             require_memory = Config.get_property("scheduler.default-memory")
         require_memory = cls.parse_memory_value(require_memory)
 
-        mem = psutil.virtual_memory()
-        total = mem.total
-        available = mem.available
+        if resources is None:
+            mem = psutil.virtual_memory()
+            total = mem.total
+            available = mem.available
+        else:
+            total = resources["memory_total"]
+            available = resources["memory_available"]
         cls.logger.debug("memory utilization: %.2f%%{available: %.3fGiB, total: %.3fGiB}",
                          100 * (total - available) / total,
                          ByteUnits.convert(ByteUnits.iB, ByteUnits.GiB, available),
                          ByteUnits.convert(ByteUnits.iB, ByteUnits.GiB, total))
-        available = mem.available - require_memory
+        available = available - require_memory
 
         utilization_limit = Config.get_property("utilization-limit.memory")
         if available < 0 or available / total < 1 - utilization_limit:
@@ -256,19 +365,22 @@ class GroupScheduler(object):
         return True
 
     @classmethod
-    def assign_cuda(cls, require_cuda_memory=None, device: str = None):
+    def assign_cuda(cls, require_cuda_memory=None, device: str = None, resources: dict = None):
         """
         assign a cuda device.
 
         :param require_cuda_memory: the cuda memory current task required.
         :param device: specify a device, then other device will be ignored.
+        :param resources: the resources snapshot of a host, default is current host.
         :return: An integer represents the cuda id
         """
         if require_cuda_memory is None:
             require_cuda_memory = Config.get_property("scheduler.default-cuda-memory")
         require_cuda_memory = cls.parse_memory_value(require_cuda_memory)
 
-        gpus = NGPUInfo.list_gpus()
+        if resources is None:
+            resources = local_resources()
+        gpus = resources["gpus"]
         if device is not None:
             try:
                 device = device.replace("cuda:", "")
@@ -277,15 +389,14 @@ class GroupScheduler(object):
             except:
                 pass
 
-        for g in gpus:
-            gpu: ngpuinfo.NGPU = g
-            total = gpu.mem_total()
-            available = gpu.mem_free()
+        for gpu in gpus:
+            total = gpu["mem_total"]
+            available = gpu["mem_free"]
             cls.logger.debug("cuda:%d memory utilization: %.2f%%{available: %.3fGiB, total: %.3fGiB}",
-                             gpu.id, 100 * (total - available) / total,
+                             gpu["id"], 100 * (total - available) / total,
                              ByteUnits.convert(ByteUnits.iB, ByteUnits.GiB, available),
                              ByteUnits.convert(ByteUnits.iB, ByteUnits.GiB, total))
-            available = gpu.mem_free() - require_cuda_memory
+            available = available - require_cuda_memory
 
             utilization_limit = Config.get_property("utilization-limit.cuda-memory")
             if available < 0 or available / total < 1 - utilization_limit:
@@ -296,8 +407,8 @@ class GroupScheduler(object):
             if available < remain_limit:
                 continue
 
-            cls.logger.debug("select cuda:%d", gpu.id)
-            return gpu.id
+            cls.logger.debug("select cuda:%d", gpu["id"])
+            return gpu["id"]
 
         cls.logger.debug("no free gpu.")
         return -1
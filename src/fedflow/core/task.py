@@ -43,6 +43,7 @@ class TaskStatus(enum.Enum):
     EXITED = 7          #: subprocess exited
     EXCEPTION = 8       #: caught some exception while running
     INTERRUPT = 9       #: caught OOM(or cuda OOM) exception while running
+    BLOCKED = 10        #: waiting for dependencies to finish before it can be scheduled
 
 
 class Task(object):
@@ -50,6 +51,11 @@ class Task(object):
     the basic class of all user task
     """
 
+    # keep the base fields compact, groups may hold a huge number of tasks in main process.
+    __slots__ = ("task_id", "estimate_memory", "estimate_cuda_memory", "device", "load_numbers", "train_numbers",
+                 "dependencies", "required_dependencies", "load_time", "train_time", "items", "result",
+                 "worker", "__workdir", "__process", "__pipe", "__mq", "__status", "__main_pid")
+
     main_logger = logging.getLogger("fedflow.task.main")
     sub_logger = logging.getLogger("fedflow.task.sub")
 
@@ -73,6 +79,9 @@ class Task(object):
         self.load_numbers = 0
         self.train_numbers = 0
 
+        self.dependencies = []
+        self.required_dependencies = None
+
         self.__workdir = None
         self.load_time = -1
         self.train_time = -1
@@ -80,6 +89,9 @@ class Task(object):
         self.items = {}
         self.result = {}
 
+        # the remote worker(see ``fedflow.core.cluster``) this task runs on, None means local.
+        self.worker = None
+
         self.__process = None
         self.__pipe = None
         self.__mq = None
@@ -133,18 +145,53 @@ class Task(object):
     def get_item(self, key):
         return self.items.get(key)
 
+    def depend_on(self, *tasks, required: int = None) -> None:
+        """
+        Declare the tasks this task depends on.
+
+        The task will be held in ``TaskStatus.BLOCKED`` status by its group, and it will be released to
+        ``TaskStatus.INIT`` as soon as ``required`` dependencies finished successfully. If too many dependencies failed
+        to satisfy ``required``, the task will be reported as an exception without running.
+
+        All dependencies must be added to the same group as this task.
+
+        :param tasks: instances of ``Task`` or task ids.
+        :param required: how many dependencies need to be finished, default is all of them. Use a number less than the
+            number of dependencies to declare a 'K of N' dependency.
+        :return:
+        """
+        for t in tasks:
+            task_id = t.task_id if isinstance(t, Task) else t
+            if task_id == self.task_id:
+                raise ValueError("task[%s] cannot depend on itself." % str(task_id))
+            if task_id not in self.dependencies:
+                self.dependencies.append(task_id)
+        if required is not None:
+            if required < 0 or required > len(self.dependencies):
+                raise ValueError("required must be in [0, %d]" % len(self.dependencies))
+            self.required_dependencies = required
+
     # ======================================================================
     # ------------------------ main process methods ------------------------
     # --- The following methods will only be used in the main process.   ---
     # ======================================================================
 
-    def start(self) -> None:
+    def start(self, worker=None) -> None:
         """
         Start task process
         *This method cannot be called by user.*
 
+        :param worker: an instance of ``fedflow.core.cluster.RemoteWorker``, the task process will be started on this
+            remote agent. If it's None, the task process will be started locally.
         :return:
         """
+        if worker is not None:
+            self.main_logger.info("{%s} start on %s.", self.task_id, worker.name)
+            relpath = worker.relpath(os.curdir)
+            self.__workdir = worker.task_workdir(relpath, self.task_id)
+            self.__pipe = worker.start_task(self, relpath)
+            self.worker = worker
+            return
         self.main_logger.info("{%s} start.", self.task_id)
         self.__workdir = os.path.join(os.curdir, str(self.task_id))
         self.__workdir = os.path.abspath(self.__workdir)
@@ -195,12 +242,33 @@ class Task(object):
         self.__pipe.close()
         self.main_logger.info("{%s} exit.", self.task_id)
 
+    def recover(self, result: dict = None, items: dict = None, load_time: int = -1, train_time: int = -1) -> None:
+        """
+        Restore the outputs of a task which finished in previous run, then the task needn't to run again.
+        *This method cannot be called by user.*
+
+        :param result: the dict returned by ``train`` method.
+        :param items: the items set by ``set_item`` method.
+        :param load_time: the milliseconds used for loading.
+        :param train_time: the milliseconds used for training.
+        :return:
+        """
+        self.main_logger.info("{%s} recover.", self.task_id)
+        self.__workdir = os.path.join(os.curdir, str(self.task_id))
+        self.__workdir = os.path.abspath(self.__workdir)
+        self.result = result.copy() if result is not None else {}
+        self.items = items.copy() if items is not None else {}
+        self.load_time = load_time
+        self.train_time = train_time
+
     def is_alive(self) -> bool:
         """
         If the task process is alive.
 
         :return: a bool value
         """
+        if self.worker is not None:
+            return self.worker.is_running(self.task_id)
         return self.__process is not None and self.__process.is_alive()
 
     # ======================================================================
@@ -259,6 +327,37 @@ class Task(object):
                 t.start()
         self.__pipe.close()
 
+    def cache_parameters(self) -> Union[dict, None]:
+        """
+        User can overwrite this method to make the task cacheable(only works if ``cache.enable`` is true).
+
+        The parameters returned by this method, together with the code of task class and the content of input files,
+        decide the result of task. If the same task with the same parameters and inputs has finished before, the
+        scheduler will restore the cached result instead of running it again.
+
+        This method is called in main process.
+
+        :return: a json serializable dict, or None(default) if the task cannot be cached.
+        """
+        return None
+
+    def cache_inputs(self) -> list:
+        """
+        User can overwrite this method to declare the input files(or directories) of a cacheable task.
+
+        :return: a list of paths.
+        """
+        return []
+
+    def cache_outputs(self) -> list:
+        """
+        User can overwrite this method to declare the output files(or directories) of a cacheable task, they will be
+        stored in cache and restored when the task hits cache.
+
+        :return: a list of paths relative to the workdir of task.
+        """
+        return []
+
     @abc.abstractmethod
     def load(self) -> None:
         """
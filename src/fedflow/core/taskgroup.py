@@ -2,29 +2,128 @@
 TaskGroup
 ==========
 
-All tasks in one group will executed disorderly.
+All tasks in one group will executed disorderly, except the tasks which declared dependencies by ``Task.depend_on``.
 """
 
 __all__ = [
+    "TaskContainer",
     "TaskGroup"
 ]
 
+import collections
+import heapq
 import json
+import logging
 import random
-from typing import Union
+import threading
+from typing import Callable, Iterable, Union
 
 from fedflow.config import Config
 from fedflow.core.task import Task, TaskStatus
 
 
+class TaskContainer(object):
+
+    """
+    The container of tasks which have the same status.
+
+    Tasks are bucketed by their scheduling priority. Adding a task, removing a task and retrieving a random task with
+    the highest priority are all O(1)(the number of distinct priorities is very small in practice).
+    """
+
+    def __init__(self):
+        super(TaskContainer, self).__init__()
+        # priority -> list of tasks
+        self.__buckets = {}
+        # task id -> (priority, index in bucket)
+        self.__positions = {}
+        # negative priorities of non-empty(maybe empty, lazy deletion) buckets
+        self.__heap = []
+        # the priorities in heap, every priority is pushed once until it's popped
+        self.__heap_priorities = set()
+
+    def __len__(self) -> int:
+        return len(self.__positions)
+
+    def __contains__(self, task_id) -> bool:
+        return task_id in self.__positions
+
+    def get(self, task_id: Union[int, str]) -> Union[Task, None]:
+        pos = self.__positions.get(task_id)
+        if pos is None:
+            return None
+        return self.__buckets[pos[0]][pos[1]]
+
+    def values(self) -> list:
+        """
+        All tasks in this container.
+
+        :return: a list of tasks.
+        """
+        return [task for bucket in self.__buckets.values() for task in bucket]
+
+    def add(self, task: Task, priority: int = 1) -> None:
+        bucket = self.__buckets.get(priority)
+        if bucket is None:
+            bucket = self.__buckets[priority] = []
+        if priority not in self.__heap_priorities:
+            heapq.heappush(self.__heap, -priority)
+            self.__heap_priorities.add(priority)
+        self.__positions[task.task_id] = (priority, len(bucket))
+        bucket.append(task)
+
+    def pop(self, task_id: Union[int, str]) -> Task:
+        priority, idx = self.__positions.pop(task_id)
+        bucket = self.__buckets[priority]
+        task = bucket[idx]
+        last = bucket.pop()
+        if last is not task:
+            # move the last task to the hole
+            bucket[idx] = last
+            self.__positions[last.task_id] = (priority, idx)
+        return task
+
+    def update(self, task_id: Union[int, str], priority: int) -> None:
+        """
+        Update the priority of a task.
+
+        :param task_id: the id of task in this container.
+        :param priority: the new priority.
+        :return:
+        """
+        if task_id in self.__positions and self.__positions[task_id][0] != priority:
+            self.add(self.pop(task_id), priority)
+
+    def random(self) -> Union[Task, None]:
+        """
+        randomly choose a task which has the highest priority.
+
+        :return: the task or None if container is empty.
+        """
+        while len(self.__heap) > 0:
+            priority = -self.__heap[0]
+            bucket = self.__buckets[priority]
+            if len(bucket) > 0:
+                return bucket[random.randint(0, len(bucket) - 1)]
+            heapq.heappop(self.__heap)
+            self.__heap_priorities.discard(priority)
+            del self.__buckets[priority]
+        return None
+
+
 class TaskGroup(object):
 
     """
     Generally, tasks in one group should be similar, it means all tasks is instance of the same class.
 
-    Of course, this is not mandatory, you just need to ensure that there are no dependencies between tasks.
+    Of course, this is not mandatory. Tasks in one group can depend on each other(see ``Task.depend_on``), the group
+    holds a task until its dependencies are satisfied, and prefers the tasks on the critical path(the longest chain of
+    dependent tasks) when scheduling.
     """
 
+    logger = logging.getLogger("fedflow.taskgroup")
+
+    # only used when ``task.allow-duplicate-id`` is false
     global_ids = set()
 
     def __init__(self, group_name: str = None, *,
@@ -52,10 +151,31 @@ class TaskGroup(object):
             self.auto_adjust_memory = False
             self.auto_adjust_cuda_memory = False
 
-        self.task_ids = set()
+        # task id -> task
+        self.task_index = {}
+        # status -> TaskContainer, the size of container is the counter of tasks with this status
         self.tasks = {}
         for ts in TaskStatus.__members__.values():
-            self.tasks[ts] = {}
+            self.tasks[ts] = TaskContainer()
+        self.__lock = threading.RLock()
+
+        # dependency id -> ids of tasks which depend on it
+        self.dependents = {}
+        # dependent task id -> [finished number, failed number] of its dependencies
+        self.dependency_states = {}
+        # task id -> the length of the longest dependent chain start from this task, 1 if absent
+        self.priorities = {}
+        # if some dependencies are added after the priorities computed
+        self.__priorities_stale = False
+
+        # lazily generated tasks, every item is a list ``[iterator, remaining number or None]``
+        self.sources = collections.deque()
+        # ids of the unfinished tasks materialized from sources
+        self.__source_ids = set()
+        # ids of the finished tasks materialized from sources, they are released by ``materialize``
+        self.__finished_sources = collections.deque()
+        # functions called with the task when a task finished successfully
+        self.finish_callbacks = []
 
         self.task_number = 0
         self.success_number = 0
@@ -64,6 +184,10 @@ class TaskGroup(object):
         self.result = {}
 
         self.workdir = None
+        # the journal of scheduling, it's opened by scheduler
+        self.journal = None
+        # task id -> data recorded in journal, the finished tasks of previous run
+        self.recovered = {}
 
     @property
     def device(self) -> str:
@@ -90,15 +214,284 @@ class TaskGroup(object):
         if task.device is None:
             task.device = self.device
 
-        if not Config.get_property("task.allow-duplicate-id") and task.task_id in TaskGroup.global_ids:
-            raise ValueError("Duplicate id[%s] in global." % str(task.task_id))
-        TaskGroup.global_ids.add(task.task_id)
-        if task.task_id in self.task_ids:
+        if task.task_id in self.task_index or task.task_id in self.result:
             raise ValueError("Duplicate id[%s] in group." % str(task.task_id))
-        self.task_ids.add(task.task_id)
+        if not Config.get_property("task.allow-duplicate-id"):
+            if task.task_id in TaskGroup.global_ids:
+                raise ValueError("Duplicate id[%s] in global." % str(task.task_id))
+            TaskGroup.global_ids.add(task.task_id)
+
+        with self.__lock:
+            self.task_index[task.task_id] = task
+            if len(task.dependencies) > 0:
+                task.status = TaskStatus.BLOCKED
+            self.tasks[task.status].add(task, self.priority(task.task_id))
+            self.task_number += 1
+
+            if task.status == TaskStatus.BLOCKED:
+                self.dependency_states[task.task_id] = [0, 0]
+                for dependency_id in task.dependencies:
+                    if dependency_id in self.result:
+                        # the dependency is done(and maybe released), it's resolved below.
+                        continue
+                    self.dependents.setdefault(dependency_id, []).append(task.task_id)
+                    self.__priorities_stale = True
+                for dependency_id in task.dependencies:
+                    res = self.result.get(dependency_id)
+                    if res is not None and task.status == TaskStatus.BLOCKED:
+                        # the dependency has been done before this task was added.
+                        if self.__update_dependency(task, res["type"] == "success"):
+                            self.__resolve_dependents(task.task_id, False)
+
+            if task.task_id in self.recovered:
+                self.__recover_task(task, self.recovered.pop(task.task_id))
+
+    def recover(self, finished: dict) -> None:
+        """
+        Mark the tasks finished in previous run as done, the tasks not added yet will be recovered when they are
+        added(or materialized from task sources).
+        *This method cannot be called by user.*
+
+        :param finished: a dict ``{task_id: data}`` replayed from journal.
+        :return:
+        """
+        self.recovered.update(finished)
+        for task_id in list(self.recovered.keys()):
+            task = self.task_index.get(task_id)
+            if task is not None:
+                self.__recover_task(task, self.recovered.pop(task_id))
+
+    def __recover_task(self, task: Task, data: dict) -> None:
+        if task.status in (TaskStatus.EXITED, TaskStatus.EXCEPTION):
+            return
+        report = data.get("report", {})
+        task.recover(data.get("result"), data.get("items"), report.get("load_time", -1), report.get("train_time", -1))
+        if task.status == TaskStatus.BLOCKED:
+            self.dependency_states.pop(task.task_id, None)
+        self.move_task(task.task_id, task.status, TaskStatus.EXITED)
+        self.report_finish(task.task_id, report)
+
+    @classmethod
+    def clear_global_ids(cls) -> None:
+        """
+        Forget all task ids recorded for the global duplicate check(only used when ``task.allow-duplicate-id`` is
+        false), then the ids can be reused by new groups.
+
+        :return:
+        """
+        cls.global_ids.clear()
+
+    def add_task_source(self, source: Iterable[Task], total: int = None) -> None:
+        """
+        Add a lazily generated task source to this group.
+
+        Tasks in the source are only materialized(and added to this group) when the scheduler has room for more
+        ``TaskStatus.INIT`` tasks, so the tasks can be generated by a generator without building all of them up front.
+        The finished tasks of sources are released after their finish callbacks, only their entries in ``result``(the
+        data of group report) are kept, so they cannot be retrieved by ``get_task`` any more.
+
+        :param source: an iterable object(such as a generator) which yields instances of ``Task``.
+        :param total: the number of tasks in the source, it's only used for reporting. If it's None, ``len(source)``
+            will be used if the source supports it.
+        :return:
+        """
+        if total is None and hasattr(source, "__len__"):
+            total = len(source)
+        self.sources.append([iter(source), total])
+
+    def add_finish_callback(self, callback: Callable[[Task], None]) -> None:
+        """
+        Add a function which is called with the task when a task in this group finished successfully, includes the
+        tasks restored from cache or journal. The result of task(``task.result``) is available in callback.
+
+        The callbacks are called by the scheduler in main process, so they should return quickly. Exceptions raised by
+        callbacks are logged and ignored.
+
+        :param callback: a function accepts an instance of ``Task``.
+        :return:
+        """
+        self.finish_callbacks.append(callback)
+
+    def materialize(self, number: int = 1) -> int:
+        """
+        Pull tasks from task sources until there are ``number`` tasks in ``TaskStatus.INIT`` or ``TaskStatus.BLOCKED``
+        status or all sources are exhausted, and release the finished tasks of sources.
+        *This method cannot be called by user.*
+
+        If no task is in ``TaskStatus.INIT`` status or running, the blocked tasks can only be unblocked by the tasks
+        not materialized yet, so the tasks are pulled regardless of ``number``.
+
+        :param number: the expected number of ``TaskStatus.INIT`` and ``TaskStatus.BLOCKED`` tasks.
+        :return: the number of tasks materialized.
+        """
+        self.__release_finished()
+        count = 0
+        while len(self.sources) > 0:
+            init_number = len(self.tasks[TaskStatus.INIT])
+            if init_number + len(self.tasks[TaskStatus.BLOCKED]) >= number and \
+                    (init_number > 0 or self.numbers()[0] > 0):
+                break
+            source = self.sources[0]
+            task = next(source[0], None)
+            if task is None:
+                self.sources.popleft()
+                if len(self.sources) == 0:
+                    # all tasks are known now, check the dependencies of them.
+                    self.prepare()
+                continue
+            if source[1] is not None:
+                source[1] = max(source[1] - 1, 0)
+            self.add_task(task)
+            with self.__lock:
+                if task.status in (TaskStatus.EXITED, TaskStatus.EXCEPTION):
+                    # finished when added, such as recovered from journal.
+                    self.__finished_sources.append(task.task_id)
+                else:
+                    self.__source_ids.add(task.task_id)
+            count += 1
+        if count > 0:
+            self.prepare()
+        return count
+
+    def __release_finished(self) -> None:
+        with self.__lock:
+            for _ in range(len(self.__finished_sources)):
+                task_id = self.__finished_sources.popleft()
+                task = self.task_index.get(task_id)
+                if task is None:
+                    continue
+                if task.status not in (TaskStatus.EXITED, TaskStatus.EXCEPTION):
+                    # the failed task has not been moved to ``TaskStatus.EXCEPTION`` by scheduler yet.
+                    self.__finished_sources.append(task_id)
+                    continue
+                self.tasks[task.status].pop(task_id)
+                del self.task_index[task_id]
+                self.priorities.pop(task_id, None)
+                self.dependents.pop(task_id, None)
+
+    def __mark_finished(self, task_id: Union[int, str]) -> None:
+        if task_id in self.__source_ids:
+            self.__source_ids.discard(task_id)
+            self.__finished_sources.append(task_id)
+
+    def total_number(self) -> Union[int, None]:
+        """
+        The total number of tasks in this group, includes the tasks which has not been materialized from sources.
+
+        :return: an integer value or None if the total number of some sources is unknown.
+        """
+        total = self.task_number
+        for _, remaining in self.sources:
+            if remaining is None:
+                return None
+            total += remaining
+        return total
+
+    def prepare(self) -> None:
+        """
+        Check dependencies and compute the scheduling priority of tasks.
+        *This method cannot be called by user.*
+
+        An exception will be threw if some dependencies not exist in this group or there is a circular dependency. The
+        check of dependencies is delayed until all task sources are exhausted. The priorities are recomputed only if
+        dependencies were added since the last call.
+
+        :return:
+        """
+        with self.__lock:
+            if self.__priorities_stale:
+                self.__compute_priorities()
+                self.__priorities_stale = False
+        if len(self.sources) == 0:
+            for task in self.tasks[TaskStatus.BLOCKED].values():
+                for dependency_id in task.dependencies:
+                    if dependency_id not in self.task_index and dependency_id not in self.result:
+                        raise ValueError("dependency[%s] of task[%s] not exists in group."
+                                         % (str(dependency_id), str(task.task_id)))
+
+    def priority(self, task_id: Union[int, str]) -> int:
+        """
+        The scheduling priority of task, it is the length of the longest dependent chain start from this task, so the
+        tasks on the critical path have the highest priority.
 
-        self.tasks[task.status][task.task_id] = task
-        self.task_number += 1
+        :param task_id: the id of task
+        :return: an integer value, the task without dependents has priority 1.
+        """
+        return self.priorities.get(task_id, 1)
+
+    def __compute_priorities(self) -> None:
+        """
+        Compute the priorities of all tasks in a topological pass from the tasks without dependents, it's O(V+E). The
+        tasks left unvisited are in or behind a circular dependency.
+        """
+        # task id -> the number of its dependents not visited yet
+        counts = dict.fromkeys(self.task_index, 0)
+        for task in self.task_index.values():
+            for dependency_id in task.dependencies:
+                if dependency_id in counts:
+                    counts[dependency_id] += 1
+        priorities = dict.fromkeys(self.task_index, 1)
+        queue = collections.deque(task_id for task_id, count in counts.items() if count == 0)
+        while len(queue) > 0:
+            task_id = queue.popleft()
+            for dependency_id in self.task_index[task_id].dependencies:
+                if dependency_id not in counts:
+                    continue
+                priorities[dependency_id] = max(priorities[dependency_id], priorities[task_id] + 1)
+                counts[dependency_id] -= 1
+                if counts[dependency_id] == 0:
+                    queue.append(dependency_id)
+        unvisited = [task_id for task_id, count in counts.items() if count > 0]
+        if len(unvisited) > 0:
+            # every unvisited task has an unvisited dependent, follow them until a task repeats.
+            dependents = {}
+            for task_id in unvisited:
+                for dependency_id in self.task_index[task_id].dependencies:
+                    if counts.get(dependency_id, 0) > 0:
+                        dependents[dependency_id] = task_id
+            task_id, seen = unvisited[0], set()
+            while task_id not in seen:
+                seen.add(task_id)
+                task_id = dependents[task_id]
+            raise ValueError("circular dependency found at task[%s]." % str(task_id))
+        self.priorities = priorities
+        for task_id, task in self.task_index.items():
+            self.tasks[task.status].update(task_id, priorities[task_id])
+
+    def __resolve_dependents(self, task_id: Union[int, str], success: bool) -> None:
+        # the failure is propagated along dependent chains by a queue instead of recursion, the chains can be long.
+        with self.__lock:
+            queue = collections.deque([(task_id, success)])
+            while len(queue) > 0:
+                task_id, success = queue.popleft()
+                for dependent_id in self.dependents.get(task_id, ()):
+                    task = self.tasks[TaskStatus.BLOCKED].get(dependent_id)
+                    if task is not None and self.__update_dependency(task, success):
+                        queue.append((dependent_id, False))
+
+    def __update_dependency(self, task: Task, success: bool) -> bool:
+        """
+        Count a done dependency of a blocked task.
+
+        :return: if the task failed because of its dependencies, its dependents are not resolved yet.
+        """
+        state = self.dependency_states[task.task_id]
+        if success:
+            state[0] += 1
+        else:
+            state[1] += 1
+        required = task.required_dependencies
+        if required is None:
+            required = len(task.dependencies)
+        if state[0] >= required:
+            self.dependency_states.pop(task.task_id)
+            self.move_task(task.task_id, TaskStatus.BLOCKED, TaskStatus.INIT)
+        elif len(task.dependencies) - state[1] < required:
+            self.dependency_states.pop(task.task_id)
+            self.move_task(task.task_id, TaskStatus.BLOCKED, TaskStatus.EXCEPTION)
+            self.__record_exception(task.task_id, "dependency", "DependenciesFailed")
+            return True
+        return False
 
     def get_task(self, task_id: Union[int, str]) -> Union[Task, None]:
         """
@@ -107,11 +500,7 @@ class TaskGroup(object):
         :param task_id: the unique task id.
         :return: an instance of ``Task`` or None if not found.
         """
-        for k, v in self.tasks.items():
-            task = v.get(task_id)
-            if task is not None:
-                return v.get(task_id)
-        return None
+        return self.task_index.get(task_id)
 
     def move_task(self, task_id: Union[int, str], _from: TaskStatus, _to: TaskStatus) -> None:
         """
@@ -124,11 +513,14 @@ class TaskGroup(object):
         :param _to: the status move to
         :return:
         """
-        if task_id not in self.tasks[_from]:
-            raise ValueError("task id %s not exists in %s status" % (str(task_id), _from.name))
-        task = self.tasks[_from].pop(task_id)
-        self.tasks[_to][task_id] = task
-        task.status = _to
+        with self.__lock:
+            if task_id not in self.tasks[_from]:
+                raise ValueError("task id %s not exists in %s status" % (str(task_id), _from.name))
+            task = self.tasks[_from].pop(task_id)
+            self.tasks[_to].add(task, self.priority(task_id))
+            task.status = _to
+        if self.journal is not None:
+            self.journal.record(task_id, _to)
 
     def report_finish(self, task_id: Union[int, str], data=None) -> None:
         """
@@ -138,12 +530,21 @@ class TaskGroup(object):
         :param data: extra report data
         :return:
         """
-        self.success_number += 1
+        with self.__lock:
+            self.success_number += 1
         if data is None:
             data = {}
+        if self.journal is not None:
+            task = self.get_task(task_id)
+            self.journal.record(task_id, TaskStatus.FINISHED, {
+                "report": data,
+                "result": task.result if task is not None else {},
+                "items": task.items if task is not None else {}
+            })
         load_time = data["load_time"] if "load_time" in data else -1
         train_time = data["train_time"] if "train_time" in data else -1
         real_data = data["data"] if "data" in data else {}
+        self.__adjust_memory(real_data.get("peak_memory"))
         train_acc = real_data.pop("train_acc") if "train_acc" in data else -1
         val_acc = real_data.pop("val_acc") if "val_acc" in data else -1
         res = {
@@ -156,7 +557,37 @@ class TaskGroup(object):
                 "train_time": self.__time_format(train_time)
             }
         }
-        self.result[task_id] = res
+        with self.__lock:
+            self.result[task_id] = res
+            self.__resolve_dependents(task_id, True)
+        task = self.get_task(task_id)
+        for callback in self.finish_callbacks:
+            try:
+                callback(task)
+            except Exception:
+                self.logger.exception("finish callback of task[%s] failed", str(task_id))
+        with self.__lock:
+            self.__mark_finished(task_id)
+
+    def __adjust_memory(self, peak_memory) -> None:
+        """
+        Adjust the estimate memory of this group by the peak memory reported by a finished task(such as the
+        ``peak_memory`` in the result of ``SupervisedTrainer.train``), if ``scheduler.auto-adjust`` is enabled.
+
+        :param peak_memory: a dict ``{"host": bytes, "cuda": bytes}``.
+        :return:
+        """
+        if not isinstance(peak_memory, dict):
+            return
+        host, cuda = peak_memory.get("host"), peak_memory.get("cuda")
+        if self.auto_adjust_memory and host:
+            if type(self.estimate_memory) != int or host > self.estimate_memory:
+                self.estimate_memory = host
+                self.logger.info("adjust estimate memory of group %s to %d bytes", self.group_name, host)
+        if self.auto_adjust_cuda_memory and cuda:
+            if type(self.estimate_cuda_memory) != int or cuda > self.estimate_cuda_memory:
+                self.estimate_cuda_memory = cuda
+                self.logger.info("adjust estimate cuda memory of group %s to %d bytes", self.group_name, cuda)
 
     def __time_format(self, milliseconds):
         if milliseconds is None or milliseconds < 0:
@@ -178,7 +609,18 @@ class TaskGroup(object):
         :param message: exception message
         :return:
         """
-        self.failed_number += 1
+        with self.__lock:
+            self.__record_exception(task_id, stage, message)
+            self.__resolve_dependents(task_id, False)
+
+    def __record_exception(self, task_id: Union[int, str], stage: str, message: str) -> None:
+        with self.__lock:
+            self.failed_number += 1
+        if self.journal is not None:
+            self.journal.record(task_id, TaskStatus.EXCEPTION, {
+                "stage": stage,
+                "message": message
+            })
         res = {
             "type": "fail",
             "data": {
@@ -186,7 +628,9 @@ class TaskGroup(object):
                 "message": message
             }
         }
-        self.result[task_id] = res
+        with self.__lock:
+            self.result[task_id] = res
+            self.__mark_finished(task_id)
 
     def finished(self) -> bool:
         """
@@ -194,7 +638,7 @@ class TaskGroup(object):
 
         :return: a bool value
         """
-        return self.success_number + self.failed_number >= self.task_number
+        return len(self.sources) == 0 and self.success_number + self.failed_number >= self.task_number
 
     def numbers(self):
         """
@@ -211,14 +655,10 @@ class TaskGroup(object):
 
     def retrieve_task(self, status) -> Union[Task, None]:
         """
-        randomly retrieve a task which has ``status``.
+        randomly retrieve a task which has ``status``, the tasks with the highest priority are preferred.
 
         :param status: which status task need
         :return: the task retrieved or None if not found.
         """
-        tasks = self.tasks[status]
-        keys = list(tasks.keys())
-        if len(keys) > 0:
-            idx = random.randint(0, len(keys) - 1)
-            return tasks[keys[idx]]
-        return None
+        with self.__lock:
+            return self.tasks[status].random()
@@ -13,6 +13,7 @@ import os
 
 from fedflow.config import Config
 from fedflow.context import WorkDirContext
+from fedflow.core.cluster import Coordinator
 from fedflow.core.message import MessageListener
 from fedflow.core.scheduler import GroupScheduler
 from fedflow.core.taskgroup import Task, TaskGroup
@@ -26,9 +27,16 @@ class FedFlow(object):
 
     groups = []
 
-    def __init__(self):
+    def __init__(self, resume: bool = False):
+        """
+        Construct a flow.
+
+        :param resume: resume the groups from their journals, the tasks finished in previous run will not run again.
+            It only works for tasks with a fixed ``task_id``.
+        """
         super(FedFlow, self).__init__()
         self.in_working = False
+        self.resume = resume
         self.__pre_workdir = None
 
     def __enter__(self):
@@ -46,8 +54,12 @@ class FedFlow(object):
         os.chdir(workdir)
 
         MessageListener.start()
+        if Config.get_property("cluster.enable"):
+            Coordinator.start(workdir=os.curdir)
 
     def close(self):
+        if Config.get_property("cluster.enable"):
+            Coordinator.stop()
         MessageListener.stop()
         os.chdir(self.__pre_workdir)
         self.in_working = False
@@ -59,9 +71,9 @@ class FedFlow(object):
             os.makedirs(group.group_name, exist_ok=True)
             with WorkDirContext(group.group_name):
                 group.workdir = os.path.abspath(".")
-                GroupScheduler.schedule(group)
+                GroupScheduler.schedule(group, self.resume)
         else:
-            GroupScheduler.schedule(group)
+            GroupScheduler.schedule(group, self.resume)
 
     def execute_task(self, task: Task):
         if not self.in_working:
@@ -71,7 +83,7 @@ class FedFlow(object):
         os.makedirs(group.group_name, exist_ok=True)
         with WorkDirContext(group.group_name):
             group.workdir = os.path.abspath(".")
-            GroupScheduler.schedule(group)
+            GroupScheduler.schedule(group, self.resume)
 
     @classmethod
     def add_group(cls, group: TaskGroup) -> None:
@@ -85,10 +97,11 @@ class FedFlow(object):
         group.index = len(cls.groups)
 
     @classmethod
-    def start(cls) -> None:
+    def start(cls, resume: bool = False) -> None:
         """
         Start schedule tasks
 
+        :param resume: resume the groups from their journals.
         :return:
         """
         workdir = Config.get_property("workdir")
@@ -97,14 +110,18 @@ class FedFlow(object):
         os.chdir(workdir)
 
         MessageListener.start()
+        if Config.get_property("cluster.enable"):
+            Coordinator.start(workdir=os.curdir)
 
         for g in cls.groups:
             if Config.get_property("task.directory-grouping"):
                 os.makedirs(g.group_name, exist_ok=True)
                 with WorkDirContext(g.group_name):
                     g.workdir = os.path.abspath(".")
-                    GroupScheduler.schedule(g)
+                    GroupScheduler.schedule(g, resume)
             else:
-                GroupScheduler.schedule(g)
+                GroupScheduler.schedule(g, resume)
 
+        if Config.get_property("cluster.enable"):
+            Coordinator.stop()
         MessageListener.stop()
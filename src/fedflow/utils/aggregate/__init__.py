@@ -0,0 +1,20 @@
+"""
+Aggregation
+=============
+
+Some classes or methods for aggregating the parameters of clients.
+"""
+__all__ = [
+    "FedAvgAggregator",
+    "load_state_dict",
+    "fedavg",
+    "ParallelFedAvgAggregator",
+    "parallel_fedavg",
+    "BufferedAsyncAggregator",
+    "UpdateCodec"
+]
+
+from fedflow.utils.aggregate.buffered import *
+from fedflow.utils.aggregate.compression import *
+from fedflow.utils.aggregate.fedavg import *
+from fedflow.utils.aggregate.parallel import *
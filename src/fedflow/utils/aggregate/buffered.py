@@ -0,0 +1,272 @@
+"""
+Buffered Asynchronous Aggregation
+===================================
+
+Asynchronous federated learning with a buffer of client updates(FedBuff).
+"""
+
+__all__ = [
+    "BufferedAsyncAggregator"
+]
+
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Iterator, Union
+
+import torch
+
+from fedflow.core.task import Task
+from fedflow.utils.aggregate.fedavg import FedAvgAggregator, load_state_dict
+from fedflow.utils.trainer.checkpoint import CheckpointWriter
+
+
+class BufferedAsyncAggregator(object):
+
+    """
+    Aggregate the updates of clients asynchronously.
+
+    Instead of rounds, client tasks are generated continuously by a task source(see ``client_source``), and every
+    client starts from the latest global version when it starts training(see ``checkout``). When a client finished,
+    its update(the difference between its parameters and the version it started from) is folded into a buffer with the
+    weight ``samples * (1 + staleness) ^ -staleness_exponent``, the staleness is the number of versions published
+    since the client started. After every ``buffer_size`` updates, a new global version is published:
+
+    ``global += server_lr * sum(weight * update) / sum(samples)``
+
+    So the devices never wait for the slowest client of a round. The global versions are saved as ``version-N.pth``
+    in ``directory``, and ``latest.json`` points to the newest one.
+
+    >>> aggregator = BufferedAsyncAggregator("global", model.state_dict(), buffer_size=5, max_versions=100)
+    >>> group = TaskGroup("async")
+    >>> group.add_task_source(aggregator.client_source(lambda i: ClientTask(i, aggregator.directory)))
+    >>> group.add_finish_callback(aggregator.on_finish)
+
+    The client task should load ``checkout(directory)`` when it starts training, and return the version in its result
+    as ``base_version``.
+
+    The updates passed to ``on_finish`` are folded by a background thread, so the scheduler is not blocked by loading
+    and saving parameters. Call ``flush`` after training to wait for them and publish the last version.
+    """
+
+    logger = logging.getLogger("fedflow.aggregate")
+
+    def __init__(self, directory: str, init_state_dict: Union[dict, str], *,
+                 buffer_size: int = 10,
+                 max_versions: int = None,
+                 max_clients: int = None,
+                 staleness_exponent: float = 0.5,
+                 max_staleness: int = None,
+                 server_lr: float = 1.0,
+                 parameter_file: str = "parameter.pth"):
+        """
+        Construct an aggregator, the initial parameters are published as version 0.
+
+        :param directory: the directory of global versions.
+        :param init_state_dict: the initial global parameters or their path.
+        :param buffer_size: the number of client updates aggregated into every version.
+        :param max_versions: stop generating clients after this number of versions published.
+        :param max_clients: stop generating clients after this number of clients generated. At least one of
+            ``max_versions`` and ``max_clients`` is required.
+        :param staleness_exponent: the exponent of staleness discount, 0 means no discount.
+        :param max_staleness: the updates staler than it are dropped, and the versions which cannot be the base of
+            accepted updates are deleted, except the newest of them, which may still be loaded by a client that
+            checked it out just before a new version was published. Default is unlimited and all versions are kept.
+        :param server_lr: the learning rate of applying the aggregated update.
+        :param parameter_file: the file of client parameters in the task workdir.
+        """
+        super(BufferedAsyncAggregator, self).__init__()
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be positive")
+        if max_versions is None and max_clients is None:
+            raise ValueError("at least one of max_versions and max_clients is required")
+        self.directory = os.path.abspath(directory)
+        self.buffer_size = buffer_size
+        self.max_versions = max_versions
+        self.max_clients = max_clients
+        self.staleness_exponent = staleness_exponent
+        self.max_staleness = max_staleness
+        self.server_lr = server_lr
+        self.parameter_file = parameter_file
+
+        self.version = 0
+        self.clients = 0
+        # the number of accepted and dropped updates
+        self.accepted = 0
+        self.dropped = 0
+        # the weighted sum of updates in buffer
+        self.__sum = FedAvgAggregator()
+        self.__samples = 0.0
+        # protects the counters, it's never held while loading or saving parameters
+        self.__lock = threading.RLock()
+        # serializes folding updates and publishing versions
+        self.__update_lock = threading.RLock()
+        # the updates passed to ``on_finish``, they are folded by a worker thread
+        self.__queue = queue.Queue()
+        self.__worker = None
+
+        if type(init_state_dict) == str:
+            init_state_dict = load_state_dict(init_state_dict)
+        self.__save_version(0, CheckpointWriter.snapshot(init_state_dict))
+
+    @classmethod
+    def checkout(cls, directory: str) -> tuple:
+        """
+        The latest global version in directory, it can be called in task process.
+
+        :param directory: the directory of global versions.
+        :return: a tuple ``(version, path)``
+        """
+        with open(os.path.join(directory, "latest.json"), "r") as f:
+            latest = json.load(f)
+        return latest["version"], os.path.join(directory, latest["file"])
+
+    def version_path(self, version: int) -> str:
+        return os.path.join(self.directory, "version-%d.pth" % version)
+
+    def latest_path(self) -> str:
+        return self.version_path(self.version)
+
+    def staleness_weight(self, staleness: int) -> float:
+        """
+        The discount of a stale update.
+
+        :param staleness: the number of versions published since the client started.
+        :return: a float value in (0, 1].
+        """
+        return (1 + staleness) ** -self.staleness_exponent
+
+    def finished(self) -> bool:
+        """
+        If enough versions are published or enough clients are generated.
+
+        :return: a bool value
+        """
+        with self.__lock:
+            if self.max_versions is not None and self.version >= self.max_versions:
+                return True
+            return self.max_clients is not None and self.clients >= self.max_clients
+
+    def client_source(self, factory: Callable[[int], Task]) -> Iterator[Task]:
+        """
+        A task source which generates clients until ``finished``.
+
+        :param factory: a function accepts the client index and returns a client task.
+        :return: a generator of tasks, it can be added by ``TaskGroup.add_task_source``.
+        """
+        while not self.finished():
+            with self.__lock:
+                index = self.clients
+                self.clients += 1
+            yield factory(index)
+
+    def on_finish(self, task: Task) -> None:
+        """
+        The finish callback of client tasks, it can be added by ``TaskGroup.add_finish_callback``.
+
+        The parameters are read from ``parameter_file`` in task workdir, the base version and weight are read from
+        ``base_version`` and ``samples`` in task result. The update is queued and folded by a worker thread, because
+        the callback runs in the message thread of scheduler.
+
+        :param task: the finished client task.
+        :return:
+        """
+        base_version = task.result.get("base_version")
+        if base_version is None:
+            self.logger.warning("task[%s] has no base_version in result, its update is ignored", str(task.task_id))
+            return
+        weight = task.result.get("samples", 1)
+        with self.__lock:
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run, name="buffered-aggregator", daemon=True)
+                self.__worker.start()
+        self.__queue.put((task.task_id, os.path.join(task.workdir, self.parameter_file), base_version, weight))
+
+    def __run(self):
+        while True:
+            task_id, path, base_version, weight = self.__queue.get()
+            try:
+                self.add(path, base_version, weight)
+            except Exception:
+                self.logger.exception("failed to add the update of task[%s]", str(task_id))
+            finally:
+                self.__queue.task_done()
+
+    def add(self, state_dict: Union[dict, str], base_version: int, weight: float = 1.0) -> bool:
+        """
+        Fold the update of a client into buffer, and publish a new version if the buffer is full.
+
+        :param state_dict: the parameters of client or their path.
+        :param base_version: the global version the client started from.
+        :param weight: the weight of client, such as its number of train samples.
+        :return: if the update is accepted.
+        """
+        with self.__update_lock:
+            staleness = self.version - base_version
+            if self.max_staleness is not None and staleness > self.max_staleness:
+                with self.__lock:
+                    self.dropped += 1
+                self.logger.info("drop an update of version %d, staleness %d", base_version, staleness)
+                return False
+            if type(state_dict) == str:
+                state_dict = load_state_dict(state_dict)
+            base = load_state_dict(self.version_path(base_version))
+            update = {k: state_dict[k].double() - v.double() for k, v in base.items()}
+            del state_dict, base
+            self.__sum.add(update, weight * self.staleness_weight(staleness))
+            self.__samples += weight
+            with self.__lock:
+                self.accepted += 1
+            if self.__sum.count >= self.buffer_size:
+                self.__publish()
+            return True
+
+    def flush(self) -> None:
+        """
+        Wait for the updates queued by ``on_finish``, and publish a new version by the updates in buffer, even if the
+        buffer is not full.
+
+        :return:
+        """
+        self.__queue.join()
+        self.__publish()
+
+    def __publish(self):
+        with self.__update_lock:
+            if self.__sum.count == 0 or self.__samples == 0:
+                return
+            update = self.__sum.buffer * (self.server_lr / self.__samples)
+            current = load_state_dict(self.latest_path())
+            state_dict = {}
+            for key, shape, _, offset, numel in self.__sum.layout:
+                value = current[key]
+                new_value = value.double() + update[offset:offset + numel].view(shape)
+                if value.dtype == torch.bool:
+                    new_value = new_value >= 0.5
+                elif not (value.dtype.is_floating_point or value.dtype.is_complex):
+                    new_value = torch.round(new_value)
+                state_dict[key] = new_value.to(value.dtype)
+            del current, update
+            count = self.__sum.count
+            self.__sum.reset()
+            self.__samples = 0.0
+            self.__save_version(self.version + 1, state_dict)
+            self.logger.info("publish version %d with %d updates", self.version, count)
+
+    def __save_version(self, version, state_dict):
+        CheckpointWriter.atomic_save(state_dict, self.version_path(version))
+        latest_path = os.path.join(self.directory, "latest.json")
+        tmp_path = "%s.tmp-%d" % (latest_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"version": version, "file": os.path.basename(self.version_path(version))}))
+        os.replace(tmp_path, latest_path)
+        with self.__lock:
+            self.version = version
+        if self.max_staleness is not None:
+            # the updates based on ``version - max_staleness - 1`` will be dropped, but it's kept until next version,
+            # a client may have checked it out and be still loading it.
+            expired = self.version_path(version - self.max_staleness - 2)
+            if os.path.exists(expired):
+                os.remove(expired)
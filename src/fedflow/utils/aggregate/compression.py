@@ -0,0 +1,205 @@
+"""
+Update Compression
+====================
+
+Encode the parameters of a client as a compressed update relative to the global model.
+"""
+
+__all__ = [
+    "UpdateCodec"
+]
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+
+class UpdateCodec(object):
+
+    """
+    Encode and decode compressed client updates.
+
+    The update of a floating point tensor is its difference from the global model(the base), it's compressed by one of
+    ``METHODS``:
+
+        * fp16: the update in half precision.
+        * int8: the update quantized to int8 with a per-tensor scale.
+        * topk: the ``ratio`` of elements with the largest magnitude and their indices.
+
+    The other tensors(such as ``num_batches_tracked``) are stored as they are. With error feedback, the compression
+    error of a client is added to its next update, so the dropped part of updates is not lost but delayed.
+
+    The encoded object records the path and the hash of base, and ``fedflow.utils.aggregate.load_state_dict`` decodes
+    it transparently, so the base must still exist and be unchanged when aggregating. The verified bases are cached
+    (see ``load_base``), so the base is read only once when the updates of many clients are aggregated.
+    """
+
+    FORMAT = "fedflow.compressed-update"
+    METHODS = ("fp16", "int8", "topk")
+    # the number of cached bases, the clients of asynchronous training may start from different versions.
+    BASE_CACHE_SIZE = 2
+
+    __bases = OrderedDict()
+    __bases_lock = threading.Lock()
+
+    @classmethod
+    def is_compressed(cls, obj) -> bool:
+        return isinstance(obj, dict) and obj.get("format") == cls.FORMAT
+
+    @classmethod
+    def encode(cls, state_dict: dict, base_path: str, method: str = "int8", ratio: float = 0.01,
+               residual: dict = None) -> tuple:
+        """
+        Encode the parameters of a client.
+
+        :param state_dict: the parameters of client, the tensors should be in cpu memory.
+        :param base_path: the path of global parameters the client started from.
+        :param method: the compression method, see ``METHODS``.
+        :param ratio: the ratio of kept elements, only used by ``topk``.
+        :param residual: the compression error of previous update, None means no error feedback.
+        :return: a tuple ``(encoded, residual)``, the residual is the compression error of this update.
+        """
+        if method not in cls.METHODS:
+            raise ValueError("method only accepts %s" % ", ".join(cls.METHODS))
+        base, base_hash = cls.load_base(base_path)
+        residual = residual if residual is not None else {}
+        tensors, new_residual = {}, {}
+        for key, value in state_dict.items():
+            base_value = base.get(key)
+            if base_value is None or base_value.shape != value.shape or not value.dtype.is_floating_point:
+                tensors[key] = {"raw": value}
+                continue
+            update = value.float() - base_value.float()
+            if key in residual and residual[key].shape == update.shape:
+                update += residual[key]
+            entry = cls.__encode_tensor(update, method, ratio)
+            tensors[key] = entry
+            new_residual[key] = update - cls.__decode_tensor(entry, update.shape)
+        encoded = {
+            "format": cls.FORMAT,
+            "method": method,
+            "base": os.path.abspath(base_path),
+            "base_hash": base_hash,
+            "tensors": tensors
+        }
+        return encoded, new_residual
+
+    @classmethod
+    def decode(cls, encoded: dict, base: dict = None) -> dict:
+        """
+        Decode the parameters of a client.
+
+        :param encoded: the object returned by ``encode``.
+        :param base: the global parameters the update was encoded against, default is loaded from the base path
+            recorded in ``encoded``.
+        :return: a state dict.
+        """
+        if base is None:
+            base, _ = cls.load_base(encoded["base"], encoded["base_hash"])
+        state_dict = {}
+        for key, entry in encoded["tensors"].items():
+            if "raw" in entry:
+                state_dict[key] = entry["raw"]
+                continue
+            base_value = base[key]
+            update = cls.__decode_tensor(entry, base_value.shape).to(base_value.device)
+            state_dict[key] = (base_value.float() + update).to(base_value.dtype)
+        return state_dict
+
+    @classmethod
+    def load_base(cls, path: str, base_hash: str = None) -> tuple:
+        """
+        Load and verify the base of updates.
+
+        The bases are cached by path, size and modification time, so they are not read and hashed again for every
+        update. A file modified in the last second is not cached, because its modification time may be unchanged if
+        it's overwritten again so quickly.
+
+        :param path: the path of base.
+        :param base_hash: the expected hash of base, None means no verification.
+        :return: a tuple ``(state_dict, hash)``, the state dict is shared by callers, it must not be modified.
+        """
+        from fedflow.utils.aggregate.fedavg import load_state_dict
+
+        if not os.path.exists(path):
+            raise ValueError("the base %s of compressed update does not exist" % path)
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with cls.__bases_lock:
+            cached = cls.__bases.get(key)
+            if cached is not None:
+                cls.__bases.move_to_end(key)
+        if cached is None:
+            cached = (load_state_dict(path), cls.file_hash(path))
+            if time.time() - stat.st_mtime > 1:
+                # the loaded tensors are memory-mapped, copy them before the file is overwritten.
+                cached = ({k: v.clone() if isinstance(v, torch.Tensor) else v for k, v in cached[0].items()},
+                          cached[1])
+                with cls.__bases_lock:
+                    cls.__bases[key] = cached
+                    while len(cls.__bases) > cls.BASE_CACHE_SIZE:
+                        cls.__bases.popitem(last=False)
+        state_dict, file_hash = cached
+        if base_hash is not None and file_hash != base_hash:
+            raise ValueError("the base %s of compressed update has been overwritten after encoding" % path)
+        return state_dict, file_hash
+
+    @classmethod
+    def file_hash(cls, path: str) -> str:
+        """
+        The sha256 of a file, it identifies the base of an update.
+
+        :param path: the file path.
+        :return: a hex string.
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    @classmethod
+    def nbytes(cls, obj) -> int:
+        """
+        The total bytes of tensors in obj.
+
+        :param obj: a tensor, or a dict/list/tuple contains tensors.
+        :return: an integer value.
+        """
+        if isinstance(obj, torch.Tensor):
+            return obj.numel() * obj.element_size()
+        if isinstance(obj, dict):
+            return sum(cls.nbytes(v) for v in obj.values())
+        if isinstance(obj, (list, tuple)):
+            return sum(cls.nbytes(v) for v in obj)
+        return 0
+
+    @classmethod
+    def __encode_tensor(cls, update, method, ratio):
+        if method == "fp16":
+            return {"fp16": update.half()}
+        if method == "int8":
+            scale = update.abs().max().item() / 127 if update.numel() > 0 else 0.0
+            if scale == 0:
+                scale = 1.0
+            return {"int8": torch.round(update / scale).clamp(-127, 127).to(torch.int8), "scale": scale}
+        flat = update.reshape(-1)
+        k = min(flat.numel(), max(1, int(math.ceil(ratio * flat.numel()))))
+        indices = flat.abs().topk(k).indices
+        index_dtype = torch.int32 if flat.numel() < 2 ** 31 else torch.int64
+        return {"indices": indices.to(index_dtype), "values": flat[indices]}
+
+    @classmethod
+    def __decode_tensor(cls, entry, shape):
+        if "fp16" in entry:
+            return entry["fp16"].float().view(shape)
+        if "int8" in entry:
+            return (entry["int8"].float() * entry["scale"]).view(shape)
+        update = torch.zeros(shape, dtype=torch.float32, device=entry["values"].device)
+        update.view(-1)[entry["indices"].long()] = entry["values"]
+        return update
@@ -0,0 +1,179 @@
+"""
+FedAvg
+========
+
+Streaming weighted averaging of model parameters.
+"""
+
+__all__ = [
+    "FedAvgAggregator",
+    "load_state_dict",
+    "fedavg"
+]
+
+from typing import Iterable, Union
+
+import torch
+
+from fedflow.utils.aggregate.compression import UpdateCodec
+
+
+def load_state_dict(path: str) -> dict:
+    """
+    Load a state dict to cpu. The file is memory-mapped, so the tensors are paged in lazily instead of being read into
+    memory at once. The compressed updates(see ``UpdateCodec``) are decoded.
+
+    :param path: the path of state dict.
+    :return: the state dict.
+    """
+    try:
+        state_dict = torch.load(path, map_location="cpu", mmap=True)
+    except RuntimeError:
+        # the legacy file format cannot be memory-mapped.
+        state_dict = torch.load(path, map_location="cpu")
+    if UpdateCodec.is_compressed(state_dict):
+        state_dict = UpdateCodec.decode(state_dict)
+    return state_dict
+
+
+class FedAvgAggregator(object):
+
+    """
+    Compute the weighted average of state dicts one by one.
+
+    All tensors are accumulated into a single flattened float64 buffer, so the memory is O(1) models no matter how many
+    state dicts are added. The values of integer tensors(such as ``num_batches_tracked`` of ``BatchNorm``) are rounded
+    to the nearest integer in result.
+
+    >>> aggregator = FedAvgAggregator()
+    >>> for task in tasks:
+    >>>     aggregator.add(os.path.join(task.workdir, "parameter.pth"), weight=task.result["samples"])
+    >>> torch.save(aggregator.result(), "aggregate.pth")
+    """
+
+    def __init__(self, buffer: torch.Tensor = None):
+        """
+        Construct an aggregator.
+
+        :param buffer: a flattened float64 tensor which holds the running sum, such as a tensor in shared memory. It's
+            cleared when the layout is initialized. Default is allocated by the first state dict.
+        """
+        super(FedAvgAggregator, self).__init__()
+        # the list of (key, shape, dtype, offset, numel)
+        self.layout = None
+        self.buffer = buffer
+        self.total_weight = 0.0
+        self.count = 0
+
+    def add(self, state_dict: Union[dict, str], weight: float = 1.0) -> None:
+        """
+        Add a state dict to the running weighted sum.
+
+        :param state_dict: a state dict or its path.
+        :param weight: the weight of this state dict, such as its number of train samples.
+        :return:
+        """
+        if weight < 0:
+            raise ValueError("weight cannot be negative")
+        if type(state_dict) == str:
+            state_dict = load_state_dict(state_dict)
+        if self.layout is None:
+            self.init_layout(state_dict)
+        elif len(state_dict) != len(self.layout):
+            raise ValueError("the state dict has different keys with previous state dicts")
+        for key, shape, _, offset, numel in self.layout:
+            if key not in state_dict:
+                raise ValueError("%s is absent from the state dict" % key)
+            value = state_dict[key]
+            if value.shape != shape:
+                raise ValueError("the shape of %s is %s, expected %s" % (key, tuple(value.shape), tuple(shape)))
+            self.buffer[offset:offset + numel].add_(value.reshape(-1).to(torch.float64), alpha=weight)
+        self.total_weight += weight
+        self.count += 1
+
+    def add_sum(self, buffer: torch.Tensor, total_weight: float, count: int = 1) -> None:
+        """
+        Add a partial weighted sum, which is the ``buffer`` of another aggregator with the same layout.
+
+        :param buffer: the flattened float64 weighted sum.
+        :param total_weight: the total weight of the partial sum.
+        :param count: the number of state dicts in the partial sum.
+        :return:
+        """
+        if self.buffer is None:
+            raise ValueError("the layout is unknown, add a state dict first")
+        self.buffer.add_(buffer)
+        self.total_weight += total_weight
+        self.count += count
+
+    def result(self) -> dict:
+        """
+        The weighted average of added state dicts.
+
+        :return: a state dict whose tensors have the same dtypes with the added state dicts.
+        """
+        if self.count == 0 or self.total_weight == 0:
+            raise ValueError("no state dict with positive weight is added")
+        average = self.buffer / self.total_weight
+        result = {}
+        for key, shape, dtype, offset, numel in self.layout:
+            value = average[offset:offset + numel].view(shape)
+            if dtype == torch.bool:
+                value = value >= 0.5
+            elif not (dtype.is_floating_point or dtype.is_complex):
+                value = torch.round(value)
+            result[key] = value.to(dtype)
+        return result
+
+    def reset(self) -> None:
+        """
+        Clear the running sum, the layout is kept.
+
+        :return:
+        """
+        if self.buffer is not None:
+            self.buffer.zero_()
+        self.total_weight = 0.0
+        self.count = 0
+
+    def init_layout(self, state_dict: dict) -> None:
+        """
+        Initialize the keys, shapes and dtypes of aggregated state dicts, and clear the running sum. It's called by the
+        first ``add`` automatically.
+
+        :param state_dict: a state dict as the template.
+        :return:
+        """
+        layout = []
+        offset = 0
+        for key, value in state_dict.items():
+            numel = value.numel()
+            layout.append((key, value.shape, value.dtype, offset, numel))
+            offset += numel
+        if self.buffer is None:
+            self.buffer = torch.zeros(offset, dtype=torch.float64)
+        elif self.buffer.numel() != offset or self.buffer.dtype != torch.float64:
+            raise ValueError("the buffer must be a float64 tensor with %d elements" % offset)
+        else:
+            self.buffer.zero_()
+        self.layout = layout
+        self.total_weight = 0.0
+        self.count = 0
+
+
+def fedavg(state_dicts: Iterable[Union[dict, str]], weights: Iterable[float] = None) -> dict:
+    """
+    Compute the weighted average of state dicts by ``FedAvgAggregator``.
+
+    :param state_dicts: an iterable of state dicts or their paths, they are loaded one by one.
+    :param weights: the weights of state dicts, default is equal weights.
+    :return: the averaged state dict.
+    """
+    aggregator = FedAvgAggregator()
+    if weights is None:
+        for sd in state_dicts:
+            aggregator.add(sd)
+    else:
+        for sd, w in zip(state_dicts, weights):
+            aggregator.add(sd, w)
+    return aggregator.result()
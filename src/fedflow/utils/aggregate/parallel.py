@@ -0,0 +1,173 @@
+"""
+Parallel FedAvg
+=================
+
+Weighted averaging of model parameters by a tree reduction across a pool of processes.
+"""
+
+__all__ = [
+    "ParallelFedAvgAggregator",
+    "parallel_fedavg"
+]
+
+import multiprocessing
+import os
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable
+
+import torch
+
+from fedflow.utils.aggregate.fedavg import FedAvgAggregator, load_state_dict
+
+
+def _init_worker():
+    # every worker handles its own partial sum, so the intra-op threads only oversubscribe cpu.
+    torch.set_num_threads(1)
+
+
+def _attach(name, numel):
+    shm = SharedMemory(name=name)
+    return shm, torch.frombuffer(shm.buf, dtype=torch.float64, count=numel)
+
+
+def _reduce_chunk(name, numel, paths, weights):
+    shm, buffer = _attach(name, numel)
+    try:
+        aggregator = FedAvgAggregator(buffer)
+        for path, weight in zip(paths, weights):
+            aggregator.add(path, weight)
+        ret = aggregator.total_weight, aggregator.count
+        del aggregator
+    finally:
+        # the memory view cannot be released while a tensor refers to it.
+        del buffer
+        shm.close()
+    return ret
+
+
+def _reduce_pair(dst_name, src_name, numel):
+    dst_shm, dst = _attach(dst_name, numel)
+    src_shm, src = _attach(src_name, numel)
+    try:
+        dst.add_(src)
+    finally:
+        del dst, src
+        dst_shm.close()
+        src_shm.close()
+
+
+class ParallelFedAvgAggregator(object):
+
+    """
+    Compute the weighted average of state dict files by a pool of processes.
+
+    The files are split into one contiguous chunk per process, and every process streams its chunk into a partial
+    weighted sum in shared memory, just like ``FedAvgAggregator``. Then the partial sums are reduced in pairs as a
+    binary tree, so the critical path is ``N / P`` loads plus ``log2(P)`` additions instead of ``N`` loads.
+
+    The memory is O(P) models. The processes are started by a fork server(or spawned if it's unsupported) instead of
+    forked, because the caller may have running threads(such as the message listener), and the workers only need the
+    names of shared memory and the file paths. The aggregator should be used in a non-daemonic process, such as a task
+    process or the main process.
+
+    >>> aggregator = ParallelFedAvgAggregator(processes=8)
+    >>> for task in tasks:
+    >>>     aggregator.add(os.path.join(task.workdir, "parameter.pth"), weight=task.result["samples"])
+    >>> torch.save(aggregator.result(), "aggregate.pth")
+    """
+
+    def __init__(self, processes: int = None):
+        """
+        Construct an aggregator.
+
+        :param processes: the number of processes, default is the number of cpus.
+        """
+        super(ParallelFedAvgAggregator, self).__init__()
+        self.processes = processes if processes is not None else (os.cpu_count() or 1)
+        if self.processes < 1:
+            raise ValueError("processes must be positive")
+        self.paths = []
+        self.weights = []
+
+    def add(self, path: str, weight: float = 1.0) -> None:
+        """
+        Add a state dict file. The file is not loaded until ``result`` is called.
+
+        :param path: the path of state dict.
+        :param weight: the weight of this state dict, such as its number of train samples.
+        :return:
+        """
+        if type(path) != str:
+            raise TypeError("only the path of state dict is supported by parallel aggregation")
+        if weight < 0:
+            raise ValueError("weight cannot be negative")
+        self.paths.append(path)
+        self.weights.append(weight)
+
+    def result(self) -> dict:
+        """
+        The weighted average of added state dicts.
+
+        :return: a state dict whose tensors have the same dtypes with the added state dicts.
+        """
+        processes = min(self.processes, len(self.paths))
+        if processes <= 1:
+            aggregator = FedAvgAggregator()
+            for path, weight in zip(self.paths, self.weights):
+                aggregator.add(path, weight)
+            return aggregator.result()
+
+        chunk = (len(self.paths) + processes - 1) // processes
+        # no process is left with an empty chunk.
+        processes = (len(self.paths) + chunk - 1) // chunk
+        aggregator = FedAvgAggregator()
+        aggregator.init_layout(load_state_dict(self.paths[0]))
+        numel = aggregator.buffer.numel()
+        # the segments are created before the pool, so the workers share the resource tracker of this process.
+        segments = [SharedMemory(create=True, size=max(1, numel * 8)) for _ in range(processes)]
+        try:
+            names = [shm.name for shm in segments]
+            chunks = [(names[i], numel, self.paths[i * chunk:(i + 1) * chunk], self.weights[i * chunk:(i + 1) * chunk])
+                      for i in range(processes)]
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # the workers are forked from a server which has imported pytorch, instead of importing it again.
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            with context.Pool(processes, initializer=_init_worker) as pool:
+                totals = pool.starmap(_reduce_chunk, chunks)
+                stride = 1
+                while stride < processes:
+                    pairs = [(names[i], names[i + stride], numel)
+                             for i in range(0, processes - stride, 2 * stride)]
+                    pool.starmap(_reduce_pair, pairs)
+                    stride *= 2
+
+            root = torch.frombuffer(segments[0].buf, dtype=torch.float64, count=numel)
+            aggregator.add_sum(root, sum(t[0] for t in totals), sum(t[1] for t in totals))
+            del root
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+        return aggregator.result()
+
+
+def parallel_fedavg(paths: Iterable[str], weights: Iterable[float] = None, processes: int = None) -> dict:
+    """
+    Compute the weighted average of state dict files by ``ParallelFedAvgAggregator``.
+
+    :param paths: the paths of state dicts.
+    :param weights: the weights of state dicts, default is equal weights.
+    :param processes: the number of processes, default is the number of cpus.
+    :return: the averaged state dict.
+    """
+    aggregator = ParallelFedAvgAggregator(processes)
+    if weights is None:
+        for path in paths:
+            aggregator.add(path)
+    else:
+        for path, weight in zip(paths, weights):
+            aggregator.add(path, weight)
+    return aggregator.result()
@@ -5,7 +5,22 @@ Trainers
 Some classes or methods for training.
 """
 __all__ = [
-    "SupervisedTrainer"
+    "SupervisedTrainer",
+    "Metric",
+    "TopKAccuracy",
+    "PerClassAccuracy",
+    "ConfusionMatrix",
+    "CheckpointWriter",
+    "ResumableRandomSampler",
+    "EarlyStopping",
+    "StepTimer",
+    "VectorizedTrainer"
 ]
 
+from fedflow.utils.trainer.checkpoint import *
+from fedflow.utils.trainer.early_stopping import *
+from fedflow.utils.trainer.metrics import *
+from fedflow.utils.trainer.sampler import *
 from fedflow.utils.trainer.supervised_trainer import *
+from fedflow.utils.trainer.timer import *
+from fedflow.utils.trainer.vmap_trainer import *
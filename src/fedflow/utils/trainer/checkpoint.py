@@ -0,0 +1,161 @@
+"""
+Checkpoint
+============
+
+A background writer of checkpoints.
+
+The state dicts are copied to cpu memory when saving, then the writer thread writes them to disk, so training doesn't
+wait on the filesystem. Every file is written to a temporary file and atomically renamed, a checkpoint file is either
+complete or not exists.
+"""
+
+__all__ = [
+    "CheckpointWriter"
+]
+
+import os
+import queue
+import threading
+
+import torch
+
+
+class CheckpointWriter(object):
+
+    """
+    A writer which saves checkpoints in a background thread, and removes the stale checkpoints by a retention policy.
+
+    The checkpoints saved with an ``epoch`` are managed by retention policy: the last ``keep_last`` checkpoints and the
+    best ``keep_best`` checkpoints(by score) are kept, the others are removed.
+    """
+
+    def __init__(self, keep_last: int = None, keep_best: int = 0, mode: str = "max"):
+        """
+        Construct a checkpoint writer.
+
+        :param keep_last: the number of latest checkpoints to keep, None means keep all checkpoints.
+        :param keep_best: the number of best checkpoints to keep.
+        :param mode: ``"max"`` means higher score is better, ``"min"`` means lower score is better.
+        """
+        super(CheckpointWriter, self).__init__()
+        if mode not in ("max", "min"):
+            raise ValueError("mode only accepts 'max' or 'min'")
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.mode = mode
+        # the list of (epoch, score, paths) of retained checkpoints
+        self.checkpoints = []
+
+        self.__queue = queue.Queue()
+        self.__errors = []
+        self.__thread = threading.Thread(target=self.__run, name="checkpoint-writer", daemon=True)
+        self.__thread.start()
+
+    def save(self, files: dict, epoch: int = None, score: float = None) -> None:
+        """
+        Snapshot objects to cpu memory and write them in background.
+
+        :param files: a dict ``{path: obj}``, obj is usually a state dict.
+        :param epoch: the epoch of checkpoint, the checkpoint without epoch is never removed.
+        :param score: the score of checkpoint, it's used for keeping the best checkpoints.
+        :return:
+        """
+        self.__check_errors()
+        snapshot = {path: self.snapshot(obj) for path, obj in files.items()}
+        self.__queue.put((snapshot, epoch, score))
+
+    def flush(self) -> None:
+        """
+        Wait until all checkpoints are written.
+
+        :return:
+        """
+        self.__queue.join()
+        self.__check_errors()
+
+    def close(self) -> None:
+        """
+        Wait until all checkpoints are written and stop the writer thread.
+
+        :return:
+        """
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        self.__check_errors()
+
+    @classmethod
+    def snapshot(cls, obj):
+        """
+        Copy all tensors in obj to cpu memory.
+
+        :param obj: a tensor, or a dict/list/tuple contains tensors.
+        :return: the copy of obj.
+        """
+        if isinstance(obj, torch.Tensor):
+            return obj.detach().to("cpu", copy=True)
+        if isinstance(obj, dict):
+            return type(obj)((k, cls.snapshot(v)) for k, v in obj.items())
+        if isinstance(obj, list):
+            return [cls.snapshot(v) for v in obj]
+        if isinstance(obj, tuple):
+            return tuple(cls.snapshot(v) for v in obj)
+        return obj
+
+    @classmethod
+    def atomic_save(cls, obj, path: str) -> None:
+        """
+        Save obj to a temporary file, then rename it to path.
+
+        :param obj: the object to be saved.
+        :param path: the target path.
+        :return:
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = "%s.tmp-%d" % (path, os.getpid())
+        try:
+            torch.save(obj, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is None:
+                    return
+                snapshot, epoch, score = item
+                for path, obj in snapshot.items():
+                    self.atomic_save(obj, path)
+                if epoch is not None:
+                    self.checkpoints.append((epoch, score, list(snapshot.keys())))
+                    self.__retain()
+            except Exception as e:
+                self.__errors.append(e)
+            finally:
+                self.__queue.task_done()
+
+    def __retain(self):
+        if self.keep_last is None:
+            return
+        kept = set(c[0] for c in self.checkpoints[-self.keep_last:]) if self.keep_last > 0 else set()
+        scored = [c for c in self.checkpoints if c[1] is not None]
+        scored.sort(key=lambda c: c[1], reverse=(self.mode == "max"))
+        kept.update(c[0] for c in scored[:self.keep_best])
+        retained = []
+        for c in self.checkpoints:
+            if c[0] in kept:
+                retained.append(c)
+                continue
+            for path in c[2]:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.checkpoints = retained
+
+    def __check_errors(self):
+        if self.__errors:
+            e = self.__errors.pop(0)
+            raise RuntimeError("failed to write checkpoint") from e
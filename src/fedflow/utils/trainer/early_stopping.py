@@ -0,0 +1,77 @@
+"""
+Early stopping
+================
+
+Stop training when the monitored value stops improving.
+"""
+
+__all__ = [
+    "EarlyStopping"
+]
+
+
+class EarlyStopping(object):
+
+    """
+    Early stopping used by ``SupervisedTrainer``.
+
+    The trainer calls ``step`` after every validation, training is stopped if the monitored value hasn't improved by
+    more than ``min_delta`` for ``patience`` validations.
+    """
+
+    def __init__(self, monitor: str = "val_loss", patience: int = 5, min_delta: float = 0.0, mode: str = None):
+        """
+        Construct an early stopping.
+
+        :param monitor: the monitored value, a field of ``SupervisedTrainer.History`` or a scalar metric such as
+            ``"val_top5_acc"``.
+        :param patience: the number of validations without improvement before stopping.
+        :param min_delta: the minimum change counted as an improvement.
+        :param mode: ``"min"`` or ``"max"``, default is ``"min"`` if monitor ends with ``"loss"``, otherwise
+            ``"max"``.
+        """
+        super(EarlyStopping, self).__init__()
+        if mode is None:
+            mode = "min" if monitor.endswith("loss") else "max"
+        if mode not in ("max", "min"):
+            raise ValueError("mode only accepts 'max' or 'min'")
+        self.monitor = monitor
+        self.patience = patience
+        self.min_delta = abs(min_delta)
+        self.mode = mode
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Clear the state, it's called when training started.
+
+        :return:
+        """
+        self.best = None
+        self.best_epoch = None
+        self.stopped_epoch = None
+        self.wait = 0
+
+    def step(self, epoch: int, value: float) -> bool:
+        """
+        Update the state by a validation result.
+
+        :param epoch: the epoch(start from 1).
+        :param value: the monitored value of this epoch.
+        :return: True if training should be stopped.
+        """
+        if self.best is None or self.__improved(value):
+            self.best = value
+            self.best_epoch = epoch
+            self.wait = 0
+            return False
+        self.wait += 1
+        if self.wait >= self.patience:
+            self.stopped_epoch = epoch
+            return True
+        return False
+
+    def __improved(self, value):
+        if self.mode == "min":
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
@@ -0,0 +1,139 @@
+"""
+Metrics
+=========
+
+Vectorized metrics used by ``SupervisedTrainer``.
+
+All metrics accumulate their states as tensors on the device of model outputs, so updating a metric never synchronizes
+host and device. The states are only copied to host when ``compute`` is called(once per epoch).
+"""
+
+__all__ = [
+    "Metric",
+    "TopKAccuracy",
+    "PerClassAccuracy",
+    "ConfusionMatrix"
+]
+
+import abc
+
+import torch
+
+
+class Metric(object):
+
+    """
+    The basic class of metrics.
+    """
+
+    def __init__(self, name: str):
+        """
+        Construct a metric.
+
+        :param name: the metric name, it is used as the key in history.
+        """
+        super(Metric, self).__init__()
+        self.name = name
+
+    @abc.abstractmethod
+    def reset(self) -> None:
+        """
+        Clear the accumulated states, it's called at the beginning of every epoch.
+
+        :return:
+        """
+        pass
+
+    @abc.abstractmethod
+    def update(self, outputs: torch.Tensor, labels: torch.Tensor) -> None:
+        """
+        Accumulate a batch. This method must not synchronize host and device(such as calling ``Tensor.item()``).
+
+        :param outputs: the model outputs of a batch, shape ``(N, C)``.
+        :param labels: the labels of a batch, shape ``(N,)``.
+        :return:
+        """
+        pass
+
+    @abc.abstractmethod
+    def compute(self):
+        """
+        Compute the metric value from accumulated states.
+
+        :return: a json serializable value.
+        """
+        pass
+
+
+class TopKAccuracy(Metric):
+
+    """
+    The ratio of samples whose label is in the top-k predictions.
+    """
+
+    def __init__(self, k: int = 5, name: str = None):
+        super(TopKAccuracy, self).__init__(name if name is not None else "top%d_acc" % k)
+        self.k = k
+        self.correct = None
+        self.total = 0
+
+    def reset(self) -> None:
+        self.correct = None
+        self.total = 0
+
+    def update(self, outputs: torch.Tensor, labels: torch.Tensor) -> None:
+        k = min(self.k, outputs.size(1))
+        topk = outputs.topk(k, dim=1).indices
+        correct = (topk == labels.unsqueeze(1)).any(dim=1).sum()
+        self.correct = correct if self.correct is None else self.correct + correct
+        self.total += labels.size(0)
+
+    def compute(self) -> float:
+        if self.correct is None or self.total == 0:
+            return 0.0
+        return self.correct.item() / self.total
+
+
+class ConfusionMatrix(Metric):
+
+    """
+    The confusion matrix, ``matrix[i][j]`` is the number of samples whose label is ``i`` and prediction is ``j``.
+    """
+
+    def __init__(self, num_classes: int, name: str = "confusion_matrix"):
+        super(ConfusionMatrix, self).__init__(name)
+        self.num_classes = num_classes
+        self.matrix = None
+
+    def reset(self) -> None:
+        self.matrix = None
+
+    def update(self, outputs: torch.Tensor, labels: torch.Tensor) -> None:
+        pred = outputs.argmax(dim=1)
+        idx = labels.long() * self.num_classes + pred
+        counts = torch.bincount(idx, minlength=self.num_classes * self.num_classes)
+        counts = counts.view(self.num_classes, self.num_classes)
+        self.matrix = counts if self.matrix is None else self.matrix + counts
+
+    def compute(self) -> list:
+        if self.matrix is None:
+            return [[0] * self.num_classes for _ in range(self.num_classes)]
+        return self.matrix.cpu().tolist()
+
+
+class PerClassAccuracy(ConfusionMatrix):
+
+    """
+    The accuracy of every class, the accuracy of a class without samples is 0.
+    """
+
+    def __init__(self, num_classes: int, name: str = "per_class_acc"):
+        super(PerClassAccuracy, self).__init__(num_classes, name)
+
+    def compute(self) -> list:
+        if self.matrix is None:
+            return [0.0] * self.num_classes
+        matrix = self.matrix.cpu()
+        correct = matrix.diagonal().double()
+        total = matrix.sum(dim=1).double()
+        return (correct / total.clamp(min=1)).tolist()
@@ -0,0 +1,57 @@
+"""
+Sampler
+=========
+
+Samplers used by ``SupervisedTrainer``.
+"""
+
+__all__ = [
+    "ResumableRandomSampler"
+]
+
+import torch
+from torch.utils.data import Sampler
+
+
+class ResumableRandomSampler(Sampler):
+
+    """
+    A random sampler whose order is determined by ``seed`` and epoch, so an interrupted epoch can be resumed from any
+    position with the same order.
+    """
+
+    def __init__(self, data_source, seed: int = None):
+        """
+        Construct a sampler.
+
+        :param data_source: the dataset.
+        :param seed: the base seed of permutations, default is a random seed.
+        """
+        # the ``data_source`` param of ``Sampler.__init__`` is deprecated in some versions of pytorch.
+        self.data_source = data_source
+        if seed is None:
+            seed = int(torch.randint(0, 2 ** 62, ()).item())
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch: int, start: int = 0) -> None:
+        """
+        Set the epoch of next iteration.
+
+        :param epoch: the epoch, every epoch has a different order.
+        :param start: skip the first ``start`` samples of next iteration.
+        :return:
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.data_source), generator=generator).tolist()
+        start, self.start = self.start, 0
+        return iter(order[start:])
+
+    def __len__(self):
+        return len(self.data_source) - self.start
@@ -9,17 +9,34 @@ __all__ = [
     "SupervisedTrainer"
 ]
 
+import contextlib
 import copy
 import os
 import json
+import multiprocessing
+import random
+import socket
 import sys
+import tempfile
 import time
 from collections import namedtuple
 
+import numpy as np
 import torch
+import torch.distributed as dist
+import torch.utils.checkpoint
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
-from torch.utils.data import random_split, DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import random_split, DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+
+from fedflow.utils.aggregate.compression import UpdateCodec
+from fedflow.utils.trainer.checkpoint import CheckpointWriter
+from fedflow.utils.trainer.early_stopping import EarlyStopping
+from fedflow.utils.trainer.metrics import Metric
+from fedflow.utils.trainer.sampler import ResumableRandomSampler
+from fedflow.utils.trainer.timer import StepTimer
 
 
 class SupervisedTrainer(object):
@@ -43,6 +60,14 @@ class SupervisedTrainer(object):
     History.train_loss.__doc__ = "train loss of every epoch"
     History.val_loss.__doc__ = "validate loss of every epoch"
     History.lr.__doc__ = "learning rate of every epoch"
+    # the histories are pickled to the spawned ranks of data-parallel training.
+    History.__qualname__ = "SupervisedTrainer.History"
+
+    PRECISIONS = {
+        "fp32": None,
+        "bf16": torch.bfloat16,
+        "fp16": torch.float16
+    }
 
     def __init__(self, model, optimizer, criterion, lr_scheduler=None, *,
                  init_model_path=None,
@@ -52,9 +77,42 @@ class SupervisedTrainer(object):
                  epoch=50,
                  epoch_action=None,
                  checkpoint_interval=10,
+                 checkpoint_keep_last=None,
+                 checkpoint_keep_best=0,
+                 checkpoint_monitor="val_acc",
                  device="cuda:0",
                  console_out=None,
-                 result_dir="."):
+                 result_dir=".",
+                 metrics=None,
+                 log_interval=0,
+                 num_workers=0,
+                 pin_memory=False,
+                 persistent_workers=False,
+                 prefetch_factor=None,
+                 non_blocking=False,
+                 autotune_workers=False,
+                 cpu_budget=None,
+                 precision="fp32",
+                 compile_model=False,
+                 compile_backend="inductor",
+                 compile_mode=None,
+                 compile_cache_dir=None,
+                 channels_last=False,
+                 resume_interval=0,
+                 val_interval=1,
+                 val_subset=None,
+                 early_stopping=None,
+                 eval_batch_size=None,
+                 accumulation_steps=1,
+                 checkpoint_modules=None,
+                 world_size=1,
+                 dist_backend="gloo",
+                 dist_port=None,
+                 time_budget=None,
+                 sample_budget=None,
+                 update_compression=None,
+                 topk_ratio=0.01,
+                 error_feedback_path=None):
         """
         Construct a trainer.
 
@@ -68,8 +126,9 @@ class SupervisedTrainer(object):
         :param dataset: the datasets used for this trainer.
         :param batch_size: the batch size
         :param epoch: the epoch
-        :param epoch_action: when every epoch finished, the epoch_action method will be called. In this method, you can
-            update ``lr`` etc. The follow is an example of epoch_action:
+        :param epoch_action: when every validated epoch finished, the epoch_action method will be called. In this
+            method, you can update ``lr`` etc. It's not called on the epochs skipped by ``val_interval``, so the
+            validate values are never None. The follow is an example of epoch_action:
 
             >>> class EpochAction(object):
             >>>     def __init__(self, optim):
@@ -83,10 +142,82 @@ class SupervisedTrainer(object):
             >>>         self.reduce.step(val_acc)
 
         :param checkpoint_interval: the interval of save parameters, the trainer will not save parameters if this param
-            if 0.
+            if 0. The checkpoints are written by a background thread, training doesn't wait for them.
+        :param checkpoint_keep_last: the number of latest checkpoints to keep, None means keep all checkpoints.
+        :param checkpoint_keep_best: the number of best checkpoints to keep, it's only effective when
+            ``checkpoint_keep_last`` is not None.
+        :param checkpoint_monitor: the history field used to select the best checkpoints, such as ``"val_acc"`` and
+            ``"val_loss"``. Lower is better if it ends with ``"loss"``, otherwise higher is better.
         :param device: the device used for training.
         :param console_out: redirect print.
         :param result_dir: the directory where the results are saved.
+        :param metrics: a list of ``fedflow.utils.trainer.metrics.Metric``, these metrics are computed on both train and
+            validate dataset every epoch, and recorded in the ``metrics`` field of history.json.
+        :param log_interval: print the running loss and accuracy every ``log_interval`` batches while training. The
+            running values are synchronized from device only when printing, 0 means only print at the end of epoch.
+        :param num_workers: the number of subprocesses used by dataloaders, 0 means loading data in training thread.
+        :param pin_memory: copy batches into pinned memory, which makes the host-to-device transfer faster.
+        :param persistent_workers: keep workers of dataloaders alive between epochs.
+        :param prefetch_factor: the number of batches loaded in advance by each worker, None means default of pytorch.
+        :param non_blocking: transfer batches to device asynchronously, it's only effective with ``pin_memory``.
+        :param autotune_workers: measure the loading speed of a few ``num_workers`` candidates before training, and keep
+            the fastest one. It's only effective for the dataloaders built by trainer.
+        :param cpu_budget: the maximum ``num_workers`` tried by autotune, default is the cpu count of current node.
+        :param precision: the precision of forward and loss, one of ``"fp32"``, ``"bf16"`` and ``"fp16"``. The
+            ``bf16`` and ``fp16`` precision run in ``torch.autocast`` on both cpu and cuda, and a ``GradScaler`` is used
+            for ``fp16`` on cuda. It applies to training, validating and testing.
+        :param compile_model: run model by ``torch.compile``, it's ignored if current pytorch doesn't support compiling.
+            The ``model`` attribute is always the original model, so the saved parameters are compatible.
+        :param compile_backend: the backend of ``torch.compile``.
+        :param compile_mode: the mode of ``torch.compile``, such as ``"reduce-overhead"`` and ``"max-autotune"``.
+        :param compile_cache_dir: the directory of compiled artifacts. Every model class has a sub-directory, which is
+            shared by all task processes on the same node, so a model is compiled only once per node. Default is
+            ``fedflow-compile-cache`` in the temporary directory of system.
+        :param channels_last: convert model and 4D inputs to ``torch.channels_last`` memory format, it usually speeds
+            up convolutional models.
+        :param resume_interval: persist the training state to ``resume.pth`` in ``result_dir`` every
+            ``resume_interval`` steps(and at the end of every epoch), 0 means disable resuming. The state contains
+            model, optimizer, lr_scheduler, RNG states, history and the position in current epoch. If the file exists
+            when training starts(e.g. the task is restarted after an interrupt), training is resumed from it. The file
+            is removed after training finished.
+        :param val_interval: validate every ``val_interval`` epochs, the last epoch is always validated. The validate
+            values of skipped epochs are None in history, and ``epoch_action`` is not called on them.
+        :param val_subset: validate on a fixed subsample of validate dataset, an int means the number of samples and a
+            float means the ratio of samples. None means the whole validate dataset.
+        :param early_stopping: an instance of ``fedflow.utils.trainer.early_stopping.EarlyStopping``, it's checked
+            after every validation.
+        :param eval_batch_size: the batch size of validating and testing, default is twice ``batch_size``. Evaluation
+            stores no activations for backward, so it can use a larger batch size.
+        :param accumulation_steps: accumulate the gradients of ``accumulation_steps`` batches before every optimizer
+            step, the effective batch size is ``batch_size * accumulation_steps``. With a smaller ``batch_size``, it
+            reduces the peak memory of training.
+        :param checkpoint_modules: the names of submodules(such as ``"layer1"`` or ``"encoder.blocks.0"``) whose
+            activations are recomputed in backward instead of being stored(activation checkpointing). It reduces the
+            peak memory at the cost of an extra forward of these submodules.
+        :param world_size: the number of local processes(ranks) of data-parallel training by
+            ``torch.distributed``. The rank 0 runs in current process and the others are spawned, every rank trains
+            on a shard of train dataset(``DistributedSampler``) with ``batch_size``, and gradients are averaged by
+            ``DistributedDataParallel``. Only the rank 0 validates, writes history and checkpoints, and returns the
+            result. It requires the dataset mounted by ``dataset`` or ``mount_dataset``, and doesn't support resuming.
+            The spawned ranks receive a pickled copy of trainer, so the model, optimizer, criterion, datasets,
+            lr_scheduler and epoch_action must be picklable, and the main script must be guarded by
+            ``if __name__ == "__main__"``.
+        :param dist_backend: the backend of ``torch.distributed``, the default ``gloo`` supports cpu training.
+        :param dist_port: the local port used for initializing process group, default is a free port.
+        :param time_budget: the maximum seconds of training. When the budget runs out, training stops after the current
+            optimizer step, and the partial epoch is validated and recorded. None means no limit.
+        :param sample_budget: the maximum number of training samples(including repeated samples of different epochs),
+            it works like ``time_budget``. The numbers of processed samples and steps are returned by ``train``, so
+            aggregators can weight clients by the work done.
+        :param update_compression: save ``parameter.pth`` as a compressed update relative to ``init_model_path``,
+            the method can be ``"fp16"``, ``"int8"`` or ``"topk"``(see ``fedflow.utils.aggregate.UpdateCodec``).
+            The aggregators in ``fedflow.utils.aggregate`` decode it transparently, as long as ``init_model_path``
+            still exists. The compression ratio is returned by ``train``. None means saving the full parameters.
+        :param topk_ratio: the ratio of kept elements of ``"topk"`` compression.
+        :param error_feedback_path: the file which keeps the compression error of this client, the error is added to
+            the next update of the client and the file is rewritten. It should be a persistent path per client, such
+            as a file outside the task workdir, and must be unique among the clients training concurrently, otherwise
+            they overwrite the residuals of each other. None means no error feedback.
         """
         super(SupervisedTrainer, self).__init__()
         self.model = model
@@ -98,13 +229,69 @@ class SupervisedTrainer(object):
         self.init_optim_path = init_optim_path
 
         self.batch_size = batch_size
+        # the size of micro-batches after running out of memory, None means no split
+        self.micro_batch_size = None
+        # if the current batch has run backward, its gradients are mixed with the accumulated gradients
+        self.__backward_started = False
+        if accumulation_steps < 1:
+            raise ValueError("accumulation_steps must be positive")
+        self.accumulation_steps = accumulation_steps
+        self.checkpoint_modules = list(checkpoint_modules) if checkpoint_modules is not None else []
+        if world_size > 1 and resume_interval > 0:
+            raise ValueError("resuming is not supported in data-parallel training")
+        self.world_size = world_size
+        self.dist_backend = dist_backend
+        self.dist_port = dist_port
+        # the rank of current process, None means not in data-parallel training
+        self.rank = None
+
+        self.time_budget = time_budget
+        self.sample_budget = sample_budget
+        # the processed samples and optimizer steps of training
+        self.samples = 0
+        self.steps = 0
+        self.budget_exhausted = False
+        self.__elapsed = 0.0
+        self.__budget_start = time.perf_counter()
+        if update_compression is not None and update_compression not in UpdateCodec.METHODS:
+            raise ValueError("update_compression only accepts %s" % ", ".join(UpdateCodec.METHODS))
+        self.update_compression = update_compression
+        self.topk_ratio = topk_ratio
+        self.error_feedback_path = error_feedback_path
+        # the ratio of full parameter bytes to compressed update bytes of last training
+        self.compression_ratio = None
+        self.eval_batch_size = eval_batch_size
+        self.resume_interval = resume_interval
+        self.val_interval = val_interval
+        self.val_subset = val_subset
+        if early_stopping is not None and not isinstance(early_stopping, EarlyStopping):
+            raise TypeError("early_stopping only accepts instance of EarlyStopping")
+        self.early_stopping = early_stopping
+        self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        self.persistent_workers = persistent_workers
+        self.prefetch_factor = prefetch_factor
+        self.non_blocking = non_blocking
+        self.autotune_workers = autotune_workers
+        self.cpu_budget = cpu_budget if cpu_budget is not None else (os.cpu_count() or 1)
+        self.train_dataset, self.val_dataset = None, None
         self.train_dataloader, self.val_dataloader = self.__split_dataset(dataset)
 
         self.epoch = epoch
         self.epoch_action = epoch_action
         self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_keep_last = checkpoint_keep_last
+        self.checkpoint_keep_best = checkpoint_keep_best
+        self.checkpoint_monitor = checkpoint_monitor
+        self.checkpoint_writer = None
 
         self.device = device
+        if precision not in self.PRECISIONS:
+            raise ValueError("precision only accepts %s" % ", ".join(self.PRECISIONS))
+        self.precision = precision
+        self.scaler = None
+        if precision == "fp16" and torch.device(device).type == "cuda":
+            self.scaler = torch.cuda.amp.GradScaler()
 
         if console_out is None:
             self.console_out = sys.stdout
@@ -115,8 +302,43 @@ class SupervisedTrainer(object):
                 self.console_out = console_out
         self.result_dir = result_dir
 
+        self.compile_model = compile_model
+        self.compile_backend = compile_backend
+        self.compile_mode = compile_mode
+        if compile_cache_dir is None:
+            compile_cache_dir = os.path.join(tempfile.gettempdir(), "fedflow-compile-cache")
+        self.compile_cache_dir = compile_cache_dir
+        self.channels_last = channels_last
+        # the callable which actually runs forward, it's the compiled model in compiled mode.
+        self.runner = self.model
+        self.__runner_model = None
+        # the callable which runs forward in training, it's wrapped by ``DistributedDataParallel`` in data-parallel
+        # training.
+        self.train_runner = self.runner
+        # the (path, mtime, size) of parameters loaded by ``evaluate``
+        self.__loaded_parameters = None
+        # (the key of loaded parameters, quantized model)
+        self.__quantized = None
+
+        self.train_metrics = list(metrics) if metrics is not None else []
+        for m in self.train_metrics:
+            if not isinstance(m, Metric):
+                raise TypeError("metrics only accepts instances of Metric")
+        self.val_metrics = copy.deepcopy(self.train_metrics)
+        self.log_interval = log_interval
+
         self.start_time = int(time.time())
         self.history = self.History([], [], [], [], [])
+        self.metric_history = {}
+        # the seconds spent in every section of each epoch
+        self.timer = StepTimer()
+        self.timing_history = []
+
+        # the state of resuming
+        self.__start_epoch = 0
+        self.__current_epoch = 0
+        self.__epoch_state = None
+        self.__steps = 0
 
     def mount_dataset(self, dataset, val_dataset=None, *, val_ratio=0.3, batch_size=32) -> None:
         """
@@ -137,8 +359,9 @@ class SupervisedTrainer(object):
         if val_dataset is None:
             self.train_dataloader, self.val_dataloader = self.__split_dataset(dataset, val_ratio)
         else:
-            self.train_dataloader = DataLoader(dataset, batch_size=self.batch_size, shuffle=True)
-            self.val_dataloader = DataLoader(val_dataset, batch_size=self.batch_size, shuffle=True)
+            self.train_dataset, self.val_dataset = dataset, val_dataset
+            self.train_dataloader = self._build_dataloader(dataset)
+            self.val_dataloader = self._build_val_dataloader(val_dataset)
 
     def mount_dataloader(self, train_dataloader, val_dataloader) -> None:
         """
@@ -151,9 +374,97 @@ class SupervisedTrainer(object):
         :param val_dataloader: dataloader used for validating.
         :return:
         """
+        self.train_dataset, self.val_dataset = None, None
         self.train_dataloader = train_dataloader
         self.val_dataloader = val_dataloader
 
+    def autotune_dataloader(self, candidates=None, batches=10) -> int:
+        """
+        Measure the loading speed(batches/sec) of train dataset with different ``num_workers``, and rebuild dataloaders
+        with the fastest one.
+
+        :param candidates: the ``num_workers`` to be tried, default is ``0, 1, 2, 4, ...`` up to ``cpu_budget``.
+        :param batches: the number of batches loaded for each candidate.
+        :return: the selected ``num_workers``.
+        """
+        if self.train_dataset is None:
+            return self.num_workers
+        if candidates is None:
+            candidates = [0]
+            n = 1
+            while n <= self.cpu_budget:
+                candidates.append(n)
+                n *= 2
+        candidates = [n for n in candidates if n <= self.cpu_budget]
+        best, best_speed = self.num_workers, 0.0
+        for n in candidates:
+            dataloader = self._build_dataloader(self.train_dataset, num_workers=n, persistent_workers=False)
+            count = 0
+            start = time.perf_counter()
+            for _ in dataloader:
+                count += 1
+                if count >= batches:
+                    break
+            elapsed = time.perf_counter() - start
+            del dataloader
+            speed = count / elapsed if elapsed > 0 else float("inf")
+            self.console_out.write("[INFO] num_workers=%d: %.2f batches/sec\n" % (n, speed))
+            if speed > best_speed:
+                best, best_speed = n, speed
+        self.console_out.write("[INFO] select num_workers=%d\n" % best)
+        self.num_workers = best
+        self.train_dataloader = self._build_dataloader(self.train_dataset)
+        self.val_dataloader = self._build_val_dataloader(self.val_dataset)
+        return best
+
+    def _build_dataloader(self, dataset, shuffle=True, **kwargs):
+        """
+        Build a dataloader with the loading options of this trainer.
+
+        :param dataset: the dataset.
+        :param shuffle: reshuffle data at every epoch.
+        :param kwargs: overwrite the options of trainer, such as ``num_workers``.
+        :return: an instance of ``DataLoader``.
+        """
+        options = {
+            "batch_size": self.batch_size,
+            "shuffle": shuffle,
+            "num_workers": self.num_workers,
+            "pin_memory": self.pin_memory,
+            "persistent_workers": self.persistent_workers
+        }
+        if self.prefetch_factor is not None:
+            options["prefetch_factor"] = self.prefetch_factor
+        if shuffle and self.resume_interval > 0:
+            options["sampler"] = ResumableRandomSampler(dataset)
+            options["shuffle"] = False
+        options.update(kwargs)
+        if options["num_workers"] == 0:
+            # these options are only valid for multiprocess loading.
+            options.pop("prefetch_factor", None)
+            options["persistent_workers"] = False
+        return DataLoader(dataset, **options)
+
+    def _build_val_dataloader(self, dataset):
+        """
+        Build a dataloader without shuffle for validating, the dataset is subsampled if ``val_subset`` is set.
+
+        :param dataset: the validate dataset.
+        :return: an instance of ``DataLoader``.
+        """
+        if self.val_subset is not None:
+            n = len(dataset)
+            size = int(self.val_subset * n) if type(self.val_subset) == float else min(self.val_subset, n)
+            # a fixed generator makes the subsample same in every epoch and every run.
+            generator = torch.Generator()
+            generator.manual_seed(0)
+            indices = torch.randperm(n, generator=generator)[:size].tolist()
+            dataset = Subset(dataset, indices)
+        return self._build_dataloader(dataset, shuffle=False, batch_size=self._eval_batch_size())
+
+    def _eval_batch_size(self):
+        return self.eval_batch_size if self.eval_batch_size is not None else 2 * self.batch_size
+
     def __split_dataset(self, dataset, val_ratio=0.3) -> tuple:
         if dataset is None:
             return None, None
@@ -161,53 +472,176 @@ class SupervisedTrainer(object):
         val_len = int(val_ratio * dataset_len)
         train_len = dataset_len - val_len
         t, v = random_split(dataset, (train_len, val_len))
-        return (DataLoader(t, batch_size=self.batch_size, shuffle=True),
-                DataLoader(v, batch_size=self.batch_size, shuffle=True))
+        self.train_dataset, self.val_dataset = t, v
+        return self._build_dataloader(t), self._build_val_dataloader(v)
 
     def train(self) -> dict:
-        self.__pre_train()
-        self.__train()
-        self.__post_train()
-        return {
+        if self.world_size > 1:
+            self.__train_distributed()
+        else:
+            self.__pre_train()
+            self.__train()
+            self.__post_train()
+        result = {
             "train_acc": self.history.train_acc[-1],
             "val_acc": self.history.val_acc[-1]
         }
+        result["timing"] = self.timing()
+        result["peak_memory"] = self.peak_memory()
+        result["samples"] = self.samples
+        result["steps"] = self.steps
+        result["budget_exhausted"] = self.budget_exhausted
+        if self.early_stopping is not None:
+            result["best_epoch"] = self.early_stopping.best_epoch
+            result["stopped_epoch"] = self.early_stopping.stopped_epoch
+        if self.update_compression is not None:
+            result["compression_ratio"] = self.compression_ratio
+        return result
+
+    def timing(self) -> dict:
+        """
+        The total seconds spent in every section of training: ``data``(waiting for dataloader), ``h2d``(host to
+        device copy), ``forward``, ``backward``, ``optimizer``, ``validation`` and ``checkpoint``. The per-epoch values
+        are recorded in the ``timing`` field of history.json.
+
+        :return: a dict ``{section: seconds}``
+        """
+        totals = dict.fromkeys(StepTimer.SECTIONS, 0.0)
+        for t in self.timing_history:
+            for k, v in t.items():
+                totals[k] = totals.get(k, 0.0) + v
+        return totals
 
-    def test(self, init_model_path, dataset=None, *, dataloader=None) -> tuple:
+    def test(self, init_model_path, dataset=None, *, dataloader=None, quantize=False) -> tuple:
         """
         calculate the predict accuracy in dataset.
 
+        :param init_model_path: the parameters to be tested, None means testing current parameters of model.
         :param dataset: the dataset for predicting.
         :param dataloader: if dataloader if not None, the ``dataset`` param will be ignored.
+        :param quantize: test a dynamically quantized(int8) copy of model on cpu, see ``evaluate_quantized``.
         :return: a tuple ``(loss, correct, total)``
         """
-        self.console_out.write("[INFO] Test started.")
+        self.console_out.write("[INFO] Test started.\n")
+        if init_model_path is None:
+            self.console_out.write("[WARN] test model has no pre-trained parameters.\n")
+        if quantize:
+            report = self.evaluate_quantized(dataset, dataloader=dataloader, model_path=init_model_path)
+            loss, correct, total = report["int8"]["loss"], report["int8"]["correct"], report["int8"]["total"]
+        else:
+            loss, correct, total = self.evaluate(dataset, dataloader=dataloader, model_path=init_model_path)
+        self.console_out.write("[INFO] Test ended.\n")
+        return loss, correct, total
+
+    def evaluate_quantized(self, dataset=None, *, dataloader=None, model_path=None, compare=False,
+                           modules=(torch.nn.Linear, torch.nn.LSTM)) -> dict:
+        """
+        Evaluate a dynamically quantized copy of model on cpu. The weights of ``modules`` are quantized to int8, and
+        activations are quantized dynamically, which is much faster for Linear/LSTM-heavy networks. The model itself
+        is not changed. The quantized copy is cached while the parameters loaded from ``model_path`` are unchanged.
+
+        :param dataset: the dataset.
+        :param dataloader: if dataloader if not None, the ``dataset`` param will be ignored.
+        :param model_path: the parameters to be loaded before evaluating, None means evaluating current parameters.
+        :param compare: evaluate the fp32 model too, as the baseline.
+        :param modules: the types of modules to be quantized.
+        :return: a dict ``{"int8": {...}, "fp32": {...}}``, every value contains ``loss``, ``correct``, ``total``,
+            ``acc`` and ``time``(seconds). The ``fp32`` is absent if ``compare`` is False.
+        """
         if dataloader is None:
-            dataloader = DataLoader(dataset, batch_size=self.batch_size, shuffle=True)
+            dataloader = self._build_dataloader(dataset, shuffle=False, batch_size=self._eval_batch_size())
+        if model_path is not None:
+            self.__load_evaluated_parameters(model_path)
+        self._prepare_model()
+
+        quantized = None
+        if self.__quantized is not None and self.__loaded_parameters is not None and \
+                self.__quantized[0] == self.__loaded_parameters:
+            quantized = self.__quantized[1]
+        if quantized is None:
+            model = copy.deepcopy(self.model).to("cpu").eval()
+            quantized = torch.ao.quantization.quantize_dynamic(model, set(modules), dtype=torch.qint8)
+            self.__quantized = (self.__loaded_parameters, quantized)
+
+        report = {}
+        runner, device, precision = self.runner, self.device, self.precision
+        self.runner, self.device, self.precision = quantized, "cpu", "fp32"
+        try:
+            start = time.perf_counter()
+            with torch.inference_mode():
+                loss, correct, total = self._epoch_update(dataloader)
+            report["int8"] = self.__evaluate_report(loss, correct, total, time.perf_counter() - start)
+        finally:
+            self.runner, self.device, self.precision = runner, device, precision
+        if compare:
+            start = time.perf_counter()
+            loss, correct, total = self._evaluate(dataloader)
+            report["fp32"] = self.__evaluate_report(loss, correct, total, time.perf_counter() - start)
+            self.console_out.write("[INFO] int8 acc: %.2f%%(%.2fs), fp32 acc: %.2f%%(%.2fs)\n" %
+                                   (100 * report["int8"]["acc"], report["int8"]["time"],
+                                    100 * report["fp32"]["acc"], report["fp32"]["time"]))
+        return report
+
+    def __evaluate_report(self, loss, correct, total, seconds):
+        return {
+            "loss": loss,
+            "correct": correct,
+            "total": total,
+            "acc": correct / total if total > 0 else 0.0,
+            "time": seconds
+        }
 
-        model_copy = copy.deepcopy(self.model)
+    def evaluate(self, dataset=None, *, dataloader=None, model_path=None, metrics=None) -> tuple:
+        """
+        Evaluate model on a dataset in eval mode and ``torch.inference_mode``.
 
-        if init_model_path is None:
-            self.console_out.write("[WARN] test model has no pre-trained parameters.")
-        else:
-            if os.path.exists(init_model_path):
-                self.console_out.write("[INFO] load model parameters.\n")
-                model_parameters = torch.load(init_model_path, map_location=self.device)
-                self.model.load_state_dict(model_parameters)
-            else:
-                self.console_out.write("[INFO] model parameters not exists.\n")
+        The parameters loaded from ``model_path`` are cached: evaluating the same unchanged file repeatedly doesn't
+        reload it from disk.
 
-        self.model = self.model.to(self.device)
-        with torch.no_grad():
-            loss, correct, total = self._epoch_update(dataloader)
-        self.console_out.write("[INFO] Test ended.")
-        return loss, correct, total
+        :param dataset: the dataset, it's loaded in order with ``eval_batch_size``.
+        :param dataloader: if dataloader if not None, the ``dataset`` param will be ignored.
+        :param model_path: the parameters to be loaded before evaluating, None means evaluating current parameters.
+        :param metrics: the metrics to be computed.
+        :return: a tuple ``(loss, correct, total)``
+        """
+        if dataloader is None:
+            dataloader = self._build_dataloader(dataset, shuffle=False, batch_size=self._eval_batch_size())
+        if model_path is not None:
+            self.__load_evaluated_parameters(model_path)
+        self._prepare_model()
+        return self._evaluate(dataloader, metrics)
+
+    def _evaluate(self, dataloader, metrics=None) -> tuple:
+        training = self.model.training
+        self.model.eval()
+        try:
+            with torch.inference_mode():
+                return self._epoch_update(dataloader, metrics)
+        finally:
+            self.model.train(training)
+
+    def __load_evaluated_parameters(self, path):
+        if not os.path.exists(path):
+            self.console_out.write("[INFO] model parameters not exists.\n")
+            return
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if key == self.__loaded_parameters:
+            return
+        self.console_out.write("[INFO] load model parameters.\n")
+        model_parameters = torch.load(path, map_location=self.device)
+        if UpdateCodec.is_compressed(model_parameters):
+            model_parameters = UpdateCodec.decode(model_parameters)
+        self.model.load_state_dict(model_parameters)
+        self.__loaded_parameters = key
 
     def __load_parameters(self):
         if self.init_model_path is not None:
             if os.path.exists(self.init_model_path):
                 self.console_out.write("[INFO] load model parameters.\n")
                 model_parameters = torch.load(self.init_model_path, map_location=self.device)
+                if UpdateCodec.is_compressed(model_parameters):
+                    model_parameters = UpdateCodec.decode(model_parameters)
                 self.model.load_state_dict(model_parameters)
             else:
                 self.console_out.write("[INFO] model parameters not exists.\n")
@@ -220,24 +654,147 @@ class SupervisedTrainer(object):
                 self.console_out.write("[INFO] optim parameters not exists.\n")
 
     def __pre_train(self):
+        # the parameters of model will be changed by training.
+        self.__loaded_parameters = None
+        if torch.device(self.device).type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
         os.makedirs(self.result_dir, exist_ok=True)
         os.makedirs(os.path.join(self.result_dir, "checkpoint"), exist_ok=True)
+        self.samples, self.steps, self.budget_exhausted = 0, 0, False
+        self.__elapsed = 0.0
+        self.__budget_start = time.perf_counter()
         self.__load_parameters()
-        self.model = self.model.to(self.device)
+        self._prepare_model()
+        self.train_runner = self.runner
+        self.checkpoint_writer = CheckpointWriter(self.checkpoint_keep_last, self.checkpoint_keep_best,
+                                                  "min" if self.checkpoint_monitor.endswith("loss") else "max")
+        if self.autotune_workers and self.rank is None:
+            self.autotune_dataloader()
+        if self.rank is not None:
+            # the parameters of rank 0 are broadcast to other ranks when wrapping.
+            self.train_runner = DistributedDataParallel(self.model)
+            sampler = DistributedSampler(self.train_dataset, num_replicas=self.world_size, rank=self.rank)
+            self.train_dataloader = self._build_dataloader(self.train_dataset, shuffle=False, sampler=sampler)
+        if self.early_stopping is not None:
+            self.early_stopping.reset()
+        if self.resume_interval > 0 and os.path.exists(self._resume_path()):
+            self.__restore(self._resume_path())
+
+    def __train_distributed(self):
+        if self.train_dataset is None:
+            raise ValueError("data-parallel training requires the dataset mounted by dataset or mount_dataset")
+        port = self.dist_port if self.dist_port is not None else self.__free_port()
+        # the task trains in a thread, forking a multi-threaded process may deadlock the child on a lock held by
+        # other threads.
+        context = multiprocessing.get_context("spawn")
+        # the ranks are not daemonic, so they can start the workers of dataloader.
+        processes = [context.Process(target=self._run_rank, args=(rank, port)) for rank in range(1, self.world_size)]
+        for p in processes:
+            p.start()
+        try:
+            self._run_rank(0, port)
+        except BaseException:
+            for p in processes:
+                p.terminate()
+            raise
+        finally:
+            for p in processes:
+                p.join()
+        failed = [rank + 1 for rank, p in enumerate(processes) if p.exitcode != 0]
+        if len(failed) > 0:
+            raise RuntimeError("rank %s of data-parallel training failed" % ", ".join(map(str, failed)))
+
+    def __getstate__(self):
+        # the trainer is pickled to the spawned ranks, the runtime objects are rebuilt in ``__pre_train``.
+        state = self.__dict__.copy()
+        for key in ("console_out", "checkpoint_writer", "runner", "train_runner", "train_dataloader",
+                    "val_dataloader", "_SupervisedTrainer__runner_model", "_SupervisedTrainer__quantized"):
+            state[key] = None
+        return state
+
+    def _run_rank(self, rank, port):
+        self.rank = rank
+        if rank != 0:
+            self.console_out = open(os.devnull, "w")
+        dist.init_process_group(self.dist_backend, init_method="tcp://127.0.0.1:%d" % port,
+                                rank=rank, world_size=self.world_size)
+        try:
+            # avoid oversubscribing cpu by the intra-op threads of all ranks.
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.world_size))
+            self.__pre_train()
+            self.__train()
+            if rank == 0:
+                self.__post_train()
+        finally:
+            dist.destroy_process_group()
+            if rank == 0:
+                self.rank = None
+                self.train_runner = self.runner
+
+    def __check_budget(self):
+        if self.time_budget is None and self.sample_budget is None:
+            return False
+        elapsed = self.__elapsed + time.perf_counter() - self.__budget_start
+        exhausted = (self.time_budget is not None and elapsed >= self.time_budget) or \
+                    (self.sample_budget is not None and self.samples >= self.sample_budget)
+        # all ranks must stop at the same step.
+        return self.__broadcast_stop(exhausted)
+
+    def __free_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def __is_main(self):
+        return self.rank is None or self.rank == 0
+
+    def __broadcast_stop(self, stop):
+        if self.rank is None:
+            return stop
+        flag = torch.tensor([1 if stop else 0])
+        dist.broadcast(flag, 0)
+        return bool(flag.item())
 
     def __train(self):
-        for e in range(self.epoch):
-            t_loss, t_correct, t_total = self._epoch_update(self.train_dataloader)
+        for e in range(self.__start_epoch, self.epoch):
+            self.__current_epoch = e
+            self.timer.reset()
+            epoch_state, self.__epoch_state = self.__epoch_state, None
+            sampler = getattr(self.train_dataloader, "sampler", None)
+            if isinstance(sampler, ResumableRandomSampler):
+                start = 0
+                if epoch_state is not None:
+                    start = epoch_state["iter_num"] * self.train_dataloader.batch_size
+                    # the sampler skips the finished batches, so the dataloader only yields the rest of epoch.
+                    epoch_state["offset"], epoch_state["skip"] = epoch_state["iter_num"], 0
+                sampler.set_epoch(e, start)
+            elif isinstance(sampler, DistributedSampler):
+                sampler.set_epoch(e)
+            t_loss, t_correct, t_total = self._epoch_update(self.train_dataloader, self.train_metrics, epoch_state)
             t_acc = t_correct / t_total
-            with torch.no_grad():
-                v_loss, v_correct, v_total = self._epoch_update(self.val_dataloader)
+            exhausted = self.budget_exhausted
+            validate = ((e + 1) % self.val_interval == 0 or e + 1 == self.epoch or exhausted) and self.__is_main()
+            v_loss, v_acc = None, None
+            if validate:
+                with self.timer.section("validation"):
+                    v_loss, v_correct, v_total = self._evaluate(self.val_dataloader, self.val_metrics)
                 v_acc = v_correct / v_total
             lr = self.optimizer.param_groups[0]["lr"]
+            if not self.__is_main():
+                if self.lr_scheduler is not None:
+                    self.lr_scheduler.step()
+                if self.__broadcast_stop(False):
+                    break
+                continue
             self.console_out.write("[%s] EPOCH %d of %d\n" %
                                    (self.__time_format(int(time.time()) - self.start_time), e + 1, self.epoch))
             self.console_out.write("\tTrain Loss: %.4f, Acc: %.2f%%\n" % (t_loss, 100 * t_acc))
-            self.console_out.write("\tVal   Loss: %.4f, Acc: %.2f%%\n" % (v_loss, 100 * v_acc))
+            if validate:
+                self.console_out.write("\tVal   Loss: %.4f, Acc: %.2f%%\n" % (v_loss, 100 * v_acc))
+            else:
+                self.console_out.write("\tVal   skipped\n")
             self.console_out.write("\tLR: %f\n" % lr)
+            self.__record_metrics(validate)
             self.console_out.flush()
 
             self.history.train_loss.append(t_loss)
@@ -246,7 +803,7 @@ class SupervisedTrainer(object):
             self.history.val_acc.append(v_acc)
             self.history.lr.append(lr)
 
-            if self.epoch_action is not None:
+            if validate and self.epoch_action is not None:
                 self.epoch_action(model=self.model, optimizer=self.optimizer, criterion=self.criterion,
                                   lr_scheduler=self.lr_scheduler,
                                   train_loss=t_loss, train_acc=t_acc, val_loss=v_loss, val_acc=v_acc, lr=lr)
@@ -255,21 +812,74 @@ class SupervisedTrainer(object):
                 self.lr_scheduler.step()
 
             if self.checkpoint_interval > 0 and (e + 1) % self.checkpoint_interval == 0:
-                torch.save(self.model.state_dict(), self._checkpoint_parameter_path(e + 1))
-                torch.save(self.optimizer.state_dict(),  self._checkpoint_optimizer_path(e + 1))
+                with self.timer.section("checkpoint"):
+                    self.checkpoint_writer.save({
+                        self._checkpoint_parameter_path(e + 1): self.model.state_dict(),
+                        self._checkpoint_optimizer_path(e + 1): self.optimizer.state_dict()
+                    }, epoch=e + 1, score=self._monitor_value(self.checkpoint_monitor))
+
+            stop = exhausted
+            if exhausted:
+                self.console_out.write("[INFO] training budget exhausted at epoch %d, %d samples, %d steps.\n" %
+                                       (e + 1, self.samples, self.steps))
+            if validate and self.early_stopping is not None and not exhausted:
+                stop = self.early_stopping.step(e + 1, self._monitor_value(self.early_stopping.monitor))
+                if stop:
+                    self.console_out.write("[INFO] early stopped at epoch %d, the best epoch is %d.\n" %
+                                           (e + 1, self.early_stopping.best_epoch))
+
+            self.timing_history.append(self.timer.summary())
+            if self.resume_interval > 0:
+                self.__save_resume(e + 1)
+
+            if self.__broadcast_stop(stop):
+                break
 
     def __post_train(self):
+        self.checkpoint_writer.save({
+            self._parameter_path(): self.__encode_parameters(),
+            self._optimizer_path(): self.optimizer.state_dict()
+        })
         with open(self._history_path(), "w") as f:
             f.write(json.dumps({
                 "train_loss": self.history.train_loss,
                 "val_loss": self.history.val_loss,
                 "train_acc": self.history.train_acc,
                 "val_acc": self.history.val_acc,
-                "lr": self.history.lr
+                "lr": self.history.lr,
+                "metrics": self.metric_history,
+                "precision": self.precision,
+                "best_epoch": self.early_stopping.best_epoch if self.early_stopping is not None else None,
+                "stopped_epoch": self.early_stopping.stopped_epoch if self.early_stopping is not None else None,
+                "timing": self.timing_history,
+                "peak_memory": self.peak_memory()
             }, indent=4))
-        torch.save(self.model.state_dict(), self._parameter_path())
-        torch.save(self.optimizer.state_dict(), self._optimizer_path())
         self.__draw_png()
+        # the results must be complete when training finished.
+        self.checkpoint_writer.close()
+        if os.path.exists(self._resume_path()):
+            os.remove(self._resume_path())
+
+    def __encode_parameters(self):
+        state_dict = self.model.state_dict()
+        if self.update_compression is None:
+            return state_dict
+        if self.init_model_path is None or not os.path.exists(self.init_model_path):
+            self.console_out.write("[WARN] no init model parameters, the full parameters are saved.\n")
+            self.compression_ratio = 1.0
+            return state_dict
+        state_dict = CheckpointWriter.snapshot(state_dict)
+        residual = None
+        if self.error_feedback_path is not None and os.path.exists(self.error_feedback_path):
+            residual = torch.load(self.error_feedback_path, map_location="cpu")
+        encoded, residual = UpdateCodec.encode(state_dict, self.init_model_path, self.update_compression,
+                                               self.topk_ratio, residual)
+        if self.error_feedback_path is not None:
+            CheckpointWriter.atomic_save(residual, self.error_feedback_path)
+        self.compression_ratio = UpdateCodec.nbytes(state_dict) / max(1, UpdateCodec.nbytes(encoded))
+        self.console_out.write("[INFO] %s update compression ratio: %.2f\n" %
+                               (self.update_compression, self.compression_ratio))
+        return encoded
 
     def _checkpoint_parameter_path(self, idx):
         return os.path.join(self.result_dir, "checkpoint", "parameter-%d.checkpoint" % idx)
@@ -289,41 +899,377 @@ class SupervisedTrainer(object):
     def _graph_path(self):
         return os.path.join(self.result_dir, "history.png")
 
-    def _epoch_update(self, dataloader):
-        correct = 0
-        total = 0
-        loss_total = 0
-        iter_num = 0
-        loss = None
+    def _resume_path(self):
+        return os.path.join(self.result_dir, "resume.pth")
+
+    def __save_resume(self, epoch, epoch_state=None):
+        sampler = getattr(self.train_dataloader, "sampler", None)
+        state = {
+            "epoch": epoch,
+            "epoch_state": epoch_state,
+            "metrics": copy.deepcopy(self.train_metrics) if epoch_state is not None else None,
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "lr_scheduler": self.lr_scheduler.state_dict() if self.lr_scheduler is not None else None,
+            "scaler": self.scaler.state_dict() if self.scaler is not None else None,
+            "history": self.history._asdict(),
+            "early_stopping": copy.deepcopy(self.early_stopping),
+            "micro_batch_size": self.micro_batch_size,
+            "resume_steps": self.__steps,
+            "timing_history": self.timing_history,
+            "budget": (self.samples, self.steps, self.__elapsed + time.perf_counter() - self.__budget_start),
+            "metric_history": self.metric_history,
+            "split": self.__split_indices(),
+            "sampler_seed": sampler.seed if isinstance(sampler, ResumableRandomSampler) else None,
+            "rng": {
+                "python": random.getstate(),
+                "numpy": np.random.get_state(),
+                "torch": torch.get_rng_state(),
+                "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+            }
+        }
+        self.checkpoint_writer.save({self._resume_path(): state})
+
+    def __restore(self, path):
+        state = torch.load(path, map_location=self.device, weights_only=False)
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        if self.lr_scheduler is not None and state["lr_scheduler"] is not None:
+            self.lr_scheduler.load_state_dict(state["lr_scheduler"])
+        if self.scaler is not None and state["scaler"] is not None:
+            self.scaler.load_state_dict(state["scaler"])
+        self.history = self.History(**state["history"])
+        if state["early_stopping"] is not None:
+            self.early_stopping = state["early_stopping"]
+        self.micro_batch_size = state["micro_batch_size"]
+        self.__steps = state["resume_steps"]
+        self.timing_history = state["timing_history"]
+        self.samples, self.steps, self.__elapsed = state["budget"]
+        self.metric_history = state["metric_history"]
+
+        split = state["split"]
+        if split is not None and self.__split_indices() is not None:
+            base = self.train_dataset.dataset
+            self.train_dataset, self.val_dataset = Subset(base, split[0]), Subset(base, split[1])
+            self.train_dataloader = self._build_dataloader(self.train_dataset)
+            self.val_dataloader = self._build_val_dataloader(self.val_dataset)
+        sampler = getattr(self.train_dataloader, "sampler", None)
+        if isinstance(sampler, ResumableRandomSampler) and state["sampler_seed"] is not None:
+            sampler.seed = state["sampler_seed"]
+
+        rng = state["rng"]
+        random.setstate(rng["python"])
+        np.random.set_state(rng["numpy"])
+        torch.set_rng_state(rng["torch"].cpu())
+        if rng["cuda"] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([s.cpu() for s in rng["cuda"]])
+
+        self.__start_epoch = state["epoch"]
+        self.__epoch_state = state["epoch_state"]
+        if self.__epoch_state is not None:
+            # the position is skipped by iterating dataloader if the sampler is not resumable.
+            self.__epoch_state["skip"] = self.__epoch_state["iter_num"]
+            self.train_metrics = state["metrics"]
+        self.console_out.write("[INFO] resume training from epoch %d, batch %d.\n" %
+                               (self.__start_epoch + 1,
+                                self.__epoch_state["iter_num"] if self.__epoch_state is not None else 0))
+
+    def __split_indices(self):
+        if isinstance(self.train_dataset, Subset) and isinstance(self.val_dataset, Subset) and \
+                self.train_dataset.dataset is self.val_dataset.dataset:
+            return list(self.train_dataset.indices), list(self.val_dataset.indices)
+        return None
+
+    def _epoch_update(self, dataloader, metrics=None, epoch_state=None):
+        """
+        Run an epoch on dataloader. If grad is enabled, the model will be updated.
+
+        The loss, correct count and metrics are accumulated as tensors on device, and only synchronized to host at the
+        end of epoch(or every ``log_interval`` batches while training).
 
-        for i, data in enumerate(dataloader):
+        :param dataloader: the dataloader.
+        :param metrics: the metrics to be updated, they will be reset at first.
+        :param epoch_state: the accumulated state of an interrupted epoch, the epoch will be continued from it.
+        :return: a tuple ``(loss, correct, total)``
+        """
+        metrics = metrics if metrics is not None else []
+        training = torch.is_grad_enabled()
+        skip = 0
+        # the number of batches finished before the dataloader starts, ``iter_num`` is the absolute index in epoch.
+        offset = 0
+        if epoch_state is None:
+            for m in metrics:
+                m.reset()
+            correct = torch.zeros((), dtype=torch.long, device=self.device)
+            loss_total = torch.zeros((), dtype=torch.float32, device=self.device)
+            total = 0
+            iter_num = 0
+        else:
+            correct = epoch_state["correct"].to(self.device)
+            loss_total = epoch_state["loss_total"].to(self.device)
+            total = epoch_state["total"]
+            iter_num = epoch_state["iter_num"]
+            skip = epoch_state.get("skip", 0)
+            offset = epoch_state.get("offset", 0)
+
+        try:
+            batches = len(dataloader) + offset
+        except TypeError:
+            batches = None
+        stepped = True
+        waited = time.perf_counter()
+        for data in dataloader:
+            if skip > 0:
+                skip -= 1
+                continue
+            now = time.perf_counter()
+            if training:
+                self.timer.add("data", now - waited)
             inputs, labels = data[0], data[1]
-            inputs = inputs.to(self.device)
-            labels = labels.to(self.device)
+            inputs = inputs.to(self.device, non_blocking=self.non_blocking)
+            if self.channels_last and inputs.dim() == 4:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+            labels = labels.to(self.device, non_blocking=self.non_blocking)
+
+            if training:
+                self.timer.add("h2d", time.perf_counter() - now)
+                first = iter_num % self.accumulation_steps == 0
+                stepped = (iter_num + 1) % self.accumulation_steps == 0 or iter_num + 1 == batches
+                outputs, loss = self._train_step(inputs, labels, first, stepped)
+            else:
+                with self._autocast():
+                    outputs = self.runner(inputs)
+                    loss = self.criterion(outputs, labels)
+
+            outputs = outputs.detach()
+            loss_total += loss.detach().float()
+            correct += (outputs.argmax(dim=1) == labels).sum()
+            total += labels.size(0)
+            iter_num += 1
+            for m in metrics:
+                m.update(outputs, labels)
+
+            if training:
+                self.samples += labels.size(0) * (self.world_size if self.rank is not None else 1)
+                if stepped:
+                    self.steps += 1
+
+            if training and stepped and self.resume_interval > 0:
+                # only saved after optimizer steps, the accumulated gradients are never lost.
+                self.__steps += 1
+                if self.__steps % self.resume_interval == 0:
+                    with self.timer.section("checkpoint"):
+                        self.__save_resume(self.__current_epoch, {
+                            "loss_total": loss_total,
+                            "correct": correct,
+                            "total": total,
+                            "iter_num": iter_num
+                        })
+
+            if training and self.log_interval > 0 and iter_num % self.log_interval == 0 and self.__is_main():
+                self.console_out.write("\t[%d] Loss: %.4f, Acc: %.2f%%\n" %
+                                       (iter_num, loss_total.item() / iter_num, 100 * correct.item() / total))
+                self.console_out.flush()
+
+            if training and stepped and self.__check_budget():
+                self.budget_exhausted = True
+                break
+            waited = time.perf_counter()
+
+        if training and not stepped:
+            # the dataloader has no length, the gradients of last batches are not applied.
+            self.__optimizer_step()
+
+        if training and self.rank is not None:
+            stats = torch.stack([loss_total.double().cpu(), correct.double().cpu(),
+                                 torch.tensor(total, dtype=torch.float64), torch.tensor(iter_num, dtype=torch.float64)])
+            dist.all_reduce(stats)
+            loss_total, correct, total, iter_num = stats[0], stats[1], int(stats[2].item()), int(stats[3].item())
+
+        if iter_num == 0:
+            return 0.0, 0, 0
+        return loss_total.item() / iter_num, int(correct.item()), total
+
+    def _train_step(self, inputs, labels, zero_grad=True, step=True) -> tuple:
+        """
+        Update model by a batch.
+
+        If the step runs out of memory(CUDA OOM or ``MemoryError``), the batch is split into micro-batches whose
+        gradients are accumulated, so the effective batch size is unchanged. The micro-batch size is halved until the
+        step succeeds, and is kept for the rest of training. The gradients accumulated from previous batches(see
+        ``accumulation_steps``) are kept if the batch runs out of memory before its backward, otherwise they cannot be
+        separated from the partial gradients of the failed batch, and are dropped with a warning.
+
+        In data-parallel training, only the backward of the last micro-batch before an optimizer step all-reduces
+        gradients(the others run in ``DistributedDataParallel.no_sync``). A retry only happens on the rank which runs
+        out of memory, if it runs out of memory in that backward, the all-reduces already started differ from the
+        other ranks, and the ranks may hang. Set a smaller ``batch_size`` instead of relying on the retry.
+
+        :param inputs: the inputs on device.
+        :param labels: the labels on device.
+        :param zero_grad: clear gradients before this batch, it's False for the non-first batches of an accumulation.
+        :param step: update parameters after this batch, it's False for the non-last batches of an accumulation.
+        :return: a tuple ``(outputs, loss)``, the loss is the mean over the whole batch.
+        """
+        while True:
+            self.__backward_started = False
+            try:
+                return self.__micro_batch_step(inputs, labels, zero_grad, step)
+            except (RuntimeError, MemoryError) as e:
+                if not self.__is_oom(e):
+                    raise
+                size = self.micro_batch_size if self.micro_batch_size is not None else inputs.size(0)
+                if size <= 1:
+                    raise
+                self.micro_batch_size = size // 2
+                if zero_grad or self.__backward_started:
+                    if not zero_grad:
+                        self.console_out.write("[WARN] the accumulated gradients are dropped.\n")
+                    self.optimizer.zero_grad()
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                self.console_out.write("[WARN] out of memory, retry with micro batch size %d.\n" %
+                                       self.micro_batch_size)
+
+    def __micro_batch_step(self, inputs, labels, zero_grad, step):
+        if zero_grad:
+            self.optimizer.zero_grad()
+        n = inputs.size(0)
+        size = self.micro_batch_size if self.micro_batch_size is not None else n
+        outputs_list = []
+        loss_total = None
+        for start in range(0, n, size):
+            x, y = inputs[start:start + size], labels[start:start + size]
+            # only the last backward before optimizer step all-reduces the accumulated gradients across ranks.
+            sync = step and start + size >= n
+            with self.__sync_context(sync):
+                with self.timer.section("forward"), self._autocast():
+                    outputs = self.train_runner(x)
+                    # the criterion is assumed to average over samples.
+                    loss = self.criterion(outputs, y) * (x.size(0) / n)
+                with self.timer.section("backward"):
+                    self.__backward_started = True
+                    scaled_loss = loss / self.accumulation_steps
+                    if self.scaler is not None:
+                        self.scaler.scale(scaled_loss).backward()
+                    else:
+                        scaled_loss.backward()
+            outputs_list.append(outputs.detach())
+            loss_total = loss.detach() if loss_total is None else loss_total + loss.detach()
+        if step:
+            self.__optimizer_step()
+        outputs = outputs_list[0] if len(outputs_list) == 1 else torch.cat(outputs_list)
+        return outputs, loss_total
+
+    def __sync_context(self, sync):
+        if sync or not isinstance(self.train_runner, DistributedDataParallel):
+            return contextlib.nullcontext()
+        return self.train_runner.no_sync()
+
+    def __optimizer_step(self):
+        with self.timer.section("optimizer"):
+            if self.scaler is not None:
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+            else:
+                self.optimizer.step()
 
-            if torch.is_grad_enabled():
-                self.optimizer.zero_grad()
+    def __is_oom(self, e):
+        if isinstance(e, MemoryError):
+            return True
+        return "out of memory" in str(e)
 
-            outputs = self.model(inputs)
+    def _monitor_value(self, name):
+        """
+        Get the latest value of a history field or a scalar metric.
 
-            if torch.is_grad_enabled():
-                loss = self.criterion(outputs, labels)
+        :param name: the field name of ``History``, or the key of metric history such as ``"val_top5_acc"``.
+        :return: the latest value, or None if it's not recorded.
+        """
+        if name in self.History._fields:
+            values = getattr(self.history, name)
+        elif name in self.metric_history:
+            values = self.metric_history[name]
+        else:
+            raise ValueError("unknown monitored value: %s" % name)
+        return values[-1] if len(values) > 0 else None
 
-            if torch.is_grad_enabled():
-                loss.backward()
-                self.optimizer.step()
+    def _prepare_model(self):
+        """
+        Move model to device, and build the runner of model.
 
-                loss_total += loss.item()
+        :return:
+        """
+        self.model = self.model.to(self.device)
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        if self.__runner_model is self.model:
+            return
+        for name in self.checkpoint_modules:
+            self.__checkpoint_module(self.model.get_submodule(name))
+        self.runner = self.model
+        self.__runner_model = self.model
+        if not self.compile_model:
+            return
+        model_cls = type(self.model)
+        cache_dir = os.path.join(self.compile_cache_dir, "%s.%s" % (model_cls.__module__, model_cls.__qualname__))
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+        try:
+            import torch._inductor.config as inductor_config
+            inductor_config.fx_graph_cache = True
+        except (ImportError, AttributeError):
+            pass
+        self.runner = torch.compile(self.model, backend=self.compile_backend, mode=self.compile_mode)
+
+    def __checkpoint_module(self, module):
+        if getattr(module, "_fedflow_checkpointed", False):
+            return
+        module.forward = CheckpointedForward(module)
+        module._fedflow_checkpointed = True
+
+    def peak_memory(self) -> dict:
+        """
+        The peak memory of current process.
 
-            iter_num += 1
+        :return: a dict ``{"host": bytes, "cuda": bytes}``, the ``cuda`` value is the peak allocated memory of trainer
+            device since training started, it's None if the device is not cuda.
+        """
+        try:
+            import resource
+            host = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # the unit of ru_maxrss is byte on macOS, and KB on linux.
+            if sys.platform != "darwin":
+                host *= 1024
+        except ImportError:
+            import psutil
+            host = psutil.Process().memory_info().rss
+        cuda = None
+        if torch.device(self.device).type == "cuda":
+            cuda = torch.cuda.max_memory_allocated(self.device)
+        return {
+            "host": host,
+            "cuda": cuda
+        }
 
-            _, pred = torch.max(outputs, 1)
-            c = (pred == labels)
-            for i, label in enumerate(labels):
-                correct += c[i].item()
-                total += 1
+    def _autocast(self):
+        """
+        The autocast context of forward and loss.
 
-        return loss_total / iter_num, correct, total
+        :return: a context manager, it does nothing if the precision is ``fp32``.
+        """
+        dtype = self.PRECISIONS[self.precision]
+        if dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=torch.device(self.device).type, dtype=dtype)
+
+    def __record_metrics(self, validate=True):
+        for prefix, metrics in (("train", self.train_metrics), ("val", self.val_metrics)):
+            for m in metrics:
+                value = m.compute() if prefix == "train" or validate else None
+                self.metric_history.setdefault("%s_%s" % (prefix, m.name), []).append(value)
+                if type(value) == float:
+                    self.console_out.write("\t%s %s: %.4f\n" % (prefix.capitalize(), m.name, value))
 
     def __time_format(self, seconds):
         minutes = seconds // 60
@@ -334,6 +1280,8 @@ class SupervisedTrainer(object):
 
     def __draw_png(self):
         xdata = range(len(self.history.train_acc))
+        val_loss = [v if v is not None else float("nan") for v in self.history.val_loss]
+        val_acc = [v if v is not None else float("nan") for v in self.history.val_acc]
 
         fig = plt.figure(figsize=(16, 14))
         spec = gridspec.GridSpec(ncols=2, nrows=2, wspace=0.3, hspace=0.4)
@@ -342,7 +1290,7 @@ class SupervisedTrainer(object):
         fig.add_subplot(spec[0, 0])
         plt.title("Loss")
         plt.plot(xdata, self.history.train_loss, label="train")
-        plt.plot(xdata, self.history.val_loss, label="val")
+        plt.plot(xdata, val_loss, label="val", marker=".")
         plt.grid()
         plt.legend()
 
@@ -350,7 +1298,7 @@ class SupervisedTrainer(object):
         fig.add_subplot(spec[0, 1])
         plt.title("Accuracy")
         plt.plot(xdata, self.history.train_acc, label="train")
-        plt.plot(xdata, self.history.val_acc, label="val")
+        plt.plot(xdata, val_acc, label="val", marker=".")
         plt.grid()
         plt.legend()
 
@@ -361,3 +1309,25 @@ class SupervisedTrainer(object):
         plt.grid()
 
         plt.savefig(self._graph_path())
+        plt.close(fig)
+
+
+class CheckpointedForward(object):
+
+    """
+    The forward of a submodule which recomputes its activations in backward.
+
+    It's a plain object instead of a closure, so the checkpointed model can be pickled to the spawned ranks of
+    data-parallel training.
+    """
+
+    def __init__(self, module, use_reentrant=False):
+        super(CheckpointedForward, self).__init__()
+        self.module = module
+        self.use_reentrant = use_reentrant
+
+    def __call__(self, *args, **kwargs):
+        forward = type(self.module).forward.__get__(self.module)
+        if self.module.training and torch.is_grad_enabled():
+            return torch.utils.checkpoint.checkpoint(forward, *args, use_reentrant=self.use_reentrant, **kwargs)
+        return forward(*args, **kwargs)
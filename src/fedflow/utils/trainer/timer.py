@@ -0,0 +1,74 @@
+"""
+Timer
+=======
+
+A low-overhead timer which accumulates the time spent in every section of training steps.
+"""
+
+__all__ = [
+    "StepTimer"
+]
+
+import contextlib
+import time
+
+
+class StepTimer(object):
+
+    """
+    Accumulate the seconds of training sections.
+
+    The timer only reads ``time.perf_counter``, it never synchronizes cuda. Because cuda kernels run asynchronously,
+    the time of a kernel is counted in the section where the host waits for it(usually the section which reads a
+    result, or the next ``data``/``h2d`` section).
+    """
+
+    SECTIONS = ("data", "h2d", "forward", "backward", "optimizer", "validation", "checkpoint")
+
+    def __init__(self):
+        super(StepTimer, self).__init__()
+        self.totals = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Clear all accumulated time.
+
+        :return:
+        """
+        self.totals = dict.fromkeys(self.SECTIONS, 0.0)
+
+    def add(self, name: str, seconds: float) -> None:
+        """
+        Add time to a section.
+
+        :param name: the section name.
+        :param seconds: the seconds.
+        :return:
+        """
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        """
+        Time a block of code.
+
+        >>> with timer.section("forward"):
+        >>>     outputs = model(inputs)
+
+        :param name: the section name.
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """
+        The accumulated seconds of all sections.
+
+        :return: a dict ``{section: seconds}``
+        """
+        return dict(self.totals)
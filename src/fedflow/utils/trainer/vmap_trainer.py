@@ -0,0 +1,247 @@
+"""
+Vectorized Trainer
+====================
+
+A trainer which trains many client replicas of a small model in lockstep inside one process by ``torch.func``.
+"""
+
+__all__ = [
+    "VectorizedTrainer"
+]
+
+import copy
+import json
+import math
+import os
+import sys
+
+import torch
+from torch.utils.data import DataLoader, Sampler
+
+
+class _PaddedBatchSampler(Sampler):
+
+    """
+    Yield ``steps`` batches of random indices every epoch, every sample is visited once in an epoch. The batches are
+    padded to ``batch_size`` by index 0, so the batches of all clients can be stacked. After the dataset is exhausted,
+    the batches only contain padding.
+    """
+
+    def __init__(self, length: int, batch_size: int, steps: int, epoch: int, generator: torch.Generator):
+        self.length = length
+        self.batch_size = batch_size
+        self.steps = steps
+        self.epoch = epoch
+        self.generator = generator
+
+    def __iter__(self):
+        for _ in range(self.epoch):
+            order = torch.randperm(self.length, generator=self.generator).tolist()
+            for i in range(self.steps):
+                batch = order[i * self.batch_size:(i + 1) * self.batch_size]
+                yield batch + [0] * (self.batch_size - len(batch))
+
+    def __len__(self):
+        return self.steps * self.epoch
+
+
+class VectorizedTrainer(object):
+
+    """
+    Train K replicas(clients) of the same architecture in lockstep.
+
+    The parameters of all clients are stacked by ``torch.func.stack_module_state``, and a step of all clients is a
+    single ``vmap`` of ``functional_call``, so tiny models don't pay the per-process overhead and small kernel
+    launches of K separate trainers. Every client starts from the same parameters and trains on its own dataset. An
+    epoch has ``ceil(max_dataset_len / batch_size)`` steps. Every client visits its samples once per epoch, the padded
+    samples of its last batch are masked out of its loss, and after its samples are exhausted it's masked out of the
+    step: its parameters and the per-client state of optimizer(such as momentum) are kept unchanged. The scalar state
+    of optimizer(such as the step count of Adam) is shared by all clients.
+
+    Because of ``vmap``, modules which update buffers in place(such as ``BatchNorm`` in training mode) are not
+    supported.
+    """
+
+    def __init__(self, model, criterion, datasets, *,
+                 optimizer=None,
+                 init_model_path=None,
+                 batch_size=32,
+                 epoch=1,
+                 num_workers=0,
+                 seed=None,
+                 device="cpu",
+                 console_out=None,
+                 result_dir=None):
+        """
+        Construct a vectorized trainer.
+
+        :param model: an instance of ``torch.nn.Module``, it's the template of clients.
+        :param criterion: loss function, it's applied to every sample, so it must average over samples.
+        :param datasets: a list of datasets, one for each client.
+        :param optimizer: a function which accepts a list of stacked parameters and returns an optimizer. The optimizer
+            must be element-wise(such as SGD and Adam), so updating stacked parameters is the same as updating every
+            client separately. Default is ``torch.optim.SGD`` with ``lr=0.01``.
+        :param init_model_path: the init model parameters path of all clients.
+        :param batch_size: the batch size of every client.
+        :param epoch: the epoch.
+        :param num_workers: the number of subprocesses used by the dataloader of every client.
+        :param seed: the seed of sampling data, default is random.
+        :param device: the device used for training.
+        :param console_out: redirect print.
+        :param result_dir: if it's not None, the parameters of client ``k`` are saved to ``client-k.pth`` and the
+            histories are saved to ``history.json`` in this directory.
+        """
+        super(VectorizedTrainer, self).__init__()
+        if len(datasets) == 0:
+            raise ValueError("datasets cannot be empty.")
+        if any(len(d) == 0 for d in datasets):
+            raise ValueError("the dataset of client cannot be empty.")
+        self.model = model
+        self.criterion = criterion
+        self.datasets = list(datasets)
+        self.optimizer_factory = optimizer if optimizer is not None else \
+            (lambda params: torch.optim.SGD(params, lr=0.01))
+        self.init_model_path = init_model_path
+        self.batch_size = batch_size
+        self.epoch = epoch
+        self.num_workers = num_workers
+        self.seed = seed if seed is not None else int(torch.randint(0, 2 ** 62, ()).item())
+        self.device = device
+        if console_out is None:
+            self.console_out = sys.stdout
+        elif type(console_out) == str:
+            self.console_out = open(console_out, "w")
+        else:
+            self.console_out = console_out
+        self.result_dir = result_dir
+
+        self.params = None
+        self.buffers = None
+        # client index -> {"train_loss": [...], "train_acc": [...]}
+        self.histories = [{"train_loss": [], "train_acc": []} for _ in self.datasets]
+
+    @property
+    def clients(self) -> int:
+        return len(self.datasets)
+
+    def train(self) -> dict:
+        """
+        Train all clients.
+
+        :return: a dict ``{"clients": K, "samples": [...], "train_loss": [...], "train_acc": [...]}``, the lists
+            contain the number of train samples and the values of last epoch of every client.
+        """
+        from torch.func import functional_call, stack_module_state, vmap
+
+        if self.init_model_path is not None and os.path.exists(self.init_model_path):
+            self.model.load_state_dict(torch.load(self.init_model_path, map_location="cpu"))
+        self.model = self.model.to(self.device)
+        replicas = [copy.deepcopy(self.model) for _ in range(self.clients)]
+        self.params, self.buffers = stack_module_state(replicas)
+        del replicas
+        # the template only provides the structure, its parameters are never used.
+        template = copy.deepcopy(self.model).to("meta")
+        optimizer = self.optimizer_factory(list(self.params.values()))
+
+        sample_loss = vmap(lambda output, label: self.criterion(output.unsqueeze(0), label.unsqueeze(0)))
+
+        def compute_loss(params, buffers, inputs, labels, mask):
+            outputs = functional_call(template, (params, buffers), (inputs,))
+            # the padded samples are masked out, the loss of a finished client is 0.
+            loss = (sample_loss(outputs, labels) * mask).sum() / mask.sum().clamp(min=1)
+            return loss, outputs
+
+        step = vmap(compute_loss, randomness="different")
+
+        lengths = torch.tensor([len(d) for d in self.datasets], device=self.device)
+        steps = max(math.ceil(len(d) / self.batch_size) for d in self.datasets)
+        positions = torch.arange(self.batch_size, device=self.device)
+        loaders = []
+        for k, dataset in enumerate(self.datasets):
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + k)
+            sampler = _PaddedBatchSampler(len(dataset), self.batch_size, steps, self.epoch, generator)
+            loaders.append(iter(DataLoader(dataset, batch_sampler=sampler, num_workers=self.num_workers)))
+
+        for e in range(self.epoch):
+            loss_total = torch.zeros(self.clients, device=self.device)
+            correct = torch.zeros(self.clients, dtype=torch.long, device=self.device)
+            for i in range(steps):
+                batches = [next(loader) for loader in loaders]
+                inputs = torch.stack([b[0] for b in batches]).to(self.device)
+                labels = torch.stack([b[1] for b in batches]).to(self.device)
+                counts = (lengths - i * self.batch_size).clamp(0, self.batch_size)
+                mask = positions.unsqueeze(0) < counts.unsqueeze(1)
+
+                optimizer.zero_grad()
+                losses, outputs = step(self.params, self.buffers, inputs, labels, mask.float())
+                # the clients are independent, so the gradient of sum is the gradient of every client.
+                losses.sum().backward()
+                finished = counts == 0
+                if finished.any():
+                    self.__masked_step(optimizer, finished)
+                else:
+                    optimizer.step()
+
+                loss_total += losses.detach() * counts
+                correct += ((outputs.detach().argmax(dim=2) == labels) & mask).sum(dim=1)
+
+            loss_values = (loss_total / lengths).tolist()
+            acc_values = (correct.double() / lengths).tolist()
+            for k in range(self.clients):
+                self.histories[k]["train_loss"].append(loss_values[k])
+                self.histories[k]["train_acc"].append(acc_values[k])
+            self.console_out.write("EPOCH %d of %d, mean loss: %.4f, mean acc: %.2f%%\n" %
+                                   (e + 1, self.epoch, sum(loss_values) / self.clients,
+                                    100 * sum(acc_values) / self.clients))
+            self.console_out.flush()
+
+        if self.result_dir is not None:
+            self.__save()
+        return {
+            "clients": self.clients,
+            "samples": [len(d) * self.epoch for d in self.datasets],
+            "train_loss": [h["train_loss"][-1] for h in self.histories],
+            "train_acc": [h["train_acc"][-1] for h in self.histories]
+        }
+
+    def __masked_step(self, optimizer, finished):
+        # the gradients of finished clients are 0, but weight decay and momentum would still update them.
+        tensors = []
+        for group in optimizer.param_groups:
+            for p in group["params"]:
+                tensors.append(p)
+                tensors += [v for v in optimizer.state[p].values()
+                            if isinstance(v, torch.Tensor) and v.dim() > 0 and v.shape[0] == self.clients]
+        with torch.no_grad():
+            saved = [t[finished].clone() for t in tensors]
+            optimizer.step()
+            for t, v in zip(tensors, saved):
+                t[finished] = v
+
+    def state_dict(self, k: int) -> dict:
+        """
+        The parameters of a client, it can be loaded by the template model.
+
+        :param k: the client index.
+        :return: a state dict.
+        """
+        stacked = dict(self.params)
+        stacked.update(self.buffers)
+        # the non-persistent buffers are not in state dict.
+        return {name: stacked[name][k].detach().clone() for name in self.model.state_dict().keys()}
+
+    def state_dicts(self) -> list:
+        """
+        The parameters of all clients.
+
+        :return: a list of state dicts.
+        """
+        return [self.state_dict(k) for k in range(self.clients)]
+
+    def __save(self):
+        os.makedirs(self.result_dir, exist_ok=True)
+        for k in range(self.clients):
+            torch.save(self.state_dict(k), os.path.join(self.result_dir, "client-%d.pth" % k))
+        with open(os.path.join(self.result_dir, "history.json"), "w") as f:
+            f.write(json.dumps(self.histories, indent=4))
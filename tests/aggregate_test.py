@@ -0,0 +1,190 @@
+import fedflow_test
+
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import torch
+import torch.nn as nn
+
+from fedflow.utils.aggregate import FedAvgAggregator, BufferedAsyncAggregator, UpdateCodec, fedavg, load_state_dict, \
+    parallel_fedavg
+
+
+def make_model(seed):
+    torch.manual_seed(seed)
+    model = nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4))
+    model(torch.randn(8, 4))
+    return model
+
+
+class FedAvgTestCase(unittest.TestCase):
+
+    def test_weighted_average(self):
+        state_dicts = [make_model(i).state_dict() for i in range(3)]
+        state_dicts[2]["1.num_batches_tracked"] += 2
+        weights = [1, 2, 3]
+        with tempfile.TemporaryDirectory() as d:
+            paths = []
+            for i, sd in enumerate(state_dicts):
+                paths.append(os.path.join(d, "client-%d.pth" % i))
+                torch.save(sd, paths[-1])
+            result = fedavg(paths, weights)
+
+        for key, value in result.items():
+            self.assertEqual(value.dtype, state_dicts[0][key].dtype)
+            if value.dtype.is_floating_point:
+                expected = sum(w * sd[key].double() for w, sd in zip(weights, state_dicts)) / sum(weights)
+                self.assertTrue(torch.allclose(value.double(), expected, atol=1e-6))
+        # (1 * 1 + 2 * 1 + 3 * 3) / 6 = 2
+        self.assertEqual(result["1.num_batches_tracked"].item(), 2)
+        make_model(0).load_state_dict(result)
+
+    def test_parallel(self):
+        state_dicts = [make_model(i).state_dict() for i in range(7)]
+        weights = list(range(1, 8))
+        with tempfile.TemporaryDirectory() as d:
+            paths = []
+            for i, sd in enumerate(state_dicts):
+                paths.append(os.path.join(d, "client-%d.pth" % i))
+                torch.save(sd, paths[-1])
+            expected = fedavg(paths, weights)
+            for processes in (1, 3, 4):
+                result = parallel_fedavg(paths, weights, processes=processes)
+                for key, value in expected.items():
+                    self.assertEqual(result[key].dtype, value.dtype)
+                    self.assertTrue(torch.allclose(result[key], value))
+
+    def test_mismatch(self):
+        aggregator = FedAvgAggregator()
+        aggregator.add(nn.Linear(4, 4).state_dict())
+        with self.assertRaises(ValueError):
+            aggregator.add(nn.Linear(4, 2).state_dict())
+        with self.assertRaises(ValueError):
+            FedAvgAggregator().result()
+
+
+class BufferedAsyncTestCase(unittest.TestCase):
+
+    def test_versions(self):
+        with tempfile.TemporaryDirectory() as d:
+            init = {"w": torch.zeros(2)}
+            aggregator = BufferedAsyncAggregator(d, init, buffer_size=2, max_versions=2, staleness_exponent=1.0,
+                                                 max_staleness=1)
+            self.assertEqual(BufferedAsyncAggregator.checkout(d), (0, aggregator.version_path(0)))
+
+            aggregator.add({"w": torch.ones(2)}, 0, weight=1)
+            self.assertEqual(aggregator.version, 0)
+            aggregator.add({"w": torch.full((2,), 3.0)}, 0, weight=3)
+            # (1 * 1 + 3 * 3) / 4
+            self.assertEqual(aggregator.version, 1)
+            self.assertTrue(torch.allclose(torch.load(aggregator.latest_path())["w"], torch.full((2,), 2.5)))
+
+            # staleness 1, weight (1 + 1) ^ -1
+            self.assertTrue(aggregator.add({"w": torch.full((2,), 4.0)}, 0, weight=1))
+            aggregator.add({"w": torch.full((2,), 2.5)}, 1, weight=1)
+            self.assertEqual(aggregator.version, 2)
+            self.assertTrue(torch.allclose(torch.load(aggregator.latest_path())["w"], torch.full((2,), 3.5)))
+            self.assertEqual(BufferedAsyncAggregator.checkout(d)[0], 2)
+            # version 0 is expired, but kept for the clients still loading it until next version
+            self.assertTrue(os.path.exists(aggregator.version_path(0)))
+            self.assertFalse(aggregator.add({"w": torch.ones(2)}, 0))
+            self.assertTrue(aggregator.finished())
+            aggregator.add({"w": torch.full((2,), 3.5)}, 2)
+            aggregator.flush()
+            self.assertFalse(os.path.exists(aggregator.version_path(0)))
+            self.assertTrue(os.path.exists(aggregator.version_path(1)))
+
+    def test_on_finish(self):
+        with tempfile.TemporaryDirectory() as d:
+            aggregator = BufferedAsyncAggregator(os.path.join(d, "global"), {"w": torch.zeros(2)}, buffer_size=2,
+                                                 max_versions=10)
+            for i in range(3):
+                workdir = os.path.join(d, "client-%d" % i)
+                os.makedirs(workdir)
+                torch.save({"w": torch.full((2,), float(i))}, os.path.join(workdir, "parameter.pth"))
+                task = SimpleNamespace(task_id="client-%d" % i, workdir=workdir,
+                                       result={"base_version": 0, "samples": 1})
+                aggregator.on_finish(task)
+            # the queued updates are folded before publishing the last version
+            aggregator.flush()
+            self.assertEqual(aggregator.accepted, 3)
+            self.assertEqual(aggregator.version, 2)
+
+    def test_client_source(self):
+        with tempfile.TemporaryDirectory() as d:
+            aggregator = BufferedAsyncAggregator(d, {"w": torch.zeros(2)}, max_clients=3)
+            self.assertEqual(list(aggregator.client_source(lambda i: "client-%d" % i)),
+                             ["client-0", "client-1", "client-2"])
+
+
+class UpdateCodecTestCase(unittest.TestCase):
+
+    def test_decode(self):
+        base, client = make_model(0).state_dict(), make_model(1).state_dict()
+        with tempfile.TemporaryDirectory() as d:
+            base_path = os.path.join(d, "base.pth")
+            torch.save(base, base_path)
+            for method, atol in (("fp16", 1e-2), ("int8", 5e-2), ("topk", None)):
+                encoded, residual = UpdateCodec.encode(client, base_path, method, ratio=1.0)
+                path = os.path.join(d, "%s.pth" % method)
+                torch.save(encoded, path)
+                decoded = load_state_dict(path)
+                self.assertEqual(list(decoded.keys()), list(client.keys()))
+                self.assertEqual(decoded["1.num_batches_tracked"], client["1.num_batches_tracked"])
+                for key, value in client.items():
+                    self.assertTrue(torch.allclose(decoded[key].float(), value.float(), atol=atol or 1e-6))
+                    if key in residual:
+                        self.assertTrue(torch.allclose(residual[key], value.float() - decoded[key].float(),
+                                                       atol=1e-5))
+
+    def test_error_feedback(self):
+        base = {"w": torch.zeros(4)}
+        client = {"w": torch.tensor([4.0, 3.0, 2.0, 1.0])}
+        with tempfile.TemporaryDirectory() as d:
+            base_path = os.path.join(d, "base.pth")
+            torch.save(base, base_path)
+            encoded, residual = UpdateCodec.encode(client, base_path, "topk", ratio=0.25)
+            self.assertTrue(torch.equal(UpdateCodec.decode(encoded)["w"], torch.tensor([4.0, 0, 0, 0])))
+            # the dropped elements are sent in the next update
+            encoded, residual = UpdateCodec.encode(base, base_path, "topk", ratio=0.25, residual=residual)
+            self.assertTrue(torch.equal(UpdateCodec.decode(encoded)["w"], torch.tensor([0, 3.0, 0, 0])))
+            self.assertTrue(torch.equal(residual["w"], torch.tensor([0, 0, 2.0, 1.0])))
+
+    def test_overwritten_base(self):
+        with tempfile.TemporaryDirectory() as d:
+            base_path = os.path.join(d, "base.pth")
+            torch.save({"w": torch.zeros(4)}, base_path)
+            encoded, _ = UpdateCodec.encode({"w": torch.ones(4)}, base_path, "fp16")
+            self.assertTrue(torch.equal(UpdateCodec.decode(encoded)["w"], torch.ones(4)))
+            # the base is overwritten by the next round
+            torch.save({"w": torch.ones(4)}, base_path)
+            with self.assertRaises(ValueError):
+                UpdateCodec.decode(encoded)
+            os.remove(base_path)
+            with self.assertRaises(ValueError):
+                UpdateCodec.decode(encoded)
+
+    def test_base_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            base_path = os.path.join(d, "base.pth")
+            torch.save({"w": torch.zeros(4)}, base_path)
+            # the base was published before clients started
+            os.utime(base_path, (time.time() - 60, time.time() - 60))
+            encoded = [UpdateCodec.encode({"w": torch.full((4,), i + 1.0)}, base_path, "fp16")[0] for i in range(3)]
+            with mock.patch.object(UpdateCodec, "file_hash", wraps=UpdateCodec.file_hash) as file_hash:
+                for i, e in enumerate(encoded):
+                    self.assertTrue(torch.equal(UpdateCodec.decode(e)["w"], torch.full((4,), i + 1.0)))
+                self.assertEqual(file_hash.call_count, 0)
+            # the overwritten base is hashed again
+            torch.save({"w": torch.ones(4)}, base_path)
+            os.utime(base_path, (time.time() - 30, time.time() - 30))
+            with self.assertRaises(ValueError):
+                UpdateCodec.decode(encoded[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
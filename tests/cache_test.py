@@ -0,0 +1,130 @@
+import fedflow_test
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from fedflow.context import WorkDirContext
+from fedflow.core.cache import ResultCache
+from fedflow.core.task import Task
+
+
+class CachedTask(Task):
+
+    def __init__(self, task_id, parameters, input_path=None):
+        super(CachedTask, self).__init__(task_id=task_id)
+        self.parameters = parameters
+        self.input_path = input_path
+
+    def load(self) -> None:
+        pass
+
+    def train(self, device: str) -> dict:
+        return {}
+
+    def cache_parameters(self):
+        return self.parameters
+
+    def cache_inputs(self) -> list:
+        return [self.input_path] if self.input_path is not None else []
+
+    def cache_outputs(self) -> list:
+        return ["output.txt"]
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def run_task(self, cache, task, content="output", size=0):
+        """restore the task from cache, or run it by writing its output and store it"""
+        report = cache.restore(task)
+        if report is not None:
+            return report
+        with WorkDirContext(self.root):
+            task.recover({"value": content})
+        os.makedirs(task.workdir, exist_ok=True)
+        with open(os.path.join(task.workdir, "output.txt"), "w") as f:
+            f.write(content + " " * size)
+        cache.store(task, {"train_time": 10})
+        cache.flush()
+        return None
+
+    def test_key(self):
+        cache = ResultCache(os.path.join(self.root, "cache"), "1GB")
+        input_path = os.path.join(self.root, "input.txt")
+        with open(input_path, "w") as f:
+            f.write("a")
+        key = cache.key(CachedTask("k0", {"lr": 0.1}, input_path))
+        self.assertIsNone(cache.key(CachedTask("k1", None)))
+        self.assertEqual(key, cache.key(CachedTask("k2", {"lr": 0.1}, input_path)))
+        self.assertNotEqual(key, cache.key(CachedTask("k3", {"lr": 0.2}, input_path)))
+        with open(input_path, "w") as f:
+            f.write("bb")
+        self.assertNotEqual(key, cache.key(CachedTask("k4", {"lr": 0.1}, input_path)))
+
+    def test_restore(self):
+        cache = ResultCache(os.path.join(self.root, "cache"), "1GB")
+        self.assertIsNone(self.run_task(cache, CachedTask("r0", {"x": 1}), "hello"))
+
+        task = CachedTask("r1", {"x": 1})
+        with WorkDirContext(self.root):
+            report = cache.restore(task)
+        self.assertEqual(report, {"train_time": 10})
+        self.assertEqual(task.result, {"value": "hello"})
+        with open(os.path.join(task.workdir, "output.txt")) as f:
+            self.assertEqual(f.read(), "hello")
+        with WorkDirContext(self.root):
+            self.assertIsNone(cache.restore(CachedTask("r2", {"x": 2})))
+
+    def test_store_background(self):
+        cache = ResultCache(os.path.join(self.root, "cache"), "1GB")
+        threads = []
+        copy2 = shutil.copy2
+
+        def record_copy(src, dst):
+            threads.append(threading.current_thread())
+            return copy2(src, dst)
+
+        with mock.patch("shutil.copy2", side_effect=record_copy):
+            self.run_task(cache, CachedTask("b0", {"x": 1}), "hello")
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        with WorkDirContext(self.root):
+            self.assertIsNotNone(cache.restore(CachedTask("b1", {"x": 1})))
+
+    def test_key_memoized(self):
+        cache = ResultCache(os.path.join(self.root, "cache"), "1GB")
+        task = CachedTask("m0", {"x": 1})
+        with mock.patch.object(task, "cache_parameters", wraps=task.cache_parameters) as parameters:
+            with WorkDirContext(self.root):
+                self.assertIsNone(cache.restore(task))
+                # the task is re-picked after an interruption
+                self.assertIsNone(cache.restore(task))
+            self.assertEqual(parameters.call_count, 1)
+
+    def test_evict(self):
+        directory = os.path.join(self.root, "cache")
+        cache = ResultCache(directory, 3500)
+        for i in range(3):
+            self.run_task(cache, CachedTask("e%d" % i, {"i": i}), size=1000)
+        # access entry 0, so entry 1 is the least recently used
+        with WorkDirContext(self.root):
+            self.assertIsNotNone(cache.restore(CachedTask("e0-again", {"i": 0})))
+        self.run_task(cache, CachedTask("e3", {"i": 3}), size=1000)
+        self.assertLessEqual(cache.size, 3500)
+        self.assertEqual(len(os.listdir(directory)), 3)
+        with WorkDirContext(self.root):
+            self.assertIsNotNone(cache.restore(CachedTask("e0-hit", {"i": 0})))
+            self.assertIsNone(cache.restore(CachedTask("e1-miss", {"i": 1})))
+
+        # the index is loaded from directory
+        self.assertEqual(ResultCache(directory, 3500).size, cache.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
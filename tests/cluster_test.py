@@ -0,0 +1,245 @@
+import fedflow_test
+
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from fedflow.config import Config
+from fedflow.context import WorkDirContext
+from fedflow.core.cluster import Agent, Coordinator, auth_digest, recv_frame, send_frame
+from fedflow.core.message import Handler, Message, MessageListener
+from fedflow.core.task import Task, TaskStatus
+
+
+class EchoTask(Task):
+
+    def load(self) -> None:
+        self.loaded = True
+
+    def train(self, device: str) -> dict:
+        return {
+            "pid": os.getpid(),
+            "workdir": os.getcwd(),
+            "device": device
+        }
+
+
+class QueueHandler(Handler):
+
+    def __init__(self):
+        super(QueueHandler, self).__init__()
+        self.messages = queue.Queue()
+
+    def handle(self, source: str, cmd: str, data: dict) -> None:
+        self.messages.put((source, cmd, data))
+
+
+class ClusterTestCase(unittest.TestCase):
+
+    def wait_status(self, handler, status, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            source, cmd, data = handler.messages.get(timeout=timeout)
+            if cmd == "update_status" and data["status"] == status:
+                return source, data
+        self.fail("wait %s timeout" % status.name)
+
+    def test_agents(self):
+        root = tempfile.mkdtemp()
+        Config.set_property("workdir", os.path.join(root, "main"))
+        Config.set_property("cluster.heartbeat", 1)
+        Config.set_property("cluster.token", "")
+        with self.assertRaises(ValueError):
+            Coordinator.start("127.0.0.1", 0)
+        Config.set_property("cluster.token", "secret")
+        os.makedirs(Config.get_property("workdir"), exist_ok=True)
+
+        host, port = Coordinator.start("127.0.0.1", 0)
+        agents = [Agent(host, port, os.path.join(root, "agent-%d" % i), name="agent-%d" % i) for i in range(2)]
+        for agent in agents:
+            threading.Thread(target=agent.run, daemon=True).start()
+        MessageListener.start()
+        try:
+            deadline = time.time() + 10
+            while len(Coordinator.workers()) < 2 and time.time() < deadline:
+                time.sleep(0.1)
+            workers = sorted(Coordinator.workers(), key=lambda w: w.name)
+            self.assertEqual([w.name for w in workers], ["agent-0", "agent-1"])
+            self.assertIn("memory_available", workers[0].resources)
+
+            for i, worker in enumerate(workers):
+                handler = QueueHandler()
+                task = EchoTask("echo-%d" % i)
+                MessageListener.register_handler(task.task_id, handler)
+                with WorkDirContext(Config.get_property("workdir")):
+                    task.start(worker)
+                self.wait_status(handler, TaskStatus.AVAILABLE)
+                task.start_load()
+                self.wait_status(handler, TaskStatus.WAITING)
+                task.start_train("cpu")
+                _, data = self.wait_status(handler, TaskStatus.FINISHED)
+                self.assertEqual(data["data"]["device"], "cpu")
+                self.assertEqual(data["data"]["workdir"], os.path.join(root, "agent-%d" % i, task.task_id))
+                self.assertEqual(task.workdir, data["data"]["workdir"])
+                self.assertTrue(task.is_alive())
+                task.exit()
+                deadline = time.time() + 10
+                while task.is_alive() and time.time() < deadline:
+                    time.sleep(0.1)
+                self.assertFalse(task.is_alive())
+        finally:
+            for agent in agents:
+                agent.stop()
+            Coordinator.stop()
+            MessageListener.stop()
+
+    def test_relative_workdir(self):
+        root = tempfile.mkdtemp()
+        Config.set_property("workdir", "res")
+        Config.set_property("cluster.heartbeat", 1)
+        Config.set_property("cluster.token", "secret")
+        os.makedirs(os.path.join(root, "res", "group"))
+        agent_root = os.path.join(root, "agent")
+        with WorkDirContext(root), WorkDirContext("res"):
+            # the flow chdir into the relative workdir before coordinator is started
+            host, port = Coordinator.start("127.0.0.1", 0, workdir=os.curdir)
+        agent = Agent(host, port, agent_root, name="agent")
+        threading.Thread(target=agent.run, daemon=True).start()
+        MessageListener.start()
+        try:
+            deadline = time.time() + 10
+            while len(Coordinator.workers()) < 1 and time.time() < deadline:
+                time.sleep(0.1)
+            worker = Coordinator.workers()[0]
+            handler = QueueHandler()
+            task = EchoTask("relative")
+            MessageListener.register_handler(task.task_id, handler)
+            with WorkDirContext(os.path.join(root, "res", "group")):
+                task.start(worker)
+                with self.assertRaises(ValueError):
+                    worker.relpath(root)
+            self.assertEqual(task.workdir, os.path.join(agent_root, "group", "relative"))
+            self.wait_status(handler, TaskStatus.AVAILABLE)
+            task.start_load()
+            self.wait_status(handler, TaskStatus.WAITING)
+            task.start_train("cpu")
+            _, data = self.wait_status(handler, TaskStatus.FINISHED)
+            self.assertEqual(data["data"]["workdir"], task.workdir)
+            task.exit()
+        finally:
+            agent.stop()
+            Coordinator.stop()
+            MessageListener.stop()
+
+    def hello(self, **kwargs):
+        hello = {"cmd": "REGISTER", "nonce": "n0", "name": "a", "workdir": "/tmp",
+                 "resources": {"cpu_percent": 0, "memory_total": 1, "memory_available": 1, "gpus": []}}
+        hello.update(kwargs)
+        return hello
+
+    def register(self, host, port, token="secret", **kwargs):
+        """connect as an agent, return the socket and the last reply of coordinator"""
+        sock = socket.create_connection((host, port))
+        sock.settimeout(10)
+        hello = self.hello(**kwargs)
+        send_frame(sock, hello, raw=True)
+        challenge = recv_frame(sock, allow_pickle=False)
+        if challenge is None:
+            return sock, None
+        self.assertEqual(challenge["cmd"], "CHALLENGE")
+        self.assertEqual(challenge["proof"], auth_digest("secret", "coordinator", hello["nonce"], challenge["nonce"]))
+        send_frame(sock, {"cmd": "AUTH", "proof": auth_digest(token, "agent", hello["nonce"], challenge["nonce"])},
+                   raw=True)
+        return sock, recv_frame(sock, allow_pickle=False)
+
+    def test_reject(self):
+        Config.set_property("cluster.token", "secret")
+        host, port = Coordinator.start("127.0.0.1", 0)
+        try:
+            hellos = [
+                {"cmd": "REGISTER", "token": "secret", "name": "a", "workdir": "/tmp", "resources": {}},
+                self.hello(nonce=""),
+                self.hello(workdir=None),
+                self.hello(resources={"gpus": []}),
+                ["REGISTER"]
+            ]
+            for hello in hellos:
+                sock = socket.create_connection((host, port))
+                send_frame(sock, hello, raw=True)
+                sock.settimeout(10)
+                # the connection is closed without reply
+                self.assertIsNone(recv_frame(sock, allow_pickle=False))
+                sock.close()
+            # the token is never sent, a wrong proof is rejected after challenge
+            sock, reply = self.register(host, port, token="wrong")
+            self.assertIsNone(reply)
+            sock.close()
+            self.assertEqual(Coordinator.workers(), [])
+        finally:
+            Coordinator.stop()
+
+    def test_authenticate_coordinator(self):
+        Config.set_property("cluster.token", "secret")
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+
+        def fake_coordinator():
+            sock, _ = server.accept()
+            hello = recv_frame(sock, allow_pickle=False)
+            # the coordinator does not know the token
+            send_frame(sock, {"cmd": "CHALLENGE", "nonce": "n1",
+                              "proof": auth_digest("guess", "coordinator", hello["nonce"], "n1")}, raw=True)
+            send_frame(sock, {"cmd": "ACCEPT"}, raw=True)
+            send_frame(sock, Message(source="", cmd="START", data={}))
+            sock.close()
+
+        t = threading.Thread(target=fake_coordinator, daemon=True)
+        t.start()
+        try:
+            agent = Agent("127.0.0.1", server.getsockname()[1], tempfile.mkdtemp(), name="agent")
+            with self.assertRaises(ConnectionError):
+                agent.run()
+            t.join(10)
+        finally:
+            server.close()
+
+    def test_disconnect(self):
+        Config.set_property("cluster.token", "secret")
+        Config.set_property("workdir", tempfile.mkdtemp())
+        host, port = Coordinator.start("127.0.0.1", 0)
+        MessageListener.start()
+        try:
+            sock, reply = self.register(host, port)
+            self.assertEqual(reply, {"cmd": "ACCEPT"})
+            deadline = time.time() + 10
+            while len(Coordinator.workers()) < 1 and time.time() < deadline:
+                time.sleep(0.1)
+            worker = Coordinator.workers()[0]
+            handlers = {}
+            for task_id in ("finished", "training"):
+                handlers[task_id] = QueueHandler()
+                MessageListener.register_handler(task_id, handlers[task_id])
+                worker.start_task(EchoTask(task_id), ".")
+            for task_id, status in (("finished", TaskStatus.FINISHED), ("training", TaskStatus.TRAINING)):
+                message = Message(source=task_id, cmd="update_status", data={"status": status})
+                send_frame(sock, Message(source="a", cmd="MESSAGE", data={"message": message}))
+            self.wait_status(handlers["finished"], TaskStatus.FINISHED)
+            self.wait_status(handlers["training"], TaskStatus.TRAINING)
+            sock.close()
+            # only the task still running is failed
+            _, data = self.wait_status(handlers["training"], TaskStatus.EXCEPTION)
+            self.assertEqual(data["stage"], "AGENT")
+            time.sleep(0.5)
+            self.assertTrue(handlers["finished"].messages.empty())
+            self.assertFalse(worker.is_running("training"))
+        finally:
+            Coordinator.stop()
+            MessageListener.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import fedflow_test
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from fedflow.core.journal import Journal
+from fedflow.core.task import Task, TaskStatus
+from fedflow.core.taskgroup import TaskGroup
+
+
+class DummyTask(Task):
+
+    def load(self) -> None:
+        pass
+
+    def train(self, device: str) -> dict:
+        return {}
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def test_resume(self):
+        path = os.path.join(tempfile.mkdtemp(), "group.journal")
+
+        group = TaskGroup("journal")
+        for i in range(3):
+            group.add_task(DummyTask(i))
+        group.journal = Journal(path)
+        group.journal.open()
+        task = group.get_task(1)
+        task.result = {"acc": 0.5}
+        group.move_task(1, TaskStatus.INIT, TaskStatus.EXITED)
+        group.report_finish(1, {"load_time": 10, "train_time": 20, "data": {"acc": 0.5}})
+        group.move_task(2, TaskStatus.INIT, TaskStatus.AVAILABLE)
+        group.journal.close()
+        with open(path, "a") as f:
+            # a broken record written by a dead process
+            f.write('{"time": 1, "task_id": 0, "sta')
+
+        finished = Journal.replay(path)
+        self.assertEqual(list(finished.keys()), [1])
+
+        group = TaskGroup("journal")
+        group.add_task(DummyTask(0))
+        group.recover(finished)
+        group.add_task(DummyTask(1))
+        group.add_task(DummyTask(2))
+        self.assertEqual(group.get_task(1).status, TaskStatus.EXITED)
+        self.assertEqual(group.get_task(1).result, {"acc": 0.5})
+        self.assertEqual(group.get_task(1).train_time, 20)
+        self.assertEqual(group.success_number, 1)
+        self.assertEqual(len(group.tasks[TaskStatus.INIT]), 2)
+
+    def test_reopen_truncated(self):
+        path = os.path.join(tempfile.mkdtemp(), "reopen.journal")
+        journal = Journal(path)
+        journal.open()
+        journal.record("a", TaskStatus.FINISHED, {"acc": 1})
+        journal.close()
+        with open(path, "a") as f:
+            f.write('{"time": 1, "task_id": "x", "sta')
+
+        journal = Journal(path)
+        journal.open(append=True)
+        journal.record("b", TaskStatus.FINISHED, {"acc": 2})
+        journal.close()
+        finished = Journal.replay(path)
+        self.assertEqual(finished, {"a": {"acc": 1}, "b": {"acc": 2}})
+
+    def test_exact_data(self):
+        path = os.path.join(tempfile.mkdtemp(), "exact.journal")
+        data = {
+            "data": {"loss": torch.tensor([0.5, 0.25]), "acc": np.float32(0.75), "shape": (3, 4), "classes": {0: 10}},
+            "train_time": 20
+        }
+        journal = Journal(path)
+        journal.open()
+        journal.record("a", TaskStatus.FINISHED, data)
+        journal.record("b", TaskStatus.FINISHED, {"acc": 1, "history": [0.5, 1]})
+        journal.close()
+        finished = Journal.replay(path)
+        self.assertEqual(finished["b"], {"acc": 1, "history": [0.5, 1]})
+        result = finished["a"]["data"]
+        self.assertTrue(torch.equal(result["loss"], data["data"]["loss"]))
+        self.assertIsInstance(result["acc"], np.float32)
+        self.assertEqual(result["shape"], (3, 4))
+        self.assertEqual(result["classes"], {0: 10})
+        with open(path) as f:
+            # the json data is still readable
+            self.assertIn('"history": [0.5, 1]', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import fedflow_test
+
+import unittest
+
+import torch
+
+from fedflow.utils.trainer import TopKAccuracy, PerClassAccuracy, ConfusionMatrix, EarlyStopping
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_metrics(self):
+        outputs = torch.tensor([[0.9, 0.1, 0.0], [0.1, 0.2, 0.7], [0.2, 0.5, 0.3], [0.6, 0.3, 0.1]])
+        labels = torch.tensor([0, 1, 1, 2])
+        top1, top2 = TopKAccuracy(1), TopKAccuracy(2)
+        per_class, matrix = PerClassAccuracy(3), ConfusionMatrix(3)
+        for m in (top1, top2, per_class, matrix):
+            m.reset()
+            m.update(outputs, labels)
+        self.assertAlmostEqual(top1.compute(), 0.5)
+        self.assertAlmostEqual(top2.compute(), 0.75)
+        self.assertEqual(per_class.compute(), [1.0, 0.5, 0.0])
+        self.assertEqual(matrix.compute(), [[1, 0, 0], [0, 1, 1], [1, 0, 0]])
+
+
+class EarlyStoppingTestCase(unittest.TestCase):
+
+    def test_step(self):
+        stopping = EarlyStopping("val_acc", patience=2, min_delta=0.01)
+        self.assertEqual([stopping.step(i + 1, v) for i, v in enumerate([0.5, 0.6, 0.605, 0.61, 0.7])],
+                         [False, False, False, True, False])
+        self.assertEqual(stopping.best_epoch, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
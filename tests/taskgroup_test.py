@@ -0,0 +1,266 @@
+import fedflow_test
+
+import unittest
+
+from fedflow.core.task import Task, TaskStatus
+from fedflow.core.taskgroup import TaskContainer, TaskGroup
+
+
+class DummyTask(Task):
+
+    def load(self) -> None:
+        pass
+
+    def train(self, device: str) -> dict:
+        return {}
+
+
+class TaskGroupTestCase(unittest.TestCase):
+
+    def test_dependencies(self):
+        group = TaskGroup("dag")
+        split = DummyTask("split")
+        trains = [DummyTask("train-%d" % i) for i in range(3)]
+        aggregate = DummyTask("aggregate")
+        for t in trains:
+            t.depend_on(split)
+        aggregate.depend_on(*trains, required=2)
+        for t in [aggregate, split] + trains:
+            group.add_task(t)
+        group.prepare()
+
+        self.assertEqual(group.priority("split"), 3)
+        self.assertEqual(group.priority("aggregate"), 1)
+        self.assertEqual(len(group.tasks[TaskStatus.BLOCKED]), 4)
+        self.assertIs(group.retrieve_task(TaskStatus.INIT), split)
+
+        group.move_task("split", TaskStatus.INIT, TaskStatus.EXITED)
+        group.report_finish("split")
+        self.assertEqual(len(group.tasks[TaskStatus.INIT]), 3)
+
+        group.move_task("train-0", TaskStatus.INIT, TaskStatus.EXITED)
+        group.report_finish("train-0")
+        self.assertEqual(aggregate.status, TaskStatus.BLOCKED)
+        group.move_task("train-1", TaskStatus.INIT, TaskStatus.EXITED)
+        group.report_finish("train-1")
+        self.assertEqual(aggregate.status, TaskStatus.INIT)
+
+    def test_failed_dependencies(self):
+        group = TaskGroup("dag-failed")
+        a, b, c = DummyTask("a"), DummyTask("b"), DummyTask("c")
+        b.depend_on(a)
+        c.depend_on(b)
+        for t in (a, b, c):
+            group.add_task(t)
+        group.prepare()
+
+        group.report_exception("a", "train", "error")
+        group.move_task("a", TaskStatus.INIT, TaskStatus.EXCEPTION)
+        self.assertEqual(b.status, TaskStatus.EXCEPTION)
+        self.assertEqual(c.status, TaskStatus.EXCEPTION)
+
+    def test_long_failed_chain(self):
+        group = TaskGroup("chain")
+        tasks = [DummyTask("chain-%d" % i) for i in range(5000)]
+        for i in range(1, len(tasks)):
+            tasks[i].depend_on(tasks[i - 1])
+        for t in reversed(tasks):
+            group.add_task(t)
+        group.prepare()
+
+        group.move_task("chain-0", TaskStatus.INIT, TaskStatus.EXCEPTION)
+        group.report_exception("chain-0", "train", "error")
+        self.assertEqual(tasks[-1].status, TaskStatus.EXCEPTION)
+        self.assertEqual(group.failed_number, len(tasks))
+        self.assertTrue(group.finished())
+        self.assertTrue(group.finished())
+
+    def test_circular_dependencies(self):
+        group = TaskGroup("dag-circular")
+        a, b, c = DummyTask("a"), DummyTask("b"), DummyTask("c")
+        a.depend_on(b)
+        b.depend_on(a)
+        # c is behind the circle, but not in it
+        a.depend_on(c)
+        for t in (c, a, b):
+            group.add_task(t)
+        with self.assertRaises(ValueError) as context:
+            group.prepare()
+        self.assertNotIn("task[c]", str(context.exception))
+
+    def test_long_chain_priority(self):
+        group = TaskGroup("long-chain")
+        tasks = [DummyTask("long-%d" % i) for i in range(20000)]
+        for i in range(1, len(tasks)):
+            tasks[i].depend_on(tasks[i - 1])
+        for t in tasks:
+            group.add_task(t)
+        group.prepare()
+        self.assertEqual(group.priority("long-0"), len(tasks))
+        self.assertEqual(group.priority("long-%d" % (len(tasks) - 1)), 1)
+        self.assertIs(group.retrieve_task(TaskStatus.INIT), tasks[0])
+
+    def test_source_priority(self):
+        group = TaskGroup("source-priority")
+        first, second = DummyTask("source-first"), DummyTask("source-second")
+
+        def generate():
+            yield DummyTask("source-other")
+            yield first
+            second.depend_on(first)
+            yield second
+
+        group.add_task_source(generate(), total=3)
+        group.prepare()
+        group.materialize(10)
+        # the priority of first is raised by its dependent materialized later
+        self.assertEqual(group.priority("source-first"), 2)
+        self.assertIs(group.retrieve_task(TaskStatus.INIT), first)
+
+    def test_registry(self):
+        group = TaskGroup("registry")
+        for i in range(100):
+            group.add_task(DummyTask(i))
+        self.assertIs(group.get_task(42), group.tasks[TaskStatus.INIT].get(42))
+        for i in range(60):
+            task = group.retrieve_task(TaskStatus.INIT)
+            group.move_task(task.task_id, TaskStatus.INIT, TaskStatus.AVAILABLE)
+        self.assertEqual(len(group.tasks[TaskStatus.INIT]), 40)
+        self.assertEqual(len(group.tasks[TaskStatus.AVAILABLE]), 60)
+        self.assertIn(42, group.tasks[group.get_task(42).status])
+        self.assertRaises(ValueError, group.add_task, DummyTask(42))
+
+    def test_container(self):
+        container = TaskContainer()
+        for i in range(1000):
+            container.add(DummyTask(i), priority=i % 2)
+            container.pop(i)
+            # the emptied buckets are popped from heap lazily
+            container.random()
+        container.add(DummyTask("high"), priority=3)
+        container.add(DummyTask("low"), priority=1)
+        self.assertEqual(container.random().task_id, "high")
+        self.assertLessEqual(len(container._TaskContainer__heap), 3)
+        container.pop("high")
+        self.assertEqual(container.random().task_id, "low")
+        for i in range(1000):
+            container.add(DummyTask(i), priority=2)
+            container.pop(i)
+        self.assertLessEqual(len(container._TaskContainer__heap), 3)
+
+    def test_task_source(self):
+        group = TaskGroup("source")
+        created = []
+
+        def generate():
+            for i in range(5):
+                created.append(i)
+                yield DummyTask("lazy-%d" % i)
+
+        group.add_task_source(generate(), total=5)
+        self.assertEqual(len(created), 0)
+        self.assertEqual(group.total_number(), 5)
+        self.assertFalse(group.finished())
+
+        self.assertEqual(group.materialize(2), 2)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(group.total_number(), 5)
+
+        for i in range(5):
+            group.materialize(1)
+            task = group.retrieve_task(TaskStatus.INIT)
+            group.move_task(task.task_id, TaskStatus.INIT, TaskStatus.EXITED)
+            group.report_finish(task.task_id)
+        self.assertFalse(group.finished())
+        self.assertEqual(group.materialize(1), 0)
+        self.assertTrue(group.finished())
+
+    def test_blocked_task_source(self):
+        group = TaskGroup("blocked-source")
+        root = DummyTask("root")
+
+        def generate():
+            for i in range(5):
+                task = DummyTask("leaf-%d" % i)
+                task.depend_on(root)
+                yield task
+            yield root
+
+        group.add_task_source(generate(), total=6)
+        # the blocked tasks are counted, but the group keeps pulling until a task can start.
+        self.assertEqual(group.materialize(2), 6)
+        self.assertEqual(len(group.tasks[TaskStatus.BLOCKED]), 5)
+
+        group = TaskGroup("blocked-source-2")
+        root = DummyTask("root-2")
+
+        def generate_after_root():
+            yield root
+            for i in range(5):
+                task = DummyTask("leaf-2-%d" % i)
+                task.depend_on(root)
+                yield task
+
+        group.add_task_source(generate_after_root(), total=6)
+        self.assertEqual(group.materialize(2), 2)
+        self.assertEqual(len(group.tasks[TaskStatus.BLOCKED]), 1)
+
+    def test_release_finished(self):
+        group = TaskGroup("release")
+        root = DummyTask("release-root")
+
+        def generate():
+            yield root
+            leaf = DummyTask("release-leaf")
+            leaf.depend_on(root)
+            yield leaf
+
+        group.add_task_source(generate(), total=2)
+        group.materialize(1)
+        group.move_task(root.task_id, TaskStatus.INIT, TaskStatus.EXITED)
+        group.report_finish(root.task_id)
+        self.assertIs(group.get_task(root.task_id), root)
+
+        # the finished task is released, the task depends on it is still resolved.
+        self.assertEqual(group.materialize(1), 1)
+        self.assertIsNone(group.get_task(root.task_id))
+        self.assertEqual(len(group.tasks[TaskStatus.EXITED]), 0)
+        self.assertEqual(group.result[root.task_id]["type"], "success")
+        leaf = group.retrieve_task(TaskStatus.INIT)
+        self.assertEqual(leaf.task_id, "release-leaf")
+        self.assertRaises(ValueError, group.add_task, DummyTask(root.task_id))
+
+        group.report_exception(leaf.task_id, "train", "error")
+        # not released until it's moved to EXCEPTION status.
+        group.materialize(1)
+        self.assertIs(group.get_task(leaf.task_id), leaf)
+        group.move_task(leaf.task_id, TaskStatus.INIT, TaskStatus.EXCEPTION)
+        group.materialize(1)
+        self.assertIsNone(group.get_task(leaf.task_id))
+        self.assertTrue(group.finished())
+
+    def test_auto_adjust_memory(self):
+        group = TaskGroup("adjust")
+        group.auto_adjust_memory = True
+        group.add_task(DummyTask("peak"))
+        group.move_task("peak", TaskStatus.INIT, TaskStatus.EXITED)
+        group.report_finish("peak", {"data": {"peak_memory": {"host": 1024, "cuda": None}}})
+        self.assertEqual(group.estimate_memory, 1024)
+
+    def test_finish_callback(self):
+        group = TaskGroup("callback")
+        finished = []
+        group.add_finish_callback(lambda task: finished.append(task.result["value"]))
+        group.add_finish_callback(lambda task: 1 / 0)
+        task = DummyTask("callback-task")
+        group.add_task(task)
+        task.result = {"value": 1}
+        group.move_task(task.task_id, TaskStatus.INIT, TaskStatus.EXITED)
+        # the exception of callback is ignored
+        group.report_finish(task.task_id)
+        self.assertEqual(finished, [1])
+        self.assertTrue(group.finished())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,404 @@
+import fedflow_test
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+from torch.utils.data import TensorDataset
+
+from fedflow.utils.aggregate import load_state_dict
+from fedflow.utils.trainer import SupervisedTrainer, TopKAccuracy, ConfusionMatrix, EarlyStopping
+
+
+def make_dataset(n=64, features=8, classes=3):
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(n, features, generator=generator)
+    y = torch.randint(0, classes, (n,), generator=generator)
+    return TensorDataset(x, y)
+
+
+class Net(nn.Module):
+
+    def __init__(self):
+        super(Net, self).__init__()
+        self.body = nn.Sequential(nn.Linear(8, 16), nn.ReLU())
+        self.head = nn.Linear(16, 3)
+
+    def forward(self, inputs):
+        return self.head(self.body(inputs))
+
+
+def make_trainer(result_dir, **kwargs):
+    model = nn.Linear(8, 3)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    kwargs.setdefault("epoch", 2)
+    kwargs.setdefault("checkpoint_interval", 0)
+    return SupervisedTrainer(model, optimizer, nn.CrossEntropyLoss(), dataset=make_dataset(), batch_size=16,
+                             device="cpu", result_dir=result_dir,
+                             console_out=open(os.devnull, "w"), **kwargs)
+
+
+class TrainerMetricsTestCase(unittest.TestCase):
+
+    def test_trainer_metrics(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, metrics=[TopKAccuracy(2), ConfusionMatrix(3)])
+            result = trainer.train()
+            self.assertIn("val_acc", result)
+            with open(os.path.join(result_dir, "history.json")) as f:
+                history = json.load(f)
+            self.assertEqual(len(history["metrics"]["val_top2_acc"]), 2)
+            self.assertEqual(sum(map(sum, history["metrics"]["train_confusion_matrix"][-1])), 45)
+            self.assertGreater(history["val_loss"][-1], 0)
+            self.assertEqual(len(history["timing"]), 2)
+            self.assertGreater(result["timing"]["forward"], 0)
+            self.assertGreater(result["timing"]["validation"], 0)
+
+
+class DataLoaderTestCase(unittest.TestCase):
+
+    def test_autotune_dataloader(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, pin_memory=True, non_blocking=True, cpu_budget=1)
+            selected = trainer.autotune_dataloader(batches=2)
+            self.assertIn(selected, (0, 1))
+            self.assertEqual(trainer.train_dataloader.num_workers, selected)
+            trainer.train()
+
+
+class PrecisionTestCase(unittest.TestCase):
+
+    def test_bf16(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, precision="bf16")
+            trainer.train()
+            with open(os.path.join(result_dir, "history.json")) as f:
+                self.assertEqual(json.load(f)["precision"], "bf16")
+        self.assertRaises(ValueError, make_trainer, ".", precision="int4")
+
+
+class CompileTestCase(unittest.TestCase):
+
+    def test_compile(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, compile_model=True, compile_backend="eager",
+                                   compile_cache_dir=os.path.join(result_dir, "cache"))
+            trainer.train()
+            parameters = torch.load(os.path.join(result_dir, "parameter.pth"))
+            self.assertEqual(set(parameters.keys()), {"weight", "bias"})
+
+
+class CheckpointTestCase(unittest.TestCase):
+
+    def test_checkpoint_retention(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=6, checkpoint_interval=1, checkpoint_keep_last=2,
+                                   checkpoint_keep_best=1, checkpoint_monitor="val_loss")
+            trainer.train()
+            epochs = [c[0] for c in trainer.checkpoint_writer.checkpoints]
+            best = min(range(6), key=lambda i: trainer.history.val_loss[i]) + 1
+            self.assertEqual(sorted(epochs), sorted({5, 6, best}))
+            files = os.listdir(os.path.join(result_dir, "checkpoint"))
+            self.assertEqual(len(files), 2 * len(epochs))
+            self.assertTrue(os.path.exists(os.path.join(result_dir, "parameter.pth")))
+
+
+class ResumeTestCase(unittest.TestCase):
+
+    def test_resume(self):
+        class InterruptedLoss(nn.CrossEntropyLoss):
+
+            def __init__(self, limit):
+                super(InterruptedLoss, self).__init__()
+                self.calls = 0
+                self.limit = limit
+
+            def forward(self, outputs, labels):
+                self.calls += 1
+                if self.calls > self.limit:
+                    raise RuntimeError("interrupted")
+                return super(InterruptedLoss, self).forward(outputs, labels)
+
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=3, resume_interval=1)
+            # 3 train batches and 2 val batches every epoch, interrupted at the second batch of epoch 2.
+            trainer.criterion = InterruptedLoss(6)
+            self.assertRaises(RuntimeError, trainer.train)
+            trainer.checkpoint_writer.close()
+            self.assertTrue(os.path.exists(os.path.join(result_dir, "resume.pth")))
+
+            resumed = make_trainer(result_dir, epoch=3, resume_interval=1)
+            resumed.train()
+            self.assertEqual(resumed.history.train_loss[0], trainer.history.train_loss[0])
+            self.assertEqual(len(resumed.history.train_loss), 3)
+            self.assertEqual(resumed.train_dataset.indices, trainer.train_dataset.indices)
+            self.assertFalse(os.path.exists(os.path.join(result_dir, "resume.pth")))
+
+    def test_resume_accumulation(self):
+        class InterruptedLoss(nn.CrossEntropyLoss):
+
+            def forward(self, outputs, labels):
+                raise RuntimeError("interrupted")
+
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=1, resume_interval=1, accumulation_steps=2)
+            # 3 train batches, interrupted at the third batch after the first step is saved.
+            original = trainer._train_step
+
+            def train_step(inputs, labels, zero_grad=True, step=True):
+                if trainer.steps == 1:
+                    trainer.criterion = InterruptedLoss()
+                return original(inputs, labels, zero_grad, step)
+
+            trainer._train_step = train_step
+            self.assertRaises(RuntimeError, trainer.train)
+            trainer.checkpoint_writer.close()
+
+            resumed = make_trainer(result_dir, epoch=1, resume_interval=1, accumulation_steps=2)
+            boundaries = []
+            original_resumed = resumed._train_step
+
+            def record_step(inputs, labels, zero_grad=True, step=True):
+                boundaries.append((zero_grad, step))
+                return original_resumed(inputs, labels, zero_grad, step)
+
+            resumed._train_step = record_step
+            resumed.train()
+            # the last batch starts a new accumulation and ends the epoch.
+            self.assertEqual(boundaries, [(True, True)])
+            self.assertEqual(resumed.steps, 2)
+            self.assertEqual(resumed._SupervisedTrainer__steps, 2)
+
+
+class ValidationTestCase(unittest.TestCase):
+
+    def test_val_interval(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            actions = []
+            trainer = make_trainer(result_dir, epoch=5, val_interval=2, val_subset=10,
+                                   epoch_action=lambda *, val_acc, **kwargs: actions.append(val_acc))
+            trainer.train()
+            self.assertEqual([v is None for v in trainer.history.val_acc], [True, False, True, False, False])
+            self.assertEqual(actions, [v for v in trainer.history.val_acc if v is not None])
+            self.assertEqual(len(trainer.val_dataloader.dataset), 10)
+
+    def test_early_stopping(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=50, early_stopping=EarlyStopping("val_loss", patience=1,
+                                                                                      min_delta=10))
+            result = trainer.train()
+            self.assertEqual(result["best_epoch"], 1)
+            self.assertEqual(result["stopped_epoch"], 2)
+            self.assertEqual(len(trainer.history.val_loss), 2)
+
+
+class EvaluateTestCase(unittest.TestCase):
+
+    def test_evaluate(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=1)
+            trainer.train()
+            trainer.console_out = io.StringIO()
+            path = os.path.join(result_dir, "parameter.pth")
+            results = [trainer.test(path, make_dataset(40)) for _ in range(3)]
+            self.assertEqual(trainer.console_out.getvalue().count("load model parameters"), 1)
+            self.assertEqual(results[0], results[2])
+            self.assertEqual(results[0][2], 40)
+            self.assertTrue(trainer.model.training)
+
+
+class MicroBatchTestCase(unittest.TestCase):
+
+    def test_micro_batch(self):
+        class LimitedModel(nn.Linear):
+
+            def forward(self, inputs):
+                if inputs.size(0) > 4:
+                    raise MemoryError()
+                return super(LimitedModel, self).forward(inputs)
+
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir)
+            trainer.model = trainer.runner = LimitedModel(8, 3)
+            trainer.optimizer = torch.optim.SGD(trainer.model.parameters(), lr=0.1)
+            trainer.eval_batch_size = 4
+            trainer.val_dataloader = trainer._build_val_dataloader(trainer.val_dataset)
+            trainer.train()
+            self.assertEqual(trainer.micro_batch_size, 4)
+            self.assertEqual(len(trainer.history.train_acc), 2)
+
+    def test_micro_batch_accumulation(self):
+        class OnceLimitedModel(nn.Linear):
+
+            def __init__(self, *args):
+                super(OnceLimitedModel, self).__init__(*args)
+                self.calls = 0
+
+            def forward(self, inputs):
+                if self.training:
+                    self.calls += 1
+                    # the second batch of the first accumulation runs out of memory once.
+                    if self.calls == 2:
+                        raise MemoryError()
+                return super(OnceLimitedModel, self).forward(inputs)
+
+        def run(model_class):
+            with tempfile.TemporaryDirectory() as result_dir:
+                torch.manual_seed(0)
+                trainer = make_trainer(result_dir, epoch=1, accumulation_steps=2)
+                trainer.model = trainer.runner = model_class(8, 3)
+                trainer.optimizer = torch.optim.SGD(trainer.model.parameters(), lr=0.1)
+                torch.manual_seed(1)
+                trainer.train()
+                return trainer.model.weight.detach()
+
+        self.assertTrue(torch.allclose(run(OnceLimitedModel), run(nn.Linear), atol=1e-6))
+
+
+class MemorySavingTestCase(unittest.TestCase):
+
+    def test_memory_saving(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, accumulation_steps=2, checkpoint_modules=["body"])
+            trainer.model = Net()
+            trainer.optimizer = torch.optim.SGD(trainer.model.parameters(), lr=0.1)
+            result = trainer.train()
+            self.assertTrue(trainer.model.body._fedflow_checkpointed)
+            self.assertGreater(result["peak_memory"]["host"], 0)
+            self.assertIsNone(result["peak_memory"]["cuda"])
+
+
+class DataParallelTestCase(unittest.TestCase):
+
+    def test_data_parallel(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, world_size=2, accumulation_steps=2)
+            result = trainer.train()
+            self.assertIsNone(trainer.rank)
+            self.assertEqual(len(trainer.history.train_acc), 2)
+            self.assertIn("val_acc", result)
+            self.assertTrue(os.path.exists(os.path.join(result_dir, "parameter.pth")))
+
+    def test_data_parallel_memory_saving(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, world_size=2, checkpoint_modules=["body"])
+            trainer.model = Net()
+            trainer.optimizer = torch.optim.SGD(trainer.model.parameters(), lr=0.1)
+            path = os.path.join(result_dir, "init.pth")
+            torch.save(trainer.model.state_dict(), path)
+            # the model is prepared(and checkpointed) before it's pickled to the ranks
+            self.assertEqual(trainer.test(path, make_dataset(40))[2], 40)
+            self.assertTrue(trainer.model.body._fedflow_checkpointed)
+            trainer.train()
+            self.assertEqual(len(trainer.history.train_acc), 2)
+            self.assertTrue(os.path.exists(os.path.join(result_dir, "parameter.pth")))
+
+    def test_data_parallel_precision_metrics(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, world_size=2, precision="bf16", metrics=[TopKAccuracy(2)])
+            trainer.train()
+            with open(os.path.join(result_dir, "history.json")) as f:
+                history = json.load(f)
+            self.assertEqual(history["precision"], "bf16")
+            self.assertEqual(len(history["metrics"]["val_top2_acc"]), 2)
+
+    def test_data_parallel_early_stopping(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, world_size=2, epoch=20, val_interval=2,
+                                   early_stopping=EarlyStopping("val_loss", patience=1, min_delta=10))
+            result = trainer.train()
+            # every rank stops at the same epoch
+            self.assertEqual(result["best_epoch"], 2)
+            self.assertEqual(result["stopped_epoch"], 4)
+            self.assertEqual(len(trainer.history.val_loss), 4)
+
+    def test_data_parallel_budget_checkpoint(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, world_size=2, epoch=5, sample_budget=60, checkpoint_interval=1,
+                                   checkpoint_keep_last=1)
+            result = trainer.train()
+            self.assertTrue(result["budget_exhausted"])
+            # the budget counts the samples of all ranks, 2 ranks consume 32 samples every step.
+            self.assertGreaterEqual(result["samples"], 60)
+            self.assertLess(result["samples"], 60 + 32)
+            self.assertEqual(len(trainer.history.train_acc), 2)
+            self.assertEqual(len(os.listdir(os.path.join(result_dir, "checkpoint"))), 2)
+
+    def test_data_parallel_resume(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            self.assertRaises(ValueError, make_trainer, result_dir, world_size=2, resume_interval=1)
+
+
+class BudgetTestCase(unittest.TestCase):
+
+    def test_budget(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=5, val_interval=3, sample_budget=60)
+            result = trainer.train()
+            self.assertTrue(result["budget_exhausted"])
+            self.assertEqual(result["samples"], 61)
+            self.assertEqual(result["steps"], 4)
+            self.assertEqual(len(trainer.history.val_acc), 2)
+            self.assertIsNotNone(trainer.history.val_acc[-1])
+
+
+class QuantizedEvaluateTestCase(unittest.TestCase):
+
+    def test_quantized_evaluate(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            trainer = make_trainer(result_dir, epoch=1)
+            trainer.train()
+            path = os.path.join(result_dir, "parameter.pth")
+            report = trainer.evaluate_quantized(make_dataset(40), model_path=path, compare=True)
+            self.assertEqual(report["int8"]["total"], 40)
+            self.assertEqual(report["fp32"]["total"], 40)
+            self.assertEqual(trainer.test(path, make_dataset(40), quantize=True)[2], 40)
+            self.assertIsInstance(trainer.model.weight, nn.Parameter)
+
+
+class CompressedUpdateTestCase(unittest.TestCase):
+
+    def test_compressed_update(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            init_path = os.path.join(result_dir, "init.pth")
+            residual_path = os.path.join(result_dir, "residual.pth")
+            trainer = make_trainer(result_dir, epoch=1, update_compression="int8", error_feedback_path=residual_path)
+            torch.save(trainer.model.state_dict(), init_path)
+            trainer.init_model_path = init_path
+            result = trainer.train()
+            self.assertAlmostEqual(result["compression_ratio"], 4.0)
+            self.assertTrue(os.path.exists(residual_path))
+            decoded = load_state_dict(os.path.join(result_dir, "parameter.pth"))
+            for key, value in trainer.model.state_dict().items():
+                self.assertTrue(torch.allclose(decoded[key], value, atol=1e-2))
+
+    def test_error_feedback_rounds(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            init_path = os.path.join(result_dir, "init.pth")
+            residual_path = os.path.join(result_dir, "residual.pth")
+            residuals = []
+            for _ in range(2):
+                trainer = make_trainer(result_dir, epoch=1, update_compression="topk", topk_ratio=0.1,
+                                       error_feedback_path=residual_path)
+                if residuals:
+                    # the next round starts from the decoded parameters
+                    trainer.model.load_state_dict(load_state_dict(os.path.join(result_dir, "parameter.pth")))
+                torch.save(trainer.model.state_dict(), init_path)
+                trainer.init_model_path = init_path
+                trainer.train()
+                decoded = load_state_dict(os.path.join(result_dir, "parameter.pth"))
+                update = trainer.model.weight.detach() - torch.load(init_path)["weight"]
+                # the compression error of previous round is sent in this round
+                sent = update + residuals[-1]["weight"] if residuals else update
+                residual = torch.load(residual_path)
+                self.assertTrue(torch.allclose(decoded["weight"] - torch.load(init_path)["weight"] +
+                                               residual["weight"], sent, atol=1e-6))
+                residuals.append(residual)
+
+
+if __name__ == '__main__':
+    unittest.main()
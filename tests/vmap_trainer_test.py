@@ -0,0 +1,61 @@
+import fedflow_test
+
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+from torch.utils.data import TensorDataset
+
+from fedflow.utils.trainer import VectorizedTrainer
+
+
+def make_dataset(n=64, features=8, classes=3):
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(n, features, generator=generator)
+    y = torch.randint(0, classes, (n,), generator=generator)
+    return TensorDataset(x, y)
+
+
+class VectorizedTrainerTestCase(unittest.TestCase):
+
+    def test_train(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            model = nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 3))
+            datasets = [make_dataset(n) for n in (20, 50, 7)]
+            trainer = VectorizedTrainer(model, nn.CrossEntropyLoss(), datasets, batch_size=8, epoch=2,
+                                        console_out=open(os.devnull, "w"), result_dir=result_dir)
+            result = trainer.train()
+            self.assertEqual(result["clients"], 3)
+            self.assertEqual(result["samples"], [40, 100, 14])
+            self.assertEqual(len(trainer.histories[0]["train_loss"]), 2)
+            states = trainer.state_dicts()
+            self.assertFalse(torch.equal(states[0]["0.weight"], states[1]["0.weight"]))
+            model.load_state_dict(states[2])
+            self.assertTrue(os.path.exists(os.path.join(result_dir, "client-2.pth")))
+
+
+    def test_finished_clients(self):
+        def train(datasets):
+            torch.manual_seed(0)
+            model = nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 3))
+            trainer = VectorizedTrainer(model, nn.CrossEntropyLoss(), datasets, batch_size=8, epoch=3, seed=1,
+                                        optimizer=lambda params: torch.optim.SGD(params, lr=0.1, momentum=0.9,
+                                                                                 weight_decay=0.1),
+                                        console_out=open(os.devnull, "w"))
+            return trainer, trainer.train()
+
+        small = make_dataset(12)
+        alone, alone_result = train([small])
+        together, together_result = train([small, make_dataset(40)])
+        # the small client is masked out after its 2 batches, so it's trained as if it were alone.
+        for key, value in alone.state_dict(0).items():
+            self.assertTrue(torch.allclose(together.state_dict(0)[key], value, atol=1e-6))
+        self.assertAlmostEqual(together_result["train_loss"][0], alone_result["train_loss"][0], places=5)
+        self.assertAlmostEqual(together_result["train_acc"][0], alone_result["train_acc"][0])
+        self.assertEqual(together_result["samples"], [36, 120])
+
+
+if __name__ == '__main__':
+    unittest.main()